@@ -39,20 +39,38 @@ Include bends, hammer-ons, pull-offs.
 Type annotations.
 """
 
+from concurrent.futures import ProcessPoolExecutor
+import os.path
+import resource
+from time import perf_counter
+
 from neck_renderer import NeckRenderer
+from render_cache import RenderCache, content_key, remove_output
 from scales import append_reversed_sequence
+from voicings import chord_sequence
+
+folder = 'data'
+
+def animate(sequence, filename, bpm, cache=None):
+    """Generate images and save as animation (one frame at a time).
 
-def animate(sequence, filename, bpm):
-    """Generate images and save as animation.
+    With a cache (RenderCache), the animation is only rendered if it is not
+    there already (keyed on the sequence, BPM, format and neck images).
     
     todo:
-    Generate incrementally rather than load all images into memory.
     Change input format to array of positions and onsets, use same input to audio.
         ASCII tab?
         Flexible enough?
     """
     neck_renderer = NeckRenderer()
-    neck_renderer.animate(sequence, filename, bpm)
+    if cache is None:
+        remove_output(os.path.join(folder, filename))
+        neck_renderer.animate(sequence, filename, bpm)
+        return
+    ext = os.path.splitext(filename)[1]
+    key = content_key('animation', sequence, bpm, ext, neck_renderer.fingerprint)
+    path = cache.file('animation', key, ext, lambda filepath: neck_renderer.animate(sequence, filepath, bpm))
+    cache.export(path, os.path.join(folder, filename))
 
 def pentatonic():
     """Minor pentatonic shape."""
@@ -75,7 +93,7 @@ def pentatonic():
     sequence = append_reversed_sequence(pentatonic_ascending)
     bpm = 120
     filename = f'pentatonic-bpm={bpm:d}.gif'
-    animate(sequence, filename, bpm)
+    animate(sequence, filename, bpm, cache=RenderCache())
 
 def when_the_sun_goes_down():
     """Arctic Monkeys: don't believe the hype! ;)"""
@@ -90,10 +108,17 @@ def when_the_sun_goes_down():
     sequence = [B, D_SHARP_7, E_MAJOR_7, D_SHARP_MINOR, E_MAJOR_7, D_SHARP_MINOR, C_SHARP_MINOR, F_SHARP_7, E_7, D_SHARP_MINOR, C_SHARP_MINOR, D_SHARP_MINOR]
     filename = 'When the Sun Goes Down.gif'
     bpm = 120/4
-    animate(sequence, filename, bpm)
+    animate(sequence, filename, bpm, cache=RenderCache())
 
-def arpeggios():
-    # Arpeggios over two octaves in the key of D (D E F# G A B C#).
+def chord_progression():
+    """I V vi IV in D, voicings looked up in the index (no open strings: see todo)."""
+    sequence = chord_sequence(['D', 'A', 'Bm', 'G'], open_strings=False)
+    filename = 'I V vi IV in D.gif'
+    bpm = 60/4
+    animate(sequence, filename, bpm, cache=RenderCache())
+
+def arpeggios_in_d():
+    """Arpeggios over two octaves in the key of D (D E F# G A B C#): 48 steps."""
     # todo: show shape for current arpeggio then highlight each note within it.
     # todo: generate these given the key.
     # todo: generate in all keys.
@@ -155,14 +180,42 @@ def arpeggios():
         [(6, 14)],
         [(6, 17)],
     ]
+    return sequence
+
+def arpeggios():
+    sequence = arpeggios_in_d()
     bpm = 60
     filename = 'Arpeggios over two octaves in D.gif'
-    animate(sequence, filename, bpm)
+    animate(sequence, filename, bpm, cache=RenderCache())
+
+def _render_and_measure(streaming):
+    """Render the arpeggios animation, return (seconds, peak RSS [MB]) of this process."""
+    neck_renderer = NeckRenderer()
+    sequence = arpeggios_in_d()
+    start = perf_counter()
+    if streaming:
+        neck_renderer.animate(sequence, 'benchmark-streaming.gif', bpm=60)
+    else:
+        neck_renderer.animate_in_memory(sequence, 'benchmark-in-memory.gif', bpm=60)
+    elapsed = perf_counter() - start
+    return elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024
+
+def benchmark_animate():
+    """Peak RSS: all images in memory then PIL GIF vs. streamed frames (48-step arpeggios).
+
+    Each approach runs in a fresh process so the peaks are independent.
+    """
+    for streaming, name in [(False, 'in memory'), (True, 'streaming')]:
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            elapsed, peak_rss = executor.submit(_render_and_measure, streaming).result()
+        print(f'{name:>10}: {elapsed:6.2f} s, peak RSS {peak_rss:7.1f} MB')
 
 def main():
     pentatonic()
     # when_the_sun_goes_down()
+    # chord_progression()
     # arpeggios()
+    # benchmark_animate()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,157 @@
+"""
+audio_stream.py
+
+Render audio block by block instead of as one array the length of the piece.
+
+Voices are synthesised just before their onset and added into a ring buffer
+only as long as the longest note, fixed-size blocks are read out of it in
+order, and each block is written straight to the WAV file. Peak memory
+depends on the longest note, not on the length of the piece.
+
+todo:
+Stereo (interleave channels in WavWriter)?
+"""
+
+import struct
+
+import numpy as np
+
+from karplus_strong import fs, karplus_strong_batch
+
+BLOCK_SIZE = 4096  # Samples per block.
+
+
+class WavWriter:
+    """Write a mono 32-bit float WAV file in blocks (same format as scipy.io.wavfile.write).
+
+    The header is written with placeholder sizes and patched on close.
+    """
+    def __init__(self, filepath, sample_rate):
+        self._file = open(filepath, 'wb')
+        self._sample_rate = sample_rate
+        self.num_samples = 0
+        self._write_header()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, block):
+        data = np.asarray(block, dtype='<f4')
+        self._file.write(data.tobytes())
+        self.num_samples += len(data)
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._file.seek(0)
+        self._write_header()
+        self._file.close()
+
+    def _write_header(self):
+        bytes_per_sample = 4
+        data_size = self.num_samples*bytes_per_sample
+        fmt = struct.pack(
+            '<HHIIHHH',
+            3,  # IEEE float.
+            1,  # Channels.
+            self._sample_rate,
+            self._sample_rate*bytes_per_sample,  # Byte rate.
+            bytes_per_sample,  # Block align.
+            8*bytes_per_sample,  # Bits per sample.
+            0  # Extension size.
+        )
+        fact = struct.pack('<I', self.num_samples)
+        riff_size = 4 + (8 + len(fmt)) + (8 + len(fact)) + (8 + data_size)
+        self._file.write(b'RIFF' + struct.pack('<I', riff_size) + b'WAVE')
+        self._file.write(b'fmt ' + struct.pack('<I', len(fmt)) + fmt)
+        self._file.write(b'fact' + struct.pack('<I', len(fact)) + fact)
+        self._file.write(b'data' + struct.pack('<I', data_size))
+
+
+class RingMixer:
+    """Ring buffer that voices are added into and blocks are read out of, in order.
+
+    capacity must cover the longest voice plus one block: a voice can only be
+    added if it ends within capacity samples of the read position.
+    """
+    def __init__(self, capacity):
+        self._buffer = np.zeros(capacity, dtype=np.float32)
+        self.position = 0  # Sample index (from the start of the piece) of the next read.
+
+    @property
+    def capacity(self):
+        return len(self._buffer)
+
+    def add(self, signal, start):
+        """Add signal into the mix, starting at sample index start."""
+        if start < self.position:
+            raise ValueError(f'Cannot add at sample {start}: already read up to {self.position}.')
+        if start + len(signal) > self.position + self.capacity:
+            raise ValueError(f'Voice of {len(signal)} samples at {start} does not fit in the ring buffer.')
+        offset = start % self.capacity
+        first = min(len(signal), self.capacity - offset)
+        self._buffer[offset:offset + first] += signal[:first]
+        self._buffer[:len(signal) - first] += signal[first:]
+
+    def read(self, num_samples):
+        """Return the next num_samples of the mix (and clear them for reuse)."""
+        offset = self.position % self.capacity
+        indices = (offset + np.arange(num_samples)) % self.capacity
+        block = self._buffer[indices]
+        self._buffer[indices] = 0
+        self.position += num_samples
+        return block
+
+
+def stream_blocks(frequencies, starts, lengths, num_samples, smoothing_factor=0.5, threshold=None, block_size=BLOCK_SIZE, cache=None, seed=0, gains=None):
+    """Yield the mix of all voices, block_size samples at a time (the last may be shorter).
+
+    Voices (one per frequency, starting at sample starts[i] and lasting at
+    most lengths[i] samples) are synthesised in one batch per block, when
+    their onset falls in that block. With a cache (SampleCache), buffers come
+    from the cache instead, all plucked with the given seed. gains (one per
+    voice, default 1) scale each voice as it is mixed.
+    """
+    frequencies = np.asarray(frequencies, dtype=float)
+    starts = np.asarray(starts, dtype=int)
+    lengths = np.broadcast_to(np.asarray(lengths, dtype=int), starts.shape)
+    gains = np.broadcast_to(np.asarray(1 if gains is None else gains, dtype=np.float32), starts.shape)
+    order = np.argsort(starts, kind='stable')
+    frequencies, starts, lengths, gains = frequencies[order], starts[order], lengths[order], gains[order]
+
+    longest = int(lengths.max()) if len(lengths) else 0
+    mixer = RingMixer(longest + block_size)
+    next_voice = 0
+    for block_start in range(0, num_samples, block_size):
+        block_stop = min(block_start + block_size, num_samples)
+
+        # Synthesise every voice that starts in this block.
+        first_voice = next_voice
+        while (next_voice < len(starts)) and (starts[next_voice] < block_stop):
+            next_voice += 1
+        if next_voice > first_voice:
+            voices = slice(first_voice, next_voice)
+            if cache is not None:
+                buffers = cache.get_many(frequencies[voices], smoothing_factor, lengths[voices]/fs, seed, threshold)
+            else:
+                signals, voice_lengths = karplus_strong_batch(frequencies[voices], lengths[voices], smoothing_factor, threshold=threshold)
+                buffers = [signal[:length] for signal, length in zip(signals, voice_lengths)]
+            for buffer, start, length, gain in zip(buffers, starts[voices], lengths[voices], gains[voices]):
+                buffer = buffer[:min(length, num_samples - start)]
+                mixer.add(buffer if gain == 1 else gain*buffer, start)
+
+        yield mixer.read(block_stop - block_start)
+
+
+def stream_to_wav(blocks, filepath, sample_rate):
+    """Write blocks (any iterable of 1-D arrays) to a WAV file as they arrive.
+
+    Returns the number of samples written.
+    """
+    with WavWriter(filepath, sample_rate) as writer:
+        for block in blocks:
+            writer.write(block)
+    return writer.num_samples
@@ -0,0 +1,218 @@
+"""
+batch_render.py
+
+Render the catalogue of scale videos (scale types x roots x BPMs) on a
+process pool, one output folder per job, with a timing report per job.
+
+Within a job, audio is synthesised on a background thread while the frames
+are rendered, then both go straight to the encoder. Across jobs, every core
+is kept busy: while one worker is encoding, others are synthesising or
+rendering.
+
+With a render cache (cache_folder, see render_cache.py), shared by the
+workers, a job whose inputs have not changed only exports its video from the
+cache, and one whose tempo changed re-renders its audio and video but
+reuses its frames. Each report lists the stages found in the cache.
+"""
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import json
+import os
+import os.path
+from time import perf_counter
+import traceback
+from typing import List, NamedTuple, Optional, Tuple
+
+from chroma import Chroma
+from create_video import get_stage_keys, make_video_clip, pluck_seeded, positions_to_frequencies, render_frames
+from generate_audio import bpm_to_onsets, fs
+from neck_renderer import NeckRenderer
+from render_cache import RenderCache, remove_output
+from sample_cache import SampleCache
+from scales import ScaleType, append_reversed_sequence, scale_box_positions
+
+output_root = os.path.join('data', 'catalogue')
+report_filename = 'report.json'
+
+# Per worker process: pitches repeat across jobs, so keep them.
+_sample_cache = SampleCache()
+_render_caches = {}  # By folder.
+
+
+class RenderJob(NamedTuple):
+    scale_type: ScaleType
+    root: Chroma
+    bpm: int
+    output_folder: str
+    cache_folder: Optional[str] = None  # RenderCache folder (None: render everything).
+    cache_max_bytes: int = 2*1024**3
+
+    @property
+    def name(self):
+        return f'{self.root.name} {self.scale_type.name.lower()} BPM={self.bpm}'
+
+
+class JobReport(NamedTuple):
+    """Where one job's time went [s]."""
+    name: str
+    output_folder: str
+    audio_seconds: float
+    frames_seconds: float
+    video_seconds: float
+    total_seconds: float
+    bytes_written: int
+    error: Optional[str] = None
+    cached: Tuple[str, ...] = ()  # Stages found in the render cache.
+
+
+def expand_jobs(scale_types, roots, bpms, output_root=output_root, cache_folder=None, cache_max_bytes=2*1024**3) -> List[RenderJob]:
+    """One job per (scale type, root, BPM), each with its own output folder."""
+    jobs = []
+    for scale_type in scale_types:
+        for root in roots:
+            for bpm in bpms:
+                folder = os.path.join(output_root, f'{scale_type.name.lower()}-{root.name}-bpm={bpm}')
+                jobs.append(RenderJob(scale_type, root, bpm, folder, cache_folder, cache_max_bytes))
+    return jobs
+
+
+def _get_render_cache(job):
+    """This worker's RenderCache for the job's cache folder (None if it has none)."""
+    if job.cache_folder is None:
+        return None
+    if job.cache_folder not in _render_caches:
+        _render_caches[job.cache_folder] = RenderCache(job.cache_folder, job.cache_max_bytes)
+    return _render_caches[job.cache_folder]
+
+
+def _timed(function, *args, **kwargs):
+    start = perf_counter()
+    result = function(*args, **kwargs)
+    return result, perf_counter() - start
+
+
+def run_job(job: RenderJob) -> JobReport:
+    """Render one scale (ascending and descending) to a video in the job's folder."""
+    start = perf_counter()
+    try:
+        os.makedirs(job.output_folder, exist_ok=True)
+        positions = append_reversed_sequence(scale_box_positions(job.scale_type, job.root))
+        frequencies = positions_to_frequencies(positions)
+        onsets = bpm_to_onsets(job.bpm, len(positions))
+        neck_renderer = NeckRenderer()
+        fps = 25
+        cache = _get_render_cache(job)
+        keys = get_stage_keys(positions, frequencies, onsets, fps, neck_renderer)
+        seconds = {'audio': 0.0, 'frames': 0.0, 'video': 0.0}
+
+        def cached(stage, compute):
+            return compute() if cache is None else cache.array(stage, getattr(keys, stage), compute)
+
+        def write_video(filepath):
+            # Synthesise audio in the background while the frames are rendered.
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                audio_future = executor.submit(_timed, cached, 'audio', lambda: pluck_seeded(frequencies, onsets, sample_cache=_sample_cache))
+                frames, seconds['frames'] = _timed(cached, 'frames', lambda: render_frames(positions, neck_renderer))
+                audio, seconds['audio'] = audio_future.result()
+
+            # Encode (one ffmpeg thread: the pool already uses every core).
+            video_start = perf_counter()
+            video = make_video_clip(positions, audio, onsets, frames=frames)
+            video.write_videofile(
+                filepath,
+                fps=fps,
+                audio_fps=fs,
+                threads=1,
+                temp_audiofile=os.path.join(job.output_folder, 'tmp-audio.ogg'),
+                logger=None
+            )
+            seconds['video'] = perf_counter() - video_start
+
+        filepath = os.path.join(job.output_folder, job.name + '.webm')
+        cached_stages = ()
+        if cache is None:
+            remove_output(filepath)
+            write_video(filepath)
+        else:
+            hits = cache.hits.copy()
+            cache.export(cache.file('video', keys.video, '.webm', write_video), filepath)
+            cached_stages = tuple(stage for stage in keys._fields if cache.hits[stage] > hits[stage])
+
+        return JobReport(
+            job.name, job.output_folder, seconds['audio'], seconds['frames'], seconds['video'],
+            perf_counter() - start, os.path.getsize(filepath), cached=cached_stages
+        )
+    except Exception:
+        return JobReport(job.name, job.output_folder, 0, 0, 0, perf_counter() - start, 0, traceback.format_exc())
+
+
+def run_jobs(jobs, max_workers=None) -> List[JobReport]:
+    """Run jobs on a process pool (default: one worker per core), in completion order."""
+    reports = []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(run_job, job) for job in jobs]
+        for i, future in enumerate(as_completed(futures)):
+            report = future.result()
+            reports.append(report)
+            status = 'FAILED' if report.error else f'{report.total_seconds:.1f} s'
+            print(f'[{i + 1}/{len(jobs)}] {report.name}: {status}')
+    return reports
+
+
+def write_report(reports, filepath):
+    """Save per-job timings as JSON and print a summary table."""
+    with open(filepath, 'w') as file:
+        json.dump([report._asdict() for report in reports], file, indent=2)
+
+    print(f'{"job":<36} {"audio":>7} {"frames":>7} {"video":>7} {"total":>7} {"MB":>6}  cached')
+    for report in sorted(reports, key=lambda r: r.name):
+        if report.error:
+            print(f'{report.name:<36} FAILED: {report.error.splitlines()[-1]}')
+        else:
+            print(f'{report.name:<36} {report.audio_seconds:7.2f} {report.frames_seconds:7.2f} {report.video_seconds:7.2f} {report.total_seconds:7.2f} {report.bytes_written/1e6:6.2f}  {", ".join(report.cached)}')
+    failures = sum(1 for report in reports if report.error)
+    unchanged = sum(1 for report in reports if 'video' in report.cached)
+    print(f'{len(reports) - failures - unchanged} videos rendered, {unchanged} unchanged (from the cache), {failures} failed. Report: {filepath}')
+
+
+def render_catalogue(scale_types=tuple(ScaleType), roots=tuple(Chroma), bpms=(60, 80, 100), output_root=output_root, max_workers=None, cache_folder=None, cache_max_bytes=2*1024**3):
+    """Render every scale type x root x BPM, then write the timing report.
+
+    With a cache_folder, unchanged videos are not rendered again (see module docstring).
+    """
+    jobs = expand_jobs(scale_types, roots, bpms, output_root, cache_folder, cache_max_bytes)
+    start = perf_counter()
+    reports = run_jobs(jobs, max_workers)
+    os.makedirs(output_root, exist_ok=True)
+    write_report(reports, os.path.join(output_root, report_filename))
+    print(f'Wall clock: {perf_counter() - start:.1f} s')
+    return reports
+
+
+def benchmark_cache(scale_types=(ScaleType.MINOR_PENTATONIC,), roots=(Chroma.A, Chroma.E), bpms=(80, 100), new_bpms=(80, 120), max_workers=2):
+    """Wall clock of a small catalogue: from an empty render cache, again unchanged, then with one BPM changed.
+
+    The last run should only render the videos at the new BPM, from cached frames.
+    """
+    cache_folder = os.path.join('data', 'benchmark-cache')
+    RenderCache(cache_folder).clear()
+    output = os.path.join('data', 'benchmark-catalogue')
+    runs = [('empty cache', bpms), ('unchanged', bpms), ('one BPM changed', new_bpms)]
+    results = []
+    for label, run_bpms in runs:
+        print(f'--- {label}: BPMs {run_bpms} ---')
+        start = perf_counter()
+        reports = render_catalogue(scale_types, roots, run_bpms, output, max_workers, cache_folder)
+        rendered = sum(1 for report in reports if 'video' not in report.cached)
+        results.append((label, perf_counter() - start, rendered, len(reports)))
+    print(f'Cache: {RenderCache(cache_folder).num_bytes/1e6:.1f} MB')
+    for label, seconds, rendered, num_jobs in results:
+        print(f'{label:<16} {seconds:6.1f} s, {rendered}/{num_jobs} videos rendered')
+
+
+def main():
+    benchmark_cache()
+
+
+if __name__ == '__main__':
+    main()
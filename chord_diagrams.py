@@ -12,8 +12,20 @@ SVG?
 What existing solutions? Lilypond? Don't think so.
 """
 
+from voicings import VoicingIndex, voicing_to_string
+
+lesson_chords = ['C', 'G', 'D', 'A', 'E', 'B7', 'D7', 'A7', 'Am', 'Dm', 'Em', 'F', 'Am7']
+
+def print_chords(names, index=None, num_voicings=3):
+    """Print the first few voicings (lowest on the neck) of each chord, as chord strings."""
+    if index is None:
+        index = VoicingIndex()
+    for name in names:
+        voicings = index.get_by_name(name)
+        print(f'{name:<5} {", ".join(voicing_to_string(voicing) for voicing in voicings[:num_voicings])}')
+
 def main():
-    pass
+    print_chords(lesson_chords)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
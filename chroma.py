@@ -24,3 +24,4 @@ class Chroma(Enum):
 
 chroma_list = list(Chroma)
 len_chroma = len(chroma_list)
+chroma_to_index = {chroma: i for i, chroma in enumerate(chroma_list)}
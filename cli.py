@@ -19,8 +19,19 @@ todo:
 """
 
 import argparse
-from enum import Enum
 import logging
+import os
+
+from batch_render import render_catalogue
+from chroma import Chroma
+from generate_audio import bpm_to_onsets, fs, stream_timeline
+from metronome import ClickTrack
+from neck_renderer import NeckRenderer
+from playback import BLOCK_SIZE, QUEUE_BLOCKS, play_timeline
+import profiling
+from scales import ScaleType, append_reversed_sequence, scale_box_positions
+from timeline import Timeline
+from video_renderer import render_video
 
 
 logger = logging.getLogger(__name__)
@@ -28,33 +39,49 @@ logger.setLevel(logging.INFO)
 handler = logging.StreamHandler()
 logger.addHandler(handler)
 
-class ScaleType(Enum):
-    MAJOR = 1
-    MINOR = 2
-
+def make_video(scale_type, root, bpm, fileroot=None, fps=30, click=False):
+    """Scale video (mp4, with audio) from one timeline: picture and sound cannot drift apart.
 
-def make_video(scale_type, root, bpm):
+    With click, a click track on every note (accented every 4) is mixed in.
+    """
     midi = make_midi(scale_type, root, bpm)
-    make_animation(midi)
-    make_audio(midi)
+    if fileroot is None:
+        fileroot = f'{root.name} {scale_type.name.lower()} BPM={bpm}'
+    click_track = make_click_track(midi, bpm) if click else None
+    report = render_video(midi, fileroot + '.mp4', fps, click_track=click_track)
+    logger.info(report)
 
 
 def make_midi(scale_type, root, bpm):
-    pass
+    """Timeline of the scale (one box shape, ascending then descending) at the given tempo."""
+    positions = append_reversed_sequence(scale_box_positions(scale_type, root))
+    onsets = bpm_to_onsets(bpm, len(positions))/1000
+    return Timeline.from_steps(positions, onsets)
 
 
-def make_animation(midi):
-    # for time, notes in midi:
-    # make_animation_frame(notes)
-    pass
+def make_click_track(midi, bpm):
+    """Click track from the first onset of midi to its end, at bpm."""
+    start = round(float(midi.onsets[0])*fs) if len(midi) else 0
+    num_beats = int(round((midi.end - midi.onsets[0])*bpm/60)) if len(midi) else 0
+    return ClickTrack(bpm, start=start, num_beats=num_beats)
 
 
-def make_audio(midi):
-    pass
+def make_animation(midi, filename='tmp.gif', fps=10):
+    NeckRenderer().animate_timeline(midi, filename, fps)
 
 
-def make_animation_frame(time):
-    pass
+def play_audio(midi, block_size=None, queue_blocks=None):
+    """Play the timeline through aplay as it is synthesised (no WAV file first); None: playback's defaults."""
+    return play_timeline(midi, block_size=block_size or BLOCK_SIZE, queue_blocks=queue_blocks or QUEUE_BLOCKS)
+
+
+def make_audio(midi, filename='tmp.wav'):
+    return stream_timeline(midi, filename)
+
+
+def make_animation_frame(midi, time, neck_renderer):
+    """Frame (RGB array) showing the notes sounding at time [s]."""
+    return neck_renderer.get_frame(midi.positions_at(time))
 
 
 def synthesise_piano_audio(midi):
@@ -65,6 +92,29 @@ def synthesise_guitar_audio(midi):
     pass
 
 
+def run(args):
+    """Do what the command line arguments ask (see main)."""
+    if args.catalogue:
+        scale_types = [ScaleType(int(args.scale))] if args.scale else list(ScaleType)
+        roots = [Chroma[args.root]] if args.root else list(Chroma)
+        cache_folder = None if args.no_cache else args.cache
+        render_catalogue(scale_types, roots, args.bpms, args.output, args.workers, cache_folder, args.cache_mb*1024**2)
+        return
+
+    bpm = int(args.bpm)
+    root = Chroma[args.root]  # TODO: validate
+    scale_type = ScaleType(int(args.scale))
+    
+    logger.info(f'BPM: {bpm}')
+    logger.info(f'Root note: {root}')
+    logger.info(f'Scale type: {scale_type}')
+
+    if args.play:
+        logger.info(play_audio(make_midi(scale_type, root, bpm), args.block_size, args.queue_blocks))
+        return
+    make_video(scale_type, root, bpm, click=args.click)
+
+
 def main():
     logger.info("One day this will be a CLI!")
 
@@ -76,17 +126,33 @@ def main():
     parser.add_argument('-b', '--bpm', help='Tempo in beats per minute')
     parser.add_argument('-r', '--root', help='Scale root note')
     parser.add_argument('-s', '--scale', help='Scale type: major or minor.')
+    parser.add_argument('--click', action='store_true', help='Mix a click track into the audio.')
+    parser.add_argument('--play', action='store_true', help='Play the scale now (aplay) instead of making a video.')
+    parser.add_argument('--block-size', type=int, help='Samples per block for --play (default 1024).')
+    parser.add_argument('--queue-blocks', type=int,
+        help='Blocks rendered ahead for --play (default 4): latency is about block size x queue blocks.')
+    parser.add_argument('--catalogue', action='store_true',
+        help='Render every scale type x root x BPM (--bpms) on a process pool; -s and -r narrow it down.')
+    parser.add_argument('--bpms', type=int, nargs='+', default=[60, 80, 100], help='Tempos for --catalogue.')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Worker processes for --catalogue.')
+    parser.add_argument('--output', default=os.path.join('data', 'catalogue'), help='Output folder for --catalogue.')
+    parser.add_argument('--cache', default=os.path.join('data', 'cache'),
+        help='Render cache for --catalogue: unchanged videos are not rendered again.')
+    parser.add_argument('--cache-mb', type=int, default=2048, help='Size cap of the render cache (least recently used evicted first).')
+    parser.add_argument('--no-cache', action='store_true', help='Render every video of --catalogue from scratch.')
+    parser.add_argument('--profile', nargs='?', const=os.path.join('data', 'trace.json'), metavar='TRACE',
+        help='Time each stage: print a summary and write a Chrome trace (default data/trace.json). Not inside --catalogue workers.')
 
     args = parser.parse_args()
-    bpm = args.bpm
-    root = args.root  # TODO: validate
-    scale_type = ScaleType(int(args.scale))
-    
-    logger.info(f'BPM: {bpm}')
-    logger.info(f'Root note: {root}')
-    logger.info(f'Scale type: {scale_type}')
 
-    make_video(scale_type, root, bpm)
+    if args.profile:
+        profiling.enable()
+        try:
+            run(args)
+        finally:
+            profiling.finish(args.profile)
+    else:
+        run(args)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,146 @@
+"""
+conversions.py
+
+Vectorized conversion between MIDI note number, note (chroma and octave),
+piano key number and frequency, backed by lookup tables over the whole MIDI
+range (0 to 127). Each function takes a whole array (or list) at once; see
+notes.py for the scalar equivalents.
+
+Frequencies use equal temperament relative to A4, 440 Hz by default; pass
+a4_frequency for other reference pitches (e.g. 432, or 415 for baroque pitch).
+
+todo:
+Other tuning systems (just intonation etc.) as alternative frequency tables.
+"""
+
+from functools import lru_cache
+from time import perf_counter
+
+import numpy as np
+
+from chroma import chroma_list, chroma_to_index, len_chroma
+from notes import A4_FREQUENCY, MIDI_A4, MIDI_MAX, MIDI_MIN, PIANO_MAX, PIANO_MIN, Note, midi_to_frequency, midi_to_note, note_to_midi
+
+MIDI_NUMBERS = np.arange(MIDI_MIN, MIDI_MAX)
+_chroma_objects = np.empty(len_chroma, dtype=object)
+_chroma_objects[:] = chroma_list
+_chroma_table = _chroma_objects[MIDI_NUMBERS % len_chroma]
+_octave_table = MIDI_NUMBERS//len_chroma - 1
+_midi_to_piano_offset = 20  # Piano key 1 is A0 (MIDI 21).
+
+
+@lru_cache(maxsize=None)
+def get_frequency_table(a4_frequency=A4_FREQUENCY):
+    """Frequency [Hz] of every MIDI note number, for the given reference pitch."""
+    table = a4_frequency*2**((MIDI_NUMBERS - MIDI_A4)/len_chroma)
+    table.setflags(write=False)
+    return table
+
+
+def _as_midis(midis):
+    midis = np.asarray(midis)
+    if not np.issubdtype(midis.dtype, np.integer):
+        raise TypeError('MIDI note numbers must be integers.')
+    if midis.size and ((midis.min() < MIDI_MIN) or (midis.max() >= MIDI_MAX)):
+        raise ValueError(f'MIDI note numbers must be in the range [{MIDI_MIN}, {MIDI_MAX - 1}].')
+    return midis
+
+
+def midis_to_frequencies(midis, a4_frequency=A4_FREQUENCY):
+    """Convert MIDI note numbers to frequencies [Hz]."""
+    return get_frequency_table(a4_frequency)[_as_midis(midis)]
+
+
+def midis_to_chromas(midis):
+    """Convert MIDI note numbers to chromas (object array of Chroma)."""
+    return _chroma_table[_as_midis(midis)]
+
+
+def midis_to_octaves(midis):
+    """Convert MIDI note numbers to octaves (C4 is middle C)."""
+    return _octave_table[_as_midis(midis)]
+
+
+def midis_to_notes(midis):
+    """Convert MIDI note numbers to a list of Notes."""
+    midis = _as_midis(midis)
+    return [Note(chroma, int(octave)) for chroma, octave in zip(_chroma_table[midis], _octave_table[midis])]
+
+
+def midis_to_pianos(midis):
+    """Convert MIDI note numbers to piano key numbers."""
+    midis = _as_midis(midis)
+    pianos = midis - _midi_to_piano_offset
+    if pianos.size and ((pianos.min() < PIANO_MIN) or (pianos.max() > PIANO_MAX)):
+        raise ValueError(f'MIDI note numbers must be in the range [{PIANO_MIN + _midi_to_piano_offset}, {PIANO_MAX + _midi_to_piano_offset}].')
+    return pianos
+
+
+def pianos_to_midis(pianos):
+    """Convert piano key numbers to MIDI note numbers."""
+    pianos = np.asarray(pianos)
+    if pianos.size and ((pianos.min() < PIANO_MIN) or (pianos.max() > PIANO_MAX)):
+        raise ValueError(f'Piano key numbers must be in the range [{PIANO_MIN}, {PIANO_MAX}].')
+    return pianos + _midi_to_piano_offset
+
+
+def chromas_to_indices(chromas):
+    """Index of each chroma in chroma_list (C is 0).
+
+    Chromas may already be indices (integers), which are returned as they
+    are: only Chroma objects need converting one by one.
+    """
+    chromas = np.asarray(chromas)
+    if np.issubdtype(chromas.dtype, np.integer):
+        if chromas.size and ((chromas.min() < 0) or (chromas.max() >= len_chroma)):
+            raise ValueError(f'Chroma indices must be in the range [0, {len_chroma - 1}].')
+        return chromas
+    chromas = chromas.ravel().tolist()
+    return np.fromiter(map(chroma_to_index.__getitem__, chromas), dtype=int, count=len(chromas))
+
+
+def notes_to_midis(chromas, octaves):
+    """Convert notes (sequences of chromas or chroma indices, and octaves) to MIDI note numbers."""
+    midis = (np.asarray(octaves) + 1)*len_chroma + chromas_to_indices(chromas)
+    return _as_midis(midis)
+
+
+def notes_to_frequencies(chromas, octaves, a4_frequency=A4_FREQUENCY):
+    """Convert notes (sequences of chromas and octaves) to frequencies [Hz]."""
+    return midis_to_frequencies(notes_to_midis(chromas, octaves), a4_frequency)
+
+
+def benchmark(num_conversions=1_000_000):
+    """Milliseconds per million conversions: scalar functions in notes.py vs. these."""
+    rng = np.random.default_rng(0)
+    midis = rng.integers(MIDI_MIN, MIDI_MAX, num_conversions)
+    midi_list = midis.tolist()
+    chromas = midis_to_chromas(midis)
+    octaves = midis_to_octaves(midis)
+    chroma_indices = chromas_to_indices(chromas)
+    notes = list(zip(chromas, octaves.tolist()))
+
+    cases = [
+        ('MIDI -> frequency', lambda: [midi_to_frequency(m) for m in midi_list], lambda: midis_to_frequencies(midis)),
+        ('MIDI -> note', lambda: [midi_to_note(m) for m in midi_list], lambda: (midis_to_chromas(midis), midis_to_octaves(midis))),
+        ('note -> MIDI', lambda: [note_to_midi(c, o) for c, o in notes], lambda: notes_to_midis(chromas, octaves)),
+        ('(index) -> MIDI', lambda: [note_to_midi(c, o) for c, o in notes], lambda: notes_to_midis(chroma_indices, octaves)),
+    ]
+    scale = 1e3*1_000_000/num_conversions
+    print(f'{"conversion":<20} {"scalar [ms]":>12} {"vector [ms]":>12} {"speedup":>8}')
+    for name, scalar, vector in cases:
+        start = perf_counter()
+        scalar()
+        scalar_time = perf_counter() - start
+        start = perf_counter()
+        vector()
+        vector_time = perf_counter() - start
+        print(f'{name:<20} {scalar_time*scale:12.1f} {vector_time*scale:12.1f} {scalar_time/vector_time:7.0f}x')
+
+
+def main():
+    benchmark()
+
+
+if __name__ == '__main__':
+    main()
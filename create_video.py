@@ -9,25 +9,36 @@ Create videos for all major, minor and pentatonic scales.
     Shift to root note (do for all).
     
 Read docs: https://zulko.github.io/moviepy/getting_started/videoclips.html
-Better to compose synchronised frames (functions of time) rather than combine existing files?
-    AudioArrayClip: directly from array (no intermediate file).
-Just add images at specified times.
 Draw the desired end result as a guide: musical score, tab and fretboard stacked vertically.
     Piano variant without the tablature.
 """
 
 import os.path
+from time import perf_counter
+from typing import NamedTuple
 
 import moviepy.editor as mpy
+from moviepy.audio.AudioClip import AudioArrayClip
+import numpy as np
 
 from animations import animate
-from generate_audio import bpm_to_onsets, pluck_strings, save_wav
+from fretboard import FretboardPosition
+from generate_audio import bpm_to_onsets, fs, pluck_strings, save_wav
+from karplus_strong import AUDIBILITY_THRESHOLD, SYNTHESIS_VERSION
 from guitar_tuning import GuitarTuning
+from neck_renderer import NeckRenderer
 from notes import note_to_frequency
+from profiling import span
+from render_cache import RenderCache, content_key, remove_output
+from sample_cache import SampleCache
 from scales import append_reversed_sequence
 
 folder = 'data'
 
+# Audio settings for pluck_seeded, all in its render cache key.
+note_duration = 2000  # [ms] Each note rings this long at most.
+smoothing_factor = 0.5  # Karplus-Strong (SampleCache's default).
+
 def get_filepath(filename):
     """Prepend folder name.
     
@@ -36,39 +47,193 @@ def get_filepath(filename):
 
 def combine_existing_files(filename_video, filename_audio, filename_output):
     """Combine animation and audio into a video."""
-    animation = mpy.VideoFileClip(get_filepath(filename_video))
-    audio = mpy.AudioFileClip(get_filepath(filename_audio))
-    video = animation.set_audio(audio)  # Returns a new video clip!
-    video.write_videofile(get_filepath(filename_output))
+    with span('combine_existing_files', filename=filename_output):
+        with span('decode'):
+            animation = mpy.VideoFileClip(get_filepath(filename_video))
+            audio = mpy.AudioFileClip(get_filepath(filename_audio))
+        video = animation.set_audio(audio)  # Returns a new video clip!
+        encode_video(video, get_filepath(filename_output))
+
+class VideoReport(NamedTuple):
+    """Cost of creating one video."""
+    filename: str
+    seconds: float
+    bytes_written: int  # Video plus any intermediate files.
+
+    def __str__(self):
+        return f'{self.filename}: {self.seconds:.2f} s, {self.bytes_written/1e6:.2f} MB written'
+
+def encode_video(video, filepath, **kwargs):
+    """video.write_videofile(filepath, **kwargs), traced as the encode stage (frames counted)."""
+    remove_output(filepath)
+    with span('encode', filename=os.path.basename(filepath)) as stage:
+        video.write_videofile(filepath, **kwargs)
+        stage.count('frames', int(round(video.duration*(kwargs.get('fps') or getattr(video, 'fps', None) or 0))))
+
+def positions_to_frequencies(positions, tuning=None):
+    """Convert each step (list of (string, fret)) to a list of frequencies (a chord if several)."""
+    if tuning is None:
+        tuning = GuitarTuning()
+    return [
+        [note_to_frequency(*tuning.position_to_note(FretboardPosition(*position))) for position in step]
+        for step in positions
+    ]
+
+class StageKeys(NamedTuple):
+    """Content keys (see render_cache.py) of each stage of a video."""
+    audio: str
+    frames: str
+    video: str
+
+def pluck_seeded(frequencies, onsets, seed=0, sample_cache=None):
+    """Audio for frequencies at onsets [ms], every note plucked from seed (through sample_cache, or a new SampleCache).
+
+    The same inputs always give the same audio, as get_stage_keys' audio key
+    assumes: use this for any audio cached under that key.
+    """
+    if sample_cache is None:
+        sample_cache = SampleCache()
+    return pluck_strings(frequencies, onsets, note_duration, AUDIBILITY_THRESHOLD, cache=sample_cache, seed=seed, plot=False)
+
+def get_stage_keys(positions, frequencies, onsets, fps, neck_renderer, ext='.webm', seed=0):
+    """Keys of the audio (pluck_seeded), the frames (positions) and the video made from both.
+
+    A new tempo changes the audio and video keys, not the frames key.
+    """
+    audio = content_key(
+        'audio', frequencies, onsets, fs, note_duration, AUDIBILITY_THRESHOLD, smoothing_factor, seed, SYNTHESIS_VERSION
+    )
+    frames = content_key('frames', positions, neck_renderer.fingerprint)
+    video = content_key('video', audio, frames, onsets, fps, ext)
+    return StageKeys(audio, frames, video)
+
+def render_frames(positions, neck_renderer):
+    """One frame (RGB array) per step of positions, stacked."""
+    with span('render_frames') as stage:
+        frames = np.stack([neck_renderer.get_frame(step) for step in positions])
+        stage.count('frames', len(frames))
+    return frames
+
+def make_video_clip(positions, audio, onsets, neck_renderer=None, frames=None):
+    """Video clip showing each step of positions from its onset [ms], with audio.
+
+    Frames are looked up (memoized by NeckRenderer) as moviepy asks for them:
+    no images or audio are written to disk first. Or pass frames, one per
+    step (e.g. render_frames, from a RenderCache).
+    """
+    if (neck_renderer is None) and (frames is None):
+        neck_renderer = NeckRenderer()
+    onsets_seconds = np.asarray(onsets)/1000
+
+    def make_frame(t):
+        step = int(np.clip(np.searchsorted(onsets_seconds, t, side='right') - 1, 0, len(positions) - 1))
+        return neck_renderer.get_frame(positions[step]) if frames is None else frames[step]
+
+    # Scale down rather than clip if chords sum to more than full scale.
+    peak = np.max(np.abs(audio)) if len(audio) else 0
+    if peak > 1:
+        audio = audio/peak
+
+    video = mpy.VideoClip(make_frame, duration=onsets_seconds[-1])
+    return video.set_audio(AudioArrayClip(audio[:, np.newaxis], fps=fs))
+
+def make_timeline_clip(timeline, audio, neck_renderer=None):
+    """Video clip of a timeline.Timeline with its audio (e.g. generate_audio.pluck_timeline).
+
+    Each frame shows the notes sounding at its time (interval index lookup),
+    so picture and sound come from the same onsets.
+    """
+    if neck_renderer is None:
+        neck_renderer = NeckRenderer()
+
+    def make_frame(t):
+        return neck_renderer.get_frame(timeline.positions_at(t))
+
+    peak = np.max(np.abs(audio)) if len(audio) else 0
+    if peak > 1:
+        audio = audio/peak
+
+    video = mpy.VideoClip(make_frame, duration=timeline.end)
+    return video.set_audio(AudioArrayClip(audio[:, np.newaxis], fps=fs))
+
+def create_files(positions, bpm, fileroot, in_memory=True, save_intermediate=False, fps=25, cache=None, seed=0):
+    """Create a video (webm) of positions at the given tempo, with audio.
+
+    By default, frames and audio go straight to the encoder (one encode
+    pass); the WAV and GIF are only written if save_intermediate. With
+    in_memory=False, use the original route instead: write WAV and GIF, then
+    decode both and combine. Returns a VideoReport. Every note is plucked
+    from seed (see pluck_seeded), so the audio is the same every time.
+
+    With a cache (RenderCache), in memory: the video is exported from the
+    cache if nothing changed, otherwise only the stages whose inputs changed
+    (audio, frames) are rendered (see get_stage_keys).
+    """
+    start = perf_counter()
+    intermediate_files = []
 
-def create_files(positions, bpm, fileroot):
     # Convert to frequencies.
-    # todo: accommodate multiple frequencies at any given time.
-    tuning = GuitarTuning()
-    # TODO: update to accommodate refactor of GuitarTuning.
-    notes = [tuning.position_to_note(*position[0]) for position in positions]  # hack: see above.
-    frequencies = [note_to_frequency(chroma, octave) for (chroma, octave) in notes]
+    with span('positions_to_frequencies') as stage:
+        frequencies = positions_to_frequencies(positions)
+        stage.count('steps', len(positions))
     print(frequencies)
 
     # Configure timings.
     onsets = bpm_to_onsets(bpm, len(frequencies))
 
-    # Generate audio output.
-    output = pluck_strings(frequencies, onsets)
+    # Generate audio output (cached with the video if there is a cache).
+    def make_audio():
+        return pluck_seeded(frequencies, onsets, seed)
+
+    output = None
+    if (cache is None) or save_intermediate or not in_memory:
+        output = make_audio()
     
     # Save to WAV file.
     filename_audio = fileroot + '.wav'
-    save_wav(output, filename_audio)
-
-    # Generate animation.
-    # todo: handle padding (black frame?).
     filename_animation = fileroot + '.gif'
-    animate(positions, filename_animation, bpm)
+    if save_intermediate or not in_memory:
+        save_wav(output, filename_audio)
+        intermediate_files.append(filename_audio)
+
+        # Generate animation.
+        # todo: handle padding (black frame?).
+        animate(positions, filename_animation, bpm)
+        intermediate_files.append(filename_animation)
 
-    # Combine animation with audio.
-    # todo: should be out of sync given audio has padding, animation doesn't. Why not then?
     filename_output = fileroot + '.webm'
-    combine_existing_files(filename_animation, filename_audio, filename_output)
+    if in_memory and (cache is not None):
+        neck_renderer = NeckRenderer()
+        keys = get_stage_keys(positions, frequencies, onsets, fps, neck_renderer, seed=seed)
+
+        def write_video(filepath):
+            audio = output if output is not None else cache.array('audio', keys.audio, make_audio)
+            frames = cache.array('frames', keys.frames, lambda: render_frames(positions, neck_renderer))
+            video = make_video_clip(positions, audio, onsets, frames=frames)
+            encode_video(video, filepath, fps=fps, audio_fps=fs)
+
+        cache.export(cache.file('video', keys.video, '.webm', write_video), get_filepath(filename_output))
+        print(f'Render cache: {cache}')
+    elif in_memory:
+        video = make_video_clip(positions, output, onsets)
+        encode_video(video, get_filepath(filename_output), fps=fps, audio_fps=fs)
+    else:
+        # Combine animation with audio.
+        # todo: should be out of sync given audio has padding, animation doesn't. Why not then?
+        combine_existing_files(filename_animation, filename_audio, filename_output)
+
+    bytes_written = sum(os.path.getsize(get_filepath(f)) for f in intermediate_files + [filename_output])
+    report = VideoReport(filename_output, perf_counter() - start, bytes_written)
+    print(report)
+    return report
+
+def compare_pipelines(positions, bpm, fileroot):
+    """Report time and bytes written: WAV/GIF round trip vs. straight to the encoder."""
+    round_trip = create_files(positions, bpm, fileroot + ' (round trip)', in_memory=False)
+    in_memory = create_files(positions, bpm, fileroot + ' (in memory)')
+    print(f'Round trip: {round_trip}')
+    print(f'In memory:  {in_memory}')
+    print(f'Speedup: {round_trip.seconds/in_memory.seconds:.1f}x, bytes written: {in_memory.bytes_written/round_trip.bytes_written:.0%}')
 
 def c_major_open_position():
     positions = [
@@ -93,7 +258,7 @@ def c_major_open_position():
 
     bpm = 100
     fileroot = 'C major open position'
-    create_files(positions, bpm, fileroot)
+    create_files(positions, bpm, fileroot, cache=RenderCache())
 
 def pentatonic():
     """E minor pentatonic scale."""
@@ -121,7 +286,7 @@ def pentatonic():
 
     bpm = 100
     fileroot = f'E minor pentatonic scale two octaves first position ascending and descending BPM={bpm:d}'
-    create_files(positions, bpm, fileroot)
+    create_files(positions, bpm, fileroot, cache=RenderCache())
 
 if __name__ == '__main__':
     # combine_existing_files()
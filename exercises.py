@@ -7,7 +7,7 @@ E natural minor open position.
     Then randomise order.
     Different orders ascending and descending.
     See Rock Guitar Secrets PDF, p15.
-Generate image/animation to accompany each exercise.
+Media for more exercises (every position of a note, chords, arpeggios).
 Option to go round again?
 Option to skip an exercise?
 Select random subset (once list gets too long)?
@@ -17,8 +17,10 @@ Piano equivalent (scales, arpeggios, broken chords, pieces).
 """
 
 import random
+from typing import NamedTuple, Optional
 
-from chroma import chroma_list
+from chroma import Chroma, chroma_list
+from scales import ScaleType
 
 string_names = ['low E', 'A', 'D', 'G', 'B', 'high E']
 open_chords = ['C', 'D', 'F', 'Am']  # todo: add all those listed in brown notebook.
@@ -36,6 +38,27 @@ songs = [
     'When the Sun Goes Down'
 ]
 
+class MediaJob(NamedTuple):
+    """Video (with audio) to render for an exercise: a scale, ascending and descending."""
+    scale_type: ScaleType
+    root: Chroma
+    bpm: int = 80
+
+    @property
+    def name(self):
+        return f'{self.root.name} {self.scale_type.name.lower()} BPM={self.bpm}'
+
+
+class Exercise(NamedTuple):
+    prompt: str
+    media: Optional[MediaJob] = None
+
+
+def scale_exercise(scale_type, description, bpm=80):
+    """Exercise to play a scale (random root), with its video."""
+    root = Chroma[random_chroma()]
+    return Exercise(f'Play a {root.name} {description} scale.', MediaJob(scale_type, root, bpm))
+
 def random_chroma():
     """Choose a random chroma value."""
     return random.choice(chroma_list).name
@@ -61,25 +84,28 @@ def random_fingering():
     random.shuffle(fingers)
     return fingers
 
-def main():
+def get_exercises(bpm=80):
+    """One of each exercise (random choices), shuffled."""
     exercises = [
-        f'Play every {random_chroma()} on the neck.',
-        f'Play a chromatic scale along the {random_string()} string.',
-        f'Play a quasi-chromatic scale with fingering {random_fingering()}.',
-        f'Play a {random_chroma()} minor pentatonic scale.',
-        f'Play a {random_chroma()} minor scale.',
-        f'Play a {random_chroma()} major scale.',
-        f'Play a {random_open_chord()} open chord.',
-        f'Play all the arpeggios in the key of {random_key()}.',  # todo: explain what they are!
-        f'Play {random_song()}.'
+        Exercise(f'Play every {random_chroma()} on the neck.'),
+        Exercise(f'Play a chromatic scale along the {random_string()} string.'),
+        Exercise(f'Play a quasi-chromatic scale with fingering {random_fingering()}.'),
+        scale_exercise(ScaleType.MINOR_PENTATONIC, 'minor pentatonic', bpm),
+        scale_exercise(ScaleType.MINOR, 'minor', bpm),
+        scale_exercise(ScaleType.MAJOR, 'major', bpm),
+        Exercise(f'Play a {random_open_chord()} open chord.'),
+        Exercise(f'Play all the arpeggios in the key of {random_key()}.'),  # todo: explain what they are!
+        Exercise(f'Play {random_song()}.')
     ]
     random.shuffle(exercises)
+    return exercises
+
+def main():
+    """Practice session: each exercise's video is rendered in the background before it comes up (see practice_session.py)."""
+    import asyncio
+    from practice_session import run_session
 
-    for exercise in exercises:
-        print(exercise)
-        input('Press enter to continue...')
-        print()
-    print('Well done! Session complete!')
+    asyncio.run(run_session(get_exercises()))
 
 if __name__ == '__main__':
     main()
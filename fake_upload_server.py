@@ -0,0 +1,149 @@
+"""
+fake_upload_server.py
+
+Local stand-in for YouTube's resumable upload endpoint, to try out
+upload_queue.py without an account, a network or a quota.
+
+Implements the resumable upload protocol:
+POST /upload (JSON metadata; X-Upload-Content-Length): start a session,
+    reply 200 with its URI in the Location header.
+PUT <session URI> with Content-Range: bytes first-last/total and that
+    chunk as the body: reply 308 (Resume Incomplete) with Range: bytes=0-n
+    (everything received so far), or 201 with the video resource (JSON,
+    with an id) once the file is complete.
+PUT <session URI> with Content-Range: bytes */total and no body: the status
+    query after an interruption (same replies, nothing stored).
+Unknown sessions get 404 (the client must start again).
+
+Uploads are kept in memory. Failures can be injected: failure_rate (random
+503s, which the client retries) and offline (503 for everything, e.g. to
+interrupt a batch and resume it later; set it, or offline_after_chunks).
+
+todo:
+Throttle (bytes per second) to try chunk sizes on a slow link.
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import random
+import re
+import threading
+import uuid
+
+content_range_pattern = re.compile(r'bytes (?:(\d+)-(\d+)|\*)/(\d+)')
+
+
+class UploadSession:
+    def __init__(self, size, metadata):
+        self.size = size
+        self.metadata = metadata
+        self.received = bytearray()
+        self.video_id = None
+
+
+class FakeUploadServer(ThreadingHTTPServer):
+    """HTTP server holding the sessions (see module docstring); run with serve_in_thread."""
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), failure_rate=0.0, offline_after_chunks=None, seed=0):
+        super().__init__(address, FakeUploadHandler)
+        self.sessions = {}
+        self.failure_rate = failure_rate
+        self.offline_after_chunks = offline_after_chunks
+        self.offline = False
+        self.chunks_received = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}/upload'
+
+    def should_fail(self):
+        with self._lock:
+            return self.offline or (self._random.random() < self.failure_rate)
+
+    def add_chunk(self):
+        with self._lock:
+            self.chunks_received += 1
+            if self.chunks_received == self.offline_after_chunks:
+                self.offline = True
+
+    def uploaded(self):
+        """Finished uploads: video id to bytes received."""
+        return {session.video_id: bytes(session.received) for session in self.sessions.values() if session.video_id}
+
+
+class FakeUploadHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep-alive, as the client reuses its connection for every chunk.
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, headers=None, body=b''):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def _reply_progress(self, session):
+        if session.video_id is not None:
+            resource = {'id': session.video_id, 'kind': 'youtube#video', 'snippet': session.metadata.get('snippet', {})}
+            self._reply(201, {'Content-Type': 'application/json'}, json.dumps(resource).encode())
+        elif session.received:
+            self._reply(308, {'Range': f'bytes=0-{len(session.received) - 1}'})
+        else:
+            self._reply(308)
+
+    def do_POST(self):
+        body = self._read_body()
+        if self.server.should_fail():
+            self._reply(503)
+            return
+        session_id = uuid.uuid4().hex
+        metadata = json.loads(body) if body else {}
+        self.server.sessions[session_id] = UploadSession(int(self.headers['X-Upload-Content-Length']), metadata)
+        host, port = self.server.server_address[:2]
+        self._reply(200, {'Location': f'http://{host}:{port}/upload/session/{session_id}'})
+
+    def do_PUT(self):
+        body = self._read_body()
+        session = self.server.sessions.get(self.path.rsplit('/', 1)[-1])
+        if session is None:
+            self._reply(404)
+            return
+        if self.server.should_fail():
+            self._reply(503)
+            return
+
+        match = content_range_pattern.fullmatch(self.headers.get('Content-Range', ''))
+        if match is None:
+            self._reply(400)
+            return
+        first, last, total = match.groups()
+        if first is not None and (session.video_id is None):
+            first, last = int(first), int(last)
+            if (first != len(session.received)) or (last - first + 1 != len(body)) or (int(total) != session.size):
+                self._reply(400)
+                return
+            session.received += body
+            self.server.add_chunk()
+            if len(session.received) == session.size:
+                session.video_id = 'fake' + uuid.uuid4().hex[:7]
+        self._reply_progress(session)
+
+
+def serve_in_thread(**kwargs) -> FakeUploadServer:
+    """Start a FakeUploadServer (kwargs as its constructor) on a free local port, on a daemon thread.
+
+    Stop it with server.shutdown(); its upload URL is server.url.
+    """
+    server = FakeUploadServer(**kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,166 @@
+"""
+fingering.py
+
+Choose where on the neck to play a melody: of all the positions each note
+can be played at (see GuitarTuning.midis_to_positions), find the sequence
+with the lowest total cost, by dynamic programming (Viterbi).
+
+The cost is pluggable: any object with position_cost and transition_cost
+methods (see FingeringCost) will do. Both work on whole arrays of candidates
+at once, so the costs of every step are computed up front and the only loop
+is over the notes, each step a min over (at most strings x strings)
+candidates: time is linear in the length of the melody.
+
+todo:
+Chords (several notes at one step).
+Finger assignment (which finger on which fret), not just positions.
+Track hand position through open strings (state is the position only).
+"""
+
+from time import perf_counter
+from typing import List
+
+import numpy as np
+
+from conversions import notes_to_midis
+from guitar_tuning import GuitarTuning
+from notes import Note
+
+
+class FingeringCost:
+    """Default cost of a fingering: hand shifts, string crossings and fret height.
+
+    hand_span: number of frets the hand covers without shifting (index to
+    little finger). Moving further than that costs shift_penalty on top of
+    shift_weight per fret. Open strings need no hand position, so never cost
+    a shift. Subclass (or duck-type) to change any of the terms.
+    """
+    def __init__(self, hand_span=4, shift_weight=1.0, shift_penalty=4.0, crossing_weight=0.5, height_weight=0.05):
+        self.hand_span = hand_span
+        self.shift_weight = shift_weight
+        self.shift_penalty = shift_penalty
+        self.crossing_weight = crossing_weight
+        self.height_weight = height_weight
+
+    def position_cost(self, strings, frets):
+        """Cost of playing at each position (arrays of string and fret)."""
+        return self.height_weight*frets
+
+    def transition_cost(self, strings_from, frets_from, strings_to, frets_to):
+        """Cost of moving from one position to the next (arrays, broadcast against each other)."""
+        fretted = (frets_from > 0) & (frets_to > 0)
+        distance = np.where(fretted, np.abs(frets_to - frets_from), 0)
+        shift = self.shift_weight*distance + self.shift_penalty*(distance >= self.hand_span)
+        crossing = self.crossing_weight*np.abs(strings_to - strings_from)
+        return shift + crossing
+
+
+def find_fingering_midis(midis, tuning=None, cost=None) -> np.ndarray:
+    """Lowest cost positions for a melody of MIDI note numbers.
+
+    Returns an N x 2 array of (string, fret), one row per note.
+    """
+    if tuning is None:
+        tuning = GuitarTuning()
+    if cost is None:
+        cost = FingeringCost()
+    midis = np.asarray(midis, dtype=int).ravel()
+    num_notes = len(midis)
+    if not num_notes:
+        return np.zeros((0, 2), dtype=int)
+
+    positions, offsets = tuning.midis_to_positions(midis)
+    counts = np.diff(offsets)
+    if not counts.all():
+        i = int(np.argmin(counts))
+        raise ValueError(f'Note {i} (MIDI {midis[i]}) is not available in this tuning.')
+
+    # Candidates per note, padded to the most any note has (padding costs inf).
+    max_candidates = int(counts.max())
+    columns = np.arange(max_candidates)
+    valid = columns < counts[:, np.newaxis]
+    indices = np.where(valid, offsets[:-1, np.newaxis] + columns, 0)
+    strings = positions[indices, 0]
+    frets = positions[indices, 1]
+    position_costs = np.where(valid, cost.position_cost(strings, frets), np.inf)
+
+    # Every step's transition costs at once: (notes - 1) x from x to.
+    transition_costs = cost.transition_cost(
+        strings[:-1, :, np.newaxis], frets[:-1, :, np.newaxis],
+        strings[1:, np.newaxis, :], frets[1:, np.newaxis, :]
+    )
+    transition_costs = transition_costs + position_costs[1:, np.newaxis, :]
+
+    # Forward pass: best total cost to reach each candidate, and where from.
+    backpointers = np.zeros((num_notes, max_candidates), dtype=np.intp)
+    totals = position_costs[0]
+    for i in range(1, num_notes):
+        scores = totals[:, np.newaxis] + transition_costs[i - 1]
+        best = scores.argmin(axis=0)
+        backpointers[i] = best
+        totals = scores[best, columns]
+
+    # Backward pass.
+    path = np.zeros(num_notes, dtype=np.intp)
+    path[-1] = totals.argmin()
+    for i in range(num_notes - 1, 0, -1):
+        path[i - 1] = backpointers[i, path[i]]
+    steps = np.arange(num_notes)
+    return np.stack([strings[steps, path], frets[steps, path]], axis=1)
+
+
+def find_fingering(notes: List[Note], tuning=None, cost=None) -> np.ndarray:
+    """Lowest cost positions for a melody of Notes: see find_fingering_midis."""
+    if not len(notes):
+        return find_fingering_midis([], tuning, cost)
+    chromas, octaves = zip(*notes)
+    return find_fingering_midis(notes_to_midis(chromas, octaves), tuning, cost)
+
+
+def total_cost(positions, cost=None):
+    """Total cost of a fingering (N x 2 array of string, fret)."""
+    if cost is None:
+        cost = FingeringCost()
+    positions = np.asarray(positions, dtype=int).reshape(-1, 2)
+    strings, frets = positions[:, 0], positions[:, 1]
+    return float(
+        cost.position_cost(strings, frets).sum()
+        + cost.transition_cost(strings[:-1], frets[:-1], strings[1:], frets[1:]).sum()
+    )
+
+
+def random_melody(num_notes, tuning=None, max_interval=5, seed=0):
+    """Random walk in MIDI note numbers (steps of up to max_interval semitones), within the tuning's range."""
+    if tuning is None:
+        tuning = GuitarTuning()
+    low, high = int(tuning.midis.min()), int(tuning.midis.max())
+    rng = np.random.default_rng(seed)
+    steps = rng.integers(-max_interval, max_interval + 1, num_notes)
+    midis = np.empty(num_notes, dtype=int)
+    midi = (low + high)//2
+    for i, step in enumerate(steps.tolist()):
+        midi += step
+        if not low <= midi <= high:
+            midi -= 2*step  # Bounce off the ends of the range.
+        midis[i] = midi
+    return midis
+
+
+def benchmark(lengths=(1000, 4000, 16000)):
+    """Time the solver on long random melodies (should grow linearly with length)."""
+    tuning = GuitarTuning()
+    print(f'{"notes":>8} {"time [ms]":>10} {"per note [us]":>14} {"cost per note":>14}')
+    for num_notes in lengths:
+        midis = random_melody(num_notes, tuning)
+        start = perf_counter()
+        positions = find_fingering_midis(midis, tuning)
+        seconds = perf_counter() - start
+        print(f'{num_notes:8d} {1e3*seconds:10.1f} {1e6*seconds/num_notes:14.2f} {total_cost(positions)/num_notes:14.2f}')
+
+
+def main():
+    benchmark()
+
+
+if __name__ == '__main__':
+    main()
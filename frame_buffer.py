@@ -0,0 +1,131 @@
+"""
+frame_buffer.py
+
+Frames as NumPy arrays that share memory with whatever drew them, so they can
+go to the encoder (see frame_writer.py) without being copied or converted in
+Python: ffmpeg is told the pixel layout instead (pix_fmt) and converts to
+YUV itself, as it has to anyway.
+
+Cairo: an ImageSurface's pixels (get_data()) viewed as height x width x 4.
+    ARGB32 and RGB24 are 32 bit words, so the bytes are B, G, R, A (or unused)
+    on little-endian machines: pix_fmt 'bgra' or 'bgr0'.
+PIL: an RGBA image made with Image.frombuffer on a NumPy array draws straight
+    into that array (pix_fmt 'rgba'). RGB images cannot share memory this way
+    (PIL pads them to 4 bytes per pixel), and np.asarray(image) always copies.
+
+Copies that do happen between rendering and the encoder (PIL images that
+are not array-backed, non-contiguous arrays, patching a frame in place of the
+previous one) are counted in copies, a CopyCounter.
+
+todo:
+Premultiplied alpha: Cairo ARGB32 frames with transparent pixels will not
+    look right to ffmpeg (fine for opaque frames, which are all we encode).
+"""
+
+import sys
+from typing import NamedTuple
+
+import numpy as np
+from PIL import Image
+
+little_endian = sys.byteorder == 'little'
+
+# ffmpeg pixel format by number of channels, for plain arrays.
+array_pix_fmts = {3: 'rgb24', 4: 'rgba'}
+
+
+class CopyCounter:
+    """Bytes of pixel data copied on the way to the encoder (instrumentation)."""
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.bytes_copied = 0
+        self.frames = 0
+
+    def add(self, num_bytes):
+        self.bytes_copied += int(num_bytes)
+
+    def add_frame(self):
+        self.frames += 1
+
+    @property
+    def bytes_per_frame(self) -> float:
+        return self.bytes_copied/self.frames if self.frames else 0.0
+
+    def __str__(self):
+        return f'{self.bytes_copied} bytes copied in {self.frames} frames ({self.bytes_per_frame:.0f} bytes/frame)'
+
+
+copies = CopyCounter()
+
+
+class FrameBuffer(NamedTuple):
+    """Pixels (height x width x channels, uint8) and their ffmpeg pixel format."""
+    pixels: np.ndarray
+    pix_fmt: str
+
+    @property
+    def size(self):
+        """(width, height), as PIL and ffmpeg."""
+        height, width = self.pixels.shape[:2]
+        return (width, height)
+
+
+def surface_to_buffer(surface) -> FrameBuffer:
+    """View of a Cairo ImageSurface's pixels (no copy).
+
+    The view follows the surface: it shows whatever was last drawn (call
+    surface.flush() after drawing, as the renderers do).
+    """
+    import cairo
+    pix_fmts = {
+        cairo.FORMAT_ARGB32: 'bgra' if little_endian else 'argb',
+        cairo.FORMAT_RGB24: 'bgr0' if little_endian else '0rgb',
+    }
+    surface_format = surface.get_format()
+    if surface_format not in pix_fmts:
+        raise ValueError(f'Unsupported Cairo surface format {surface_format}: use ARGB32 or RGB24.')
+    width, height, stride = surface.get_width(), surface.get_height(), surface.get_stride()
+    rows = np.frombuffer(surface.get_data(), dtype=np.uint8).reshape(height, stride)
+    return FrameBuffer(rows[:, :4*width].reshape(height, width, 4), pix_fmts[surface_format])
+
+
+def new_image(size):
+    """Blank RGBA PIL image that draws straight into a NumPy array; return (image, FrameBuffer)."""
+    width, height = size
+    pixels = np.zeros((height, width, 4), dtype=np.uint8)
+    image = Image.frombuffer('RGBA', size, pixels, 'raw', 'RGBA', 0, 1)
+    image.readonly = 0  # Otherwise PIL copies the buffer on the first change (and stops sharing it).
+    return image, FrameBuffer(pixels, 'rgba')
+
+
+def image_to_buffer(image) -> FrameBuffer:
+    """FrameBuffer from any PIL image: a copy (counted), converted to RGB(A) if need be.
+
+    Images from new_image need not come through here: use their FrameBuffer.
+    """
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.mode else 'RGB')
+    pixels = np.asarray(image)
+    copies.add(pixels.nbytes)
+    return FrameBuffer(pixels, array_pix_fmts[pixels.shape[2]])
+
+
+def frame_to_buffer(frame) -> FrameBuffer:
+    """FrameBuffer from a FrameBuffer, RGB or RGBA array, Cairo ImageSurface or PIL image.
+
+    Only PIL images are copied (see image_to_buffer).
+    """
+    if isinstance(frame, FrameBuffer):
+        return frame
+    if isinstance(frame, np.ndarray):
+        if (frame.ndim != 3) or (frame.shape[2] not in array_pix_fmts):
+            raise ValueError(f'Frame arrays must be height x width x 3 (RGB) or 4 (RGBA), got shape {frame.shape}.')
+        return FrameBuffer(frame, array_pix_fmts[frame.shape[2]])
+    if isinstance(frame, Image.Image):
+        return image_to_buffer(frame)
+    if hasattr(frame, 'get_data'):
+        return surface_to_buffer(frame)
+    raise TypeError(f'Not a frame: {type(frame).__name__}.')
+
@@ -0,0 +1,113 @@
+"""
+frame_writer.py
+
+Stream frames to ffmpeg one at a time (GIF or video), so an animation never
+has to be held in memory as a list of images.
+
+Uses the ffmpeg binary that comes with imageio-ffmpeg (a moviepy dependency).
+
+An audio track (e.g. a WAV file rendered from the same timeline) can be
+muxed in as the frames are encoded (not for GIF).
+
+Frames are sent as they are, in their own pixel format (see frame_buffer.py):
+no copy or colour conversion in Python unless they are PIL images or
+non-contiguous arrays, and those copies are counted in frame_buffer.copies.
+"""
+
+import numpy as np
+import imageio_ffmpeg
+
+from frame_buffer import copies, frame_to_buffer
+from profiling import span
+
+# ffmpeg settings by output file extension: (codec, pixel format, extra output arguments, audio codec).
+formats = {
+    '.gif': ('gif', 'rgb8', ['-loop', '0'], None),
+    '.webm': ('libvpx', 'yuv420p', ['-b:v', '2M'], 'libvorbis'),
+    '.mp4': ('libx264', 'yuv420p', [], 'aac'),
+}
+
+
+class FrameWriter:
+    """Write frames (see frame_buffer.frame_to_buffer) to a GIF or video file as they arrive.
+
+    ffmpeg is started on the first frame (which fixes the frame size and
+    pixel format). With audio_path, that audio file is muxed in as the audio
+    track.
+    """
+    def __init__(self, filepath, fps, audio_path=None):
+        extension = filepath[filepath.rfind('.'):].lower()
+        if extension not in formats:
+            raise ValueError(f'Unsupported file type {extension}: use one of {", ".join(formats)}.')
+        self._filepath = filepath
+        self._fps = fps
+        self._codec, self._pix_fmt, self._output_params, self._audio_codec = formats[extension]
+        if (audio_path is not None) and (self._audio_codec is None):
+            raise ValueError(f'{extension} files cannot have audio.')
+        self._audio_path = audio_path
+        self._writer = None
+        self._last_frame = None
+        self.size = None
+        self.pix_fmt = None
+        self.num_frames = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, frame):
+        buffer = frame_to_buffer(frame)
+        self._ensure_started(buffer)
+        self._last_frame = buffer.pixels
+        self._send(buffer.pixels)
+
+    def repeat(self):
+        """Write the previous frame again (nothing is rendered or copied)."""
+        if self._last_frame is None:
+            raise ValueError('No frame to repeat yet.')
+        self._send(self._last_frame)
+
+    def _ensure_started(self, buffer):
+        if self._writer is None:
+            self.size = buffer.size
+            self.pix_fmt = buffer.pix_fmt
+            self._writer = imageio_ffmpeg.write_frames(
+                self._filepath,
+                self.size,
+                pix_fmt_in=self.pix_fmt,
+                fps=self._fps,
+                codec=self._codec,
+                pix_fmt_out=self._pix_fmt,
+                macro_block_size=1,
+                output_params=self._output_params,
+                audio_path=self._audio_path,
+                audio_codec=self._audio_codec if self._audio_path else None
+            )
+            self._writer.send(None)  # Start the generator (and ffmpeg).
+        elif buffer.size != self.size:
+            raise ValueError(f'Frame size {buffer.size} does not match first frame {self.size}.')
+        elif buffer.pix_fmt != self.pix_fmt:
+            raise ValueError(f'Pixel format {buffer.pix_fmt} does not match first frame {self.pix_fmt}.')
+
+    def _send(self, array):
+        """Pass the array itself to ffmpeg (its buffer is written to the pipe), copying only if not contiguous."""
+        if not array.flags.c_contiguous:
+            array = np.ascontiguousarray(array)
+            copies.add(array.nbytes)
+        self._writer.send(array)
+        copies.add_frame()
+        self.num_frames += 1
+
+    def write_all(self, frames):
+        """Write every frame from an iterable (e.g. a generator); return the number written."""
+        for frame in frames:
+            self.write(frame)
+        return self.num_frames
+
+    def close(self):
+        if self._writer is not None:
+            with span('ffmpeg finish'):  # Encode what is still buffered, then mux.
+                self._writer.close()
+            self._writer = None
@@ -19,10 +19,13 @@ Change to SVG?
 
 from dataclasses import dataclass
 import math
+import os.path
 from typing import List, NamedTuple
 
 import cairo
 
+from render_cache import RenderCache, content_key
+
 class FretboardPosition(NamedTuple):
     string: int
     fret: int
@@ -49,6 +52,10 @@ image_width = 2220
 image_height = 1080
 # TODO: optimise for tablet and laptop dimensions also.
 
+# Bump whenever a change to draw_fretboard (colours, geometry) changes the
+# image drawn: cached fretboards are keyed on it (see render_cache.py).
+DRAWING_VERSION = 1
+
 
 # TODO: transform in here so always drawing in norm space?
 def draw_line(context, start, finish):
@@ -154,7 +161,11 @@ def chord_string_to_fretboard_positions(chord_string) -> List[FretboardPosition]
     return note_markers
 
 
-def main():
+def draw_fretboard(notes: List[FretboardPosition]):
+    """Draw the whole fretboard with markers at the given positions, from scratch.
+
+    See fretboard_renderer.py to draw many frames (the neck is only drawn once).
+    """
     # Create a new surface and context
     surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, image_width, image_height)
     context = cairo.Context(surface)
@@ -187,10 +198,6 @@ def main():
     draw_frets(context, normed_to_global)
     draw_strings(context, normed_to_global)
 
-    # Draw some notes.
-    # TODO: add more chords!
-    G = '300023'
-    notes = chord_string_to_fretboard_positions(G)
     draw_notes(context, notes, normed_to_global)
 
     # # Set text properties
@@ -201,8 +208,20 @@ def main():
     # context.move_to(100, 50)
     # context.show_text("Hello, World!")
 
-    # Save the image as PNG
-    surface.write_to_png("guitar_fretboard.png")
+    return surface
+
+
+def main():
+    # Draw some notes.
+    # TODO: add more chords!
+    G = '300023'
+    notes = chord_string_to_fretboard_positions(G)
+
+    # Save the image as PNG (only drawn if not in the render cache).
+    cache = RenderCache()
+    key = content_key('fretboard', notes, image_width, image_height, num_strings, num_frets, marker_radius, DRAWING_VERSION)
+    path = cache.file('fretboard', key, '.png', lambda filepath: draw_fretboard(notes).write_to_png(filepath))
+    cache.export(path, os.path.join('data', 'guitar_fretboard.png'))
 
 
 if __name__ == '__main__':
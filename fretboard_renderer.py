@@ -0,0 +1,253 @@
+"""
+fretboard_renderer.py
+
+Render many frames of the (vector) fretboard quickly: the neck (background,
+inlays, frets and strings) is drawn once into a cached surface, and each
+frame is a copy of it with a pre-rendered marker composited at each position.
+
+Same drawing as fretboard.draw_fretboard, but all frets and strings are one
+path (one stroke), and every coordinate is computed once, with NumPy, when
+the renderer is built.
+
+todo:
+Marker colours (one sprite per colour).
+"""
+
+import math
+import os
+import os.path
+from time import perf_counter
+
+import cairo
+import numpy as np
+
+from frame_buffer import FrameBuffer, surface_to_buffer
+from frame_writer import FrameWriter
+from fretboard import FretboardPosition, chord_string_to_fretboard_positions, draw_fretboard, image_height, image_width, marker_radius, num_frets, num_strings
+from render_cache import remove_output
+
+inlay_frets = [3, 5, 7, 9, 15, 17, 19, 21]
+double_inlay_fret = 12
+white = (1, 1, 1)
+black = (0, 0, 0)
+grey = (0.7, 0.7, 0.7)
+line_width = 5
+folder = 'data'
+
+
+class FretboardRenderer:
+    """Fretboard frames with markers at given positions, the static neck drawn only once.
+
+    render() draws into one frame surface that is reused for every frame:
+    use (or copy) each frame before rendering the next.
+
+    box (left, top, right, bottom) in pixels is where the neck goes in the
+    image (default: as fretboard.draw_fretboard); markers shrink to fit if
+    the strings are too close together. To draw into a surface shared with
+    other views (see layout.py), use draw_static and draw_markers: the
+    renderer's own surfaces are only made when first needed.
+    """
+    def __init__(self, width=image_width, height=image_height, num_strings=num_strings, num_frets=num_frets, marker_radius=marker_radius, box=None):
+        if box is None:
+            padding_horizontal = 50
+            padding_vertical = 250
+            box = (padding_horizontal, padding_vertical, width - padding_horizontal, height - padding_vertical)
+        else:
+            marker_radius = min(marker_radius, int(0.4*(box[3] - box[1])/num_strings))
+        self.width = width
+        self.height = height
+        self.num_strings = num_strings
+        self.num_frets = num_frets
+        self._marker_radius = marker_radius
+
+        # Layout (as fretboard.draw_fretboard): neck from left to right, top to bottom.
+        left, top, right, bottom = box
+        self._left = left + 2*marker_radius
+        self._right = right
+        self._top = top + marker_radius
+        self._bottom = bottom - marker_radius
+        self._fret_x = self._left + (self._right - self._left)*np.arange(num_frets + 1)/num_frets
+        self._string_y = self._top + (self._bottom - self._top)*np.arange(num_strings)/(num_strings - 1)
+
+        self._marker = self._draw_marker()
+
+        # Top left corner of the marker sprite for every (string, fret).
+        sprite_offset = marker_radius + 1
+        x = np.rint(self._fret_x - marker_radius - sprite_offset).astype(int)
+        y = np.rint(self._string_y - sprite_offset).astype(int)
+        self._marker_offsets = {
+            (string, fret): (int(x[fret]), int(y[string - 1]))
+            for string in range(1, num_strings + 1)
+            for fret in range(num_frets + 1)
+        }
+
+        self._neck = None
+        self._frame = None
+
+    def _ensure_surfaces(self):
+        """Make the cached neck and the frame surface, the first time they are needed."""
+        if self._frame is None:
+            self._neck = self._draw_neck()
+            self._frame = cairo.ImageSurface(cairo.FORMAT_RGB24, self.width, self.height)
+            self._context = cairo.Context(self._frame)
+            self._buffer = surface_to_buffer(self._frame)
+
+    def _draw_neck(self):
+        surface = cairo.ImageSurface(cairo.FORMAT_RGB24, self.width, self.height)
+        context = cairo.Context(surface)
+        context.set_source_rgb(*white)
+        context.paint()
+        self.draw_static(context)
+        surface.flush()
+        return surface
+
+    def draw_static(self, context):
+        """Draw the neck (inlays, frets and strings, no background) into context."""
+        context.set_antialias(cairo.ANTIALIAS_BEST)
+
+        # Inlays, midway between frets.
+        inlay_radius = self._marker_radius/2
+        centre_y = (self._top + self._bottom)/2
+        offset_y = 0.2*(self._bottom - self._top)
+        context.set_source_rgb(*grey)
+        for fret in [fret for fret in inlay_frets if fret <= self.num_frets]:
+            x = (self._fret_x[fret] + self._fret_x[fret - 1])/2
+            context.arc(x, centre_y, inlay_radius, 0, 2*math.pi)
+            context.fill()
+        if double_inlay_fret <= self.num_frets:
+            x = (self._fret_x[double_inlay_fret] + self._fret_x[double_inlay_fret - 1])/2
+            for y in [centre_y - offset_y, centre_y + offset_y]:
+                context.arc(x, y, inlay_radius, 0, 2*math.pi)
+                context.fill()
+
+        # Frets and strings: one path, one stroke.
+        context.set_source_rgb(*black)
+        context.set_line_width(line_width)
+        context.set_line_cap(cairo.LINE_CAP_ROUND)
+        for x in self._fret_x.tolist():
+            context.move_to(x, self._top)
+            context.line_to(x, self._bottom)
+        for y in self._string_y.tolist():
+            context.move_to(self._left, y)
+            context.line_to(self._right, y)
+        context.stroke()
+
+    def _draw_marker(self):
+        """Marker sprite: a filled circle on a transparent surface (one pixel margin)."""
+        size = 2*(self._marker_radius + 1)
+        surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, size, size)
+        context = cairo.Context(surface)
+        context.set_antialias(cairo.ANTIALIAS_BEST)
+        context.set_source_rgb(*black)
+        context.arc(size/2, size/2, self._marker_radius, 0, 2*math.pi)
+        context.fill()
+        surface.flush()
+        return surface
+
+    @property
+    def neck(self) -> cairo.ImageSurface:
+        """The cached static layer (do not draw on it)."""
+        self._ensure_surfaces()
+        return self._neck
+
+    def render(self, positions) -> cairo.ImageSurface:
+        """Frame with markers at the given positions (string, fret): the reused frame surface."""
+        self._ensure_surfaces()
+        context = self._context
+        context.set_operator(cairo.OPERATOR_SOURCE)
+        context.set_source_surface(self._neck, 0, 0)
+        context.paint()
+
+        context.set_operator(cairo.OPERATOR_OVER)
+        self.draw_markers(context, positions)
+        self._frame.flush()
+        return self._frame
+
+    def draw_markers(self, context, positions):
+        """Composite a marker at each position (string, fret) into context (operator as set)."""
+        size = self._marker.get_width()
+        for string, fret in positions:
+            try:
+                x, y = self._marker_offsets[(string, fret)]
+            except KeyError:
+                raise ValueError(f'No position (string {string}, fret {fret}) on this fretboard.') from None
+            context.set_source_surface(self._marker, x, y)
+            context.rectangle(x, y, size, size)
+            context.fill()
+
+    @property
+    def buffer(self) -> FrameBuffer:
+        """View of the frame surface's pixels (no copy): holds the latest render."""
+        self._ensure_surfaces()
+        return self._buffer
+
+    def render_frames(self, marker_sets):
+        """Yield one frame per set of positions (the same surface each time: see render)."""
+        for positions in marker_sets:
+            yield self.render(positions)
+
+    def write_pngs(self, marker_sets, filename_pattern='fretboard-{:04d}.png'):
+        """Render each set of positions to its own PNG file; return the number written."""
+        num_frames = 0
+        for i, frame in enumerate(self.render_frames(marker_sets)):
+            frame.write_to_png(filename_pattern.format(i))
+            num_frames += 1
+        return num_frames
+
+    def write_video(self, marker_sets, filepath, fps=25):
+        """Render each set of positions to one frame of a video (or GIF); return the number written.
+
+        Each frame goes to the encoder straight from the frame surface (see buffer).
+        """
+        with FrameWriter(filepath, fps) as writer:
+            for _ in self.render_frames(marker_sets):
+                writer.write(self._buffer)
+            return writer.num_frames
+
+
+def _random_marker_sets(num_frames, max_markers=6, seed=0):
+    rng = np.random.default_rng(seed)
+    marker_sets = []
+    for _ in range(num_frames):
+        num_markers = int(rng.integers(1, max_markers + 1))
+        strings = rng.choice(np.arange(1, num_strings + 1), num_markers, replace=False)
+        frets = rng.integers(1, num_frets + 1, num_markers)
+        marker_sets.append(list(zip(strings.tolist(), frets.tolist())))
+    return marker_sets
+
+
+def benchmark(num_frames=200):
+    """Frames per second at 2220 x 1080: full redraw (as fretboard.main) vs. cached neck."""
+    marker_sets = _random_marker_sets(num_frames)
+
+    start = perf_counter()
+    for positions in marker_sets:
+        draw_fretboard([FretboardPosition(string, fret) for string, fret in positions]).flush()
+    redraw_seconds = perf_counter() - start
+
+    start = perf_counter()
+    renderer = FretboardRenderer()
+    renderer.render([])  # Draws the cached layer.
+    setup_seconds = perf_counter() - start
+    start = perf_counter()
+    for frame in renderer.render_frames(marker_sets):
+        pass
+    cached_seconds = perf_counter() - start
+
+    print(f'full redraw:  {num_frames/redraw_seconds:7.1f} frames/s')
+    print(f'cached neck:  {num_frames/cached_seconds:7.1f} frames/s (plus {1e3*setup_seconds:.1f} ms to build the renderer once)')
+
+
+def main():
+    renderer = FretboardRenderer()
+    G = '300023'
+    os.makedirs(folder, exist_ok=True)
+    frame = renderer.render([tuple(position) for position in chord_string_to_fretboard_positions(G)])
+    filepath = os.path.join(folder, 'guitar_fretboard.png')
+    remove_output(filepath)  # fretboard.main exports the same file from the render cache.
+    frame.write_to_png(filepath)
+    benchmark()
+
+
+if __name__ == '__main__':
+    main()
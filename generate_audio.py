@@ -35,6 +35,7 @@ Add effects e.g. distortion, reverb, delay, compression.
 Use PyGame? https://www.pygame.org/wiki/about
 Listen to samples here: https://freesound.org/search/?q=guitar+string
 Play back programmatically:
+    Now see playback.py: blocks are piped to aplay as they are synthesised.
     aplay <filename>.wav
     Works at command line but not via subprocess.run(): why?
     Error: command not found.
@@ -54,6 +55,7 @@ Stereo spread. Example from https://github.com/mrahtz/javascript-karplus-strong/
         targetArrayR[i] = heapFloat32[heapOffsets.targetStart+i] * gainR;
     }
 Profile and optimise?
+    Now see profiling.py (cli.py --profile): pluck_strings, stream_strings and stream_timeline are traced.
 Fix libGL errors:
     libGL error: MESA-LOADER: failed to open radeonsi: /home/mike/anaconda3/lib/python3.9/site-packages/matplotlib/../../../libstdc++.so.6: version `GLIBCXX_3.4.29' not found (required by /usr/lib/x86_64-linux-gnu/GL/default/lib/dri/radeonsi_dri.so) (search paths /usr/lib/x86_64-linux-gnu/GL/default/lib/dri, suffix _dri)
     libGL error: failed to load driver: radeonsi
@@ -70,63 +72,17 @@ import matplotlib.pyplot as plt
 import numpy as np
 from scipy.io import wavfile
 
+from audio_stream import BLOCK_SIZE, stream_blocks, stream_to_wav
 from chroma import Chroma
+from karplus_strong import AUDIBILITY_THRESHOLD, fs, karplus_strong, mix_buffers, pluck
 from neck_renderer import bpm_to_milliseconds
 from notes import note_to_frequency
+from profiling import span
+from sample_cache import SampleCache
 from scales import get_major_triad, minor_pentatonic_scale, notes_str, append_reversed_sequence
 
-# fs = 8000
-fs = 44100  # Sampling frequency [Hz]
 folder = 'data'
 
-def karplus_strong(frequency, smoothing_factor=0.5):
-    """
-    Karplus-Strong string synthesis.
-
-    todo:
-    Wrap up as class: WavetableGroup? (Nothing guitar specific.)
-        Maintains wavetable for each string, combines in single output.
-        Automatically remove wavetable when amplitude drops below threshold?
-    Ensure amplitude always in range [-1, 1], otherwise will clip.
-    Handle multiple frequencies at this level? E.g. by combining wavetables?
-    Animate wavetable modification (becomes travelling sine wave and amplitude decays).
-    Possible to derive analytic expression for amplitude vs time?
-        See paper Karplus and Strong 1983.
-        Use to decide window: continue until amplitude below threshold.
-    Arg for different initial wavetable options: white noise, +/-1, sine chirp, ...?
-    Optimise (numpy? numba? Cython?).
-    """
-    if (smoothing_factor < 0) or (smoothing_factor > 1):
-        raise ValueError(f'smoothing_factor must be in the range [0, 1].')
-
-    # num_samples = np.ceil(duration * fs).astype(int) + 1
-    num_samples = 2*fs
-
-    # Initial wavetable: random -1 or 1 (not anywhere in that range!).
-    wavetable_size = np.floor(fs/frequency).astype(int)
-    wavetable = (2*np.random.randint(0, 2, wavetable_size) - 1).astype(np.float32)
-
-    # plt.figure()
-    # plt.plot(wavetable)
-    # plt.show()
-
-    # Generate signal.
-    signal = np.zeros(num_samples, dtype=np.float32)
-    current_sample = 0
-    previous_value = 0
-    a = smoothing_factor
-    b = 1 - smoothing_factor
-    for i in range(num_samples):
-        wavetable[current_sample] = a*wavetable[current_sample] + b*previous_value
-        signal[i] = wavetable[current_sample]
-        previous_value = signal[i]
-        current_sample = (current_sample + 1) % wavetable_size
-    
-    # Remove DC offset.
-    signal -= np.mean(signal)
-    
-    return signal
-
 def milliseconds_to_index(milliseconds):
     return np.ceil(milliseconds*fs/1000).astype(int)
 
@@ -152,32 +108,111 @@ def bpm_to_onsets(bpm, num_beats, padding=100):
     ms = bpm_to_milliseconds(bpm)
     return np.linspace(0, num_beats*ms, num_beats + 1) + padding
 
-def pluck_strings(frequencies, onsets):
+def chords_to_voices(frequencies, onsets, durations=None):
+    """Flatten chords into one voice per string.
+
+    Each entry of frequencies is either one frequency or a list of them (a
+    chord: all strings plucked at the same onset). durations [ms] is one per
+    onset, or a single value for all (default 2 s). Returns arrays of
+    (frequencies, onsets, durations), one entry per voice.
+    """
+    if durations is None:
+        durations = 2000
+    durations = np.broadcast_to(durations, (len(onsets) - 1,))
+    voice_frequencies = []
+    voice_onsets = []
+    voice_durations = []
+    for onset, frequency, duration in zip(onsets[:-1], frequencies, durations):
+        chord = np.atleast_1d(frequency)
+        voice_frequencies.extend(chord)
+        voice_onsets.extend([onset]*len(chord))
+        voice_durations.extend([duration]*len(chord))
+    return np.array(voice_frequencies, dtype=float), np.array(voice_onsets, dtype=float), np.array(voice_durations, dtype=float)
+
+def pluck_strings(frequencies, onsets, durations=None, threshold=AUDIBILITY_THRESHOLD, cache=None, seed=0, plot=True):
     """Generate signals and combine.
+
+    Each entry of frequencies is either one frequency or a list of them (a
+    chord: all strings plucked at the same onset). Every voice is synthesised
+    in one batch and mixed into the output together.
+
+    Each note rings for its duration [ms] (default 2 s; one per onset, or a
+    single value for all), until the end of the output, or until it decays
+    below threshold (None: never), whichever comes first. Nothing past that
+    is synthesised.
+
+    With a cache (SampleCache), every note is plucked with the given seed, so
+    each distinct (frequency, duration) is only synthesised once.
     
     todo:
-    Duration (samples) as argument to KS: only generate what we need.
-    Accommodate array of frequencies at each onset for chords.
-        (Add slight delay between each string?)
+    Add slight delay between each string of a chord?
     """
-    # Initialise output array.
     num_samples = milliseconds_to_index(onsets[-1])
-    output = np.zeros(num_samples, dtype=np.float32)
+    voice_frequencies, voice_onsets, voice_durations = chords_to_voices(frequencies, onsets, durations)
 
     # Generate signals and combine.
-    for onset, frequency in zip(onsets[:-1], frequencies):
-        component = karplus_strong(frequency)
-        start_index = milliseconds_to_index(onset)
-        end_index = np.min([num_samples, start_index + len(component)])
-        output[start_index:end_index] += component[:end_index-start_index]
+    starts = milliseconds_to_index(voice_onsets)
+    with span('pluck_strings', cached=cache is not None) as stage:
+        if cache is not None:
+            buffers = cache.get_many(voice_frequencies, durations=voice_durations/1000, seeds=seed, threshold=threshold)
+            output = mix_buffers(buffers, starts, num_samples)
+        else:
+            lengths = np.minimum(milliseconds_to_index(voice_durations), num_samples - starts)
+            output = pluck(voice_frequencies, starts, lengths, num_samples, threshold=threshold)
+        stage.count('samples', int(num_samples))
+        stage.count('voices', len(voice_frequencies))
     
     # Debugging: plot output.
-    plt.figure()
-    plt.plot(output)
-    plt.show()
+    if plot:
+        plt.figure()
+        plt.plot(output)
+        plt.show()
     
     return output
 
+def stream_strings(frequencies, onsets, filename='tmp.wav', durations=None, threshold=AUDIBILITY_THRESHOLD, cache=None, seed=0, block_size=BLOCK_SIZE):
+    """Like pluck_strings followed by save_wav, but streamed block by block.
+
+    Peak memory depends on the longest note, not the length of the piece.
+    Returns the number of samples written.
+    """
+    num_samples = milliseconds_to_index(onsets[-1])
+    voice_frequencies, voice_onsets, voice_durations = chords_to_voices(frequencies, onsets, durations)
+    starts = milliseconds_to_index(voice_onsets)
+    lengths = milliseconds_to_index(voice_durations)
+    blocks = stream_blocks(voice_frequencies, starts, lengths, num_samples, threshold=threshold, block_size=block_size, cache=cache, seed=seed)
+    with span('stream_strings', filename=filename) as stage:
+        num_written = stream_to_wav(blocks, get_filepath(filename), fs)
+        stage.count('samples', num_written)
+    return num_written
+
+def timeline_to_blocks(timeline, ring=2, threshold=AUDIBILITY_THRESHOLD, cache=None, seed=0, block_size=BLOCK_SIZE):
+    """Audio for a timeline.Timeline, block by block (see audio_stream.stream_blocks).
+
+    Each note is plucked at its onset and rings for at least ring [s] (or
+    its duration if longer), as a string would; velocity scales its level.
+    The audio ends with the timeline.
+    """
+    num_samples = milliseconds_to_index(1000*timeline.end)
+    starts = milliseconds_to_index(1000*timeline.onsets)
+    lengths = milliseconds_to_index(1000*np.maximum(timeline.durations, ring))
+    return stream_blocks(
+        timeline.frequencies, starts, lengths, num_samples,
+        threshold=threshold, block_size=block_size, cache=cache, seed=seed, gains=timeline.velocities
+    )
+
+def pluck_timeline(timeline, **kwargs):
+    """Audio for a timeline.Timeline as one array (keyword arguments as timeline_to_blocks)."""
+    blocks = list(timeline_to_blocks(timeline, **kwargs))
+    return np.concatenate(blocks) if blocks else np.zeros(0, dtype=np.float32)
+
+def stream_timeline(timeline, filename='tmp.wav', **kwargs):
+    """Write the audio for a timeline.Timeline to a WAV file, block by block; return the number of samples."""
+    with span('stream_timeline', filename=filename) as stage:
+        num_written = stream_to_wav(timeline_to_blocks(timeline, **kwargs), get_filepath(filename), fs)
+        stage.count('samples', num_written)
+    return num_written
+
 def main_ks():
     """Karplus-Strong, one frequency."""
     # frequency = 27.5  # Lowest note on a piano.
@@ -215,14 +250,9 @@ def main_ks2():
     octave = 4  # todo: what if notes not all in same octave? Handle in scales.py.
     frequencies = [note_to_frequency(c, octave) for c in chromas]
 
-    # Construct signal.
-    signal = np.zeros(2*fs, dtype=np.float32)
-    # plt.figure()
-    for frequency in frequencies:
-        signal += karplus_strong(frequency)
-    #     plt.plot(signal, label=f'{frequency:.0f} Hz')
-    # plt.legend()
-    # plt.show()
+    # Construct signal: all strings plucked together.
+    num_samples = 2*fs
+    signal = pluck(frequencies, np.zeros(len(frequencies)), num_samples, num_samples)
     signal /= len(chromas)  # Normalise. How best?
 
     # Plot.
@@ -241,7 +271,6 @@ def pentatonic_scale():
     """
     # Define frequencies.
     # todo: span two octaves.
-    # todo: do not generate signal more than once for any given frequency? But never same: random seed.
     scale = minor_pentatonic_scale(Chroma.A)
     octaves = [4, 5, 5, 5, 5]  # todo: handle in scales.py.
     frequencies = [note_to_frequency(chroma, octave) for (chroma, octave) in zip(scale, octaves)]
@@ -251,8 +280,10 @@ def pentatonic_scale():
     bpm = 60
     onsets = bpm_to_onsets(bpm, len(frequencies))
 
-    # Generate output.
-    output = pluck_strings(frequencies, onsets)
+    # Generate output: each pitch is only synthesised once (on the way up).
+    cache = SampleCache()
+    output = pluck_strings(frequencies, onsets, cache=cache)
+    print(f'Sample cache: {cache.stats()}')
     
     # Save to WAV file.
     filename = f'A minor pentatonic scale ascending and descending BPM={bpm:d}.wav'
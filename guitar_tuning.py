@@ -1,8 +1,30 @@
-from typing import Dict, List, NamedTuple
+"""
+guitar_tuning.py
 
-from chroma import Chroma, chroma_list, len_chroma
+Convert between fretboard position (string and fret) and note, for any
+fretted instrument (guitar, bass, ukulele, extended range).
+
+A tuning is held as a (strings x frets) matrix of MIDI note numbers, plus an
+inverse index from MIDI note number to positions in compressed sparse row
+(CSR) form: the positions of MIDI note m are
+_position_order[_midi_offsets[m]:_midi_offsets[m + 1]] (flat indices into the
+matrix). Both directions are then array lookups, for one position or note or
+for whole sequences at once. The inverse index is only built when first needed,
+so building a tuning is cheap.
+
+todo:
+Invert string numbers to follow convention that high E is 1.
+"""
+
+from time import perf_counter
+from typing import List
+
+import numpy as np
+
+from chroma import Chroma
+from conversions import midis_to_notes, notes_to_midis
 from fretboard import FretboardPosition
-from notes import Note
+from notes import MIDI_MAX, Note, midi_to_note, note_to_midi
 
 
 # Standard tuning.
@@ -15,76 +37,225 @@ standard_tuning = [
     Note(Chroma.E, 4)
 ]
 
+drop_d_tuning = [Note(Chroma.D, 2)] + standard_tuning[1:]
+
+seven_string_tuning = [Note(Chroma.B, 1)] + standard_tuning
+
+eight_string_tuning = [Note(Chroma.F_SHARP, 1)] + seven_string_tuning
+
+bass_tuning = [
+    Note(Chroma.E, 1),
+    Note(Chroma.A, 1),
+    Note(Chroma.D, 2),
+    Note(Chroma.G, 2)
+]
+
+five_string_bass_tuning = [Note(Chroma.B, 0)] + bass_tuning
+
+# Re-entrant: the G string is higher than the C string next to it.
+ukulele_tuning = [
+    Note(Chroma.G, 4),
+    Note(Chroma.C, 4),
+    Note(Chroma.E, 4),
+    Note(Chroma.A, 4)
+]
+
+
 class GuitarTuning:
     """Guitar tuning: convert from string and fret to note and vice versa.
-    
-    todo:
-    Invert string numbers to follow convention that high E is 1.
-    Use MIDI note numbers instead to simplify?
+
+    String 1 is open_strings[0] (the lowest string in standard tuning); fret
+    0 is the open string.
     """
     def __init__(self, open_strings=standard_tuning, num_frets=21):
-        self._open_strings = open_strings
-        self._num_strings = len(open_strings)  # todo: validate at six? Or allow fewer for e.g. bass, ukelele?
-        self._num_frets = num_frets
-
-        # Build lookup tables to convert from position to note and vice versa.
-        # TODO: refactor to key on note and position i.e. tuples, not nested dict with separate chroma and octave.
-        # TODO: test changes using create_video.py.
-        self._positions_to_notes: Dict[FretboardPosition, Note] = {}
-        self._notes_to_positions: Dict[Note, List[FretboardPosition]] = {}
-        for string in range(1, self._num_strings + 1):
-            # Get open string.
-            chroma_open, octave_open = self._open_strings[string - 1]
-        
-            # Which index in chroma list is open string?
-            array_offset = chroma_list.index(chroma_open)
-            
-            # Fret 0 is the open string so loop over 0, 1, ..., num_frets.
-            for fret in range(self._num_frets + 1):
-                # Counting frets from that open string chroma, what is resulting
-                # chroma including octave offset?
-                octave_offset, array_index = divmod(fret + array_offset, len_chroma)
-                chroma = chroma_list[array_index]
-        
-                # Add octave offset to octave of open string.
-                octave = octave_open + octave_offset
-                
-                # Store lookup value for this position.
-                position = FretboardPosition(string, fret)
-                note = Note(chroma, octave)
-                self._positions_to_notes[position] = note
-
-                # If no entry for this note in inverse lookup, initialise it.
-                if note not in self._notes_to_positions.keys():
-                    self._notes_to_positions[note] = []
-                
-                # Now safe to add note to inverse lookup.
-                # Append because there may be multiple positions for the same note.
-                self._notes_to_positions[note].append(position)
-    
+        if not len(open_strings):
+            raise ValueError('open_strings must have at least one string.')
+        chromas, octaves = zip(*open_strings)
+        self._set_midis(_fret_midis(notes_to_midis(chromas, octaves)[np.newaxis], num_frets)[0])
+
+    @classmethod
+    def from_midis(cls, open_midis, num_frets=21):
+        """Tuning from the MIDI note number of each open string."""
+        return cls.many_from_midis([open_midis], num_frets)[0]
+
+    @classmethod
+    def many_from_midis(cls, open_midis, num_frets=21):
+        """Tunings from a (tunings x strings) array of open string MIDI note numbers.
+
+        The position matrices of all the tunings are built in one go.
+        """
+        tunings = []
+        for midis in _fret_midis(np.asarray(open_midis), num_frets):
+            tuning = cls.__new__(cls)
+            tuning._set_midis(midis)
+            tunings.append(tuning)
+        return tunings
+
+    def _set_midis(self, midis):
+        self._midis = midis
+        self._num_strings, num_positions = midis.shape
+        self._num_frets = num_positions - 1
+        self._position_order = None  # Inverse index: built on first use.
+        self._midi_offsets = None
+
+    def _build_inverse_index(self):
+        """Positions sorted by MIDI note number (then string, then fret), in CSR form."""
+        flat_midis = self._midis.ravel()
+        self._position_order = np.argsort(flat_midis, kind='stable').astype(np.int32)
+        self._midi_offsets = np.zeros(MIDI_MAX + 1, dtype=np.int32)
+        np.cumsum(np.bincount(flat_midis, minlength=MIDI_MAX), out=self._midi_offsets[1:])
+
+    @property
+    def num_strings(self) -> int:
+        return self._num_strings
+
+    @property
+    def num_frets(self) -> int:
+        return self._num_frets
+
+    @property
+    def midis(self) -> np.ndarray:
+        """MIDI note number of every position (read-only, strings x frets, fret 0 open)."""
+        return self._midis
+
+    @property
+    def open_strings(self) -> List[Note]:
+        return midis_to_notes(self._midis[:, 0])
+
     def note_to_positions(self, note: Note) -> List[FretboardPosition]:
         """Given a note (chroma and octave), return the corresponding positions."""
-        try:
-            return self._notes_to_positions[note]
-        except KeyError:
+        midi = note_to_midi(*note)
+        flat_indices = []
+        if 0 <= midi < MIDI_MAX:
+            if self._position_order is None:
+                self._build_inverse_index()
+            flat_indices = self._position_order[self._midi_offsets[midi]:self._midi_offsets[midi + 1]].tolist()
+        if not flat_indices:
             print(f'The note {note} is not available in this tuning.')
-    
+            return
+        return [FretboardPosition(*self._flat_index_to_position(i)) for i in flat_indices]
+
     def position_to_note(self, position: FretboardPosition) -> Note:
-        """Given a string and fret, return the corresponding note.
-        
-        todo: Change input validation to just check whether key is in lookup dict?
-        todo: typing
-        """
+        """Given a string and fret, return the corresponding note."""
         if position.fret < 0:
             raise ValueError(f'fret must be >= 0 (which represents the open string).')
 
         if position.fret > self._num_frets:
             raise ValueError(f'fret must be <= {self._num_frets}')
-        
+
         if position.string < 1:
             raise ValueError(f'string must be >= 1.')
-        
+
         if position.string > self._num_strings:
             raise ValueError(f'string must be <= {self._num_strings}.')
-        
-        return self._positions_to_notes[position]
+
+        return Note(*midi_to_note(int(self._midis[position.string - 1, position.fret])))
+
+    def positions_to_midis(self, positions) -> np.ndarray:
+        """MIDI note number of each position (sequence or N x 2 array of string, fret)."""
+        positions = np.asarray(positions, dtype=int).reshape(-1, 2)
+        strings, frets = positions[:, 0], positions[:, 1]
+        if len(positions):
+            if (frets.min() < 0) or (frets.max() > self._num_frets):
+                raise ValueError(f'frets must be in the range [0, {self._num_frets}].')
+            if (strings.min() < 1) or (strings.max() > self._num_strings):
+                raise ValueError(f'strings must be in the range [1, {self._num_strings}].')
+        return self._midis[strings - 1, frets]
+
+    def positions_to_notes(self, positions) -> List[Note]:
+        """Note of each position (sequence or N x 2 array of string, fret)."""
+        return midis_to_notes(self.positions_to_midis(positions))
+
+    def midis_to_positions(self, midis):
+        """Every position of each MIDI note number, in CSR form: (positions, offsets).
+
+        positions is an M x 2 array of (string, fret); the positions of
+        midis[i] are positions[offsets[i]:offsets[i + 1]] (none if the note
+        is out of range for this tuning).
+        """
+        if self._position_order is None:
+            self._build_inverse_index()
+        midis = np.asarray(midis, dtype=int).ravel()
+        midis = np.where((midis >= 0) & (midis < MIDI_MAX), midis, MIDI_MAX)  # Out of range: no positions.
+        starts = self._midi_offsets[midis]
+        counts = np.append(np.diff(self._midi_offsets), 0)[midis]
+        offsets = np.zeros(len(midis) + 1, dtype=int)
+        np.cumsum(counts, out=offsets[1:])
+
+        # Gather each note's run of the inverse index, all runs at once.
+        runs = np.repeat(starts - offsets[:-1], counts) + np.arange(offsets[-1])
+        strings, frets = self._flat_index_to_position(self._position_order[runs])
+        return np.stack([strings, frets], axis=1), offsets
+
+    def notes_to_positions(self, notes):
+        """Every position of each note (sequence of Notes), in CSR form: see midis_to_positions."""
+        if not len(notes):
+            return self.midis_to_positions([])
+        chromas, octaves = zip(*notes)
+        return self.midis_to_positions(notes_to_midis(chromas, octaves))
+
+    def _flat_index_to_position(self, flat_index):
+        string_index, fret = divmod(flat_index, self._num_frets + 1)
+        return string_index + 1, fret
+
+
+def _fret_midis(open_midis, num_frets):
+    """MIDI note number of every position (open string plus one per fret), per tuning.
+
+    open_midis is (tunings x strings); returns read-only (tunings x strings x frets).
+    """
+    if open_midis.ndim != 2 or not open_midis.shape[1]:
+        raise ValueError('Each tuning must have at least one string.')
+    if num_frets < 0:
+        raise ValueError('num_frets must be >= 0.')
+    if open_midis.size and ((open_midis.min() < 0) or (open_midis.max() + num_frets >= MIDI_MAX)):
+        raise ValueError(f'Every position must be a MIDI note number in the range [0, {MIDI_MAX - 1}].')
+    midis = (open_midis[:, :, np.newaxis] + np.arange(num_frets + 1)).astype(np.int16)
+    midis.setflags(write=False)
+    return midis
+
+
+def benchmark(num_tunings=1000, num_positions=100_000):
+    """Time building many tunings, and converting many positions in both directions."""
+    rng = np.random.default_rng(0)
+    open_midis = np.sort(rng.integers(28, 60, (num_tunings, 6)), axis=1)
+    start = perf_counter()
+    tunings = GuitarTuning.many_from_midis(open_midis)
+    print(f'{num_tunings} tunings (from MIDI, in one go): {1e3*(perf_counter() - start):.1f} ms')
+
+    open_notes = [midis_to_notes(midis) for midis in open_midis]
+    start = perf_counter()
+    tunings = [GuitarTuning(notes) for notes in open_notes]
+    print(f'{num_tunings} tunings (from notes): {1e3*(perf_counter() - start):.1f} ms')
+
+    tuning = tunings[0]
+    positions = np.stack([
+        rng.integers(1, tuning.num_strings + 1, num_positions),
+        rng.integers(0, tuning.num_frets + 1, num_positions)
+    ], axis=1)
+    start = perf_counter()
+    midis = tuning.positions_to_midis(positions)
+    print(f'{num_positions} positions -> MIDI: {1e3*(perf_counter() - start):.1f} ms')
+    start = perf_counter()
+    tuning.midis_to_positions(midis)
+    print(f'{num_positions} MIDI -> positions: {1e3*(perf_counter() - start):.1f} ms')
+    start = perf_counter()
+    [tuning.position_to_note(FretboardPosition(*position)) for position in positions.tolist()]
+    print(f'{num_positions} positions -> notes, one at a time: {1e3*(perf_counter() - start):.1f} ms')
+
+
+def main():
+    for name, open_strings, num_frets in [
+        ('Guitar', standard_tuning, 21),
+        ('Seven-string guitar', seven_string_tuning, 24),
+        ('Bass', bass_tuning, 20),
+        ('Ukulele', ukulele_tuning, 12),
+    ]:
+        tuning = GuitarTuning(open_strings, num_frets)
+        positions = tuning.note_to_positions(Note(Chroma.C, 4))
+        print(f'{name}: C4 at {", ".join(f"({p.string}, {p.fret})" for p in positions)}')
+    benchmark()
+
+
+if __name__ == '__main__':
+    main()
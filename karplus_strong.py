@@ -0,0 +1,434 @@
+"""
+karplus_strong.py
+
+Karplus-Strong string synthesis, processed a whole wavetable period at a time.
+
+The per-sample update
+
+    wavetable[j] = a*wavetable[j] + b*previous_value
+
+is equivalent to the recurrence y[n] = a*y[n - N] + b*y[n - 1] (N is the
+wavetable size), so every sample in a period depends only on the previous
+period plus a first-order low pass filter within the period. Long periods are
+solved one block at a time with scipy.signal.lfilter; short periods (where
+per-block overhead dominates) are solved in a single call with the full
+recurrence as the filter denominator.
+
+https://users.soe.ucsc.edu/~karplus/papers/digitar.pdf
+
+todo:
+Wrap up as class: WavetableGroup? (Nothing guitar specific.)
+    Maintains wavetable for each string, combines in single output.
+Ensure amplitude always in range [-1, 1], otherwise will clip.
+Animate wavetable modification (becomes travelling sine wave and amplitude decays).
+Possible to derive analytic expression for amplitude vs time?
+    See paper Karplus and Strong 1983.
+Arg for different initial wavetable options: white noise, +/-1, sine chirp, ...?
+"""
+
+from time import perf_counter
+
+import numpy as np
+from scipy.signal import lfilter
+
+fs = 44100  # Sampling frequency [Hz]
+
+# Wavetables at most this long are filtered in one call (cost grows with the
+# period); longer ones are filtered one period at a time (cost grows with the
+# number of periods).
+DIRECT_FORM_MAX_PERIOD = 100
+
+# In a batch (karplus_strong_batch), blocks are filtered for every voice at
+# once, which pays for shorter periods: only these go to the direct form.
+BATCH_DIRECT_FORM_MAX_PERIOD = 64
+
+# Amplitude (relative to the initial peak of 1) below which a note is
+# considered to have died away: -60 dB.
+AUDIBILITY_THRESHOLD = 1e-3
+
+# With a threshold, decay is only checked every this many samples (counted
+# from the start of the note), so where a note stops never depends on how it
+# was synthesised (alone or in a batch, with or without a cache).
+DECAY_CHECK_INTERVAL = 4096
+
+# Bump whenever a change here (or in how notes are plucked and mixed) changes
+# the audio produced: cached audio is keyed on it (see render_cache.py).
+SYNTHESIS_VERSION = 1
+
+
+def validate_smoothing_factor(smoothing_factor):
+    if (smoothing_factor < 0) or (smoothing_factor > 1):
+        raise ValueError(f'smoothing_factor must be in the range [0, 1].')
+
+
+def get_wavetable_size(frequency):
+    return np.floor(fs/frequency).astype(int)
+
+
+def initial_wavetable(wavetable_size, seed=None):
+    """Initial wavetable: random -1 or 1 (not anywhere in that range!).
+
+    With seed=None the global NumPy random state is used, as before.
+    """
+    rng = np.random if seed is None else np.random.RandomState(seed)
+    return (2*rng.randint(0, 2, wavetable_size) - 1).astype(np.float32)
+
+
+def karplus_strong_loop(frequency, smoothing_factor=0.5, seed=None):
+    """Karplus-Strong string synthesis, one sample at a time.
+
+    Reference implementation: kept to check and benchmark karplus_strong.
+    """
+    validate_smoothing_factor(smoothing_factor)
+
+    num_samples = 2*fs
+    wavetable_size = get_wavetable_size(frequency)
+    wavetable = initial_wavetable(wavetable_size, seed)
+
+    # Generate signal.
+    signal = np.zeros(num_samples, dtype=np.float32)
+    current_sample = 0
+    previous_value = 0
+    a = smoothing_factor
+    b = 1 - smoothing_factor
+    for i in range(num_samples):
+        wavetable[current_sample] = a*wavetable[current_sample] + b*previous_value
+        signal[i] = wavetable[current_sample]
+        previous_value = signal[i]
+        current_sample = (current_sample + 1) % wavetable_size
+
+    # Remove DC offset.
+    signal -= np.mean(signal)
+
+    return signal
+
+
+def _has_decayed(period, threshold):
+    """True if the last wavetable period has decayed below threshold.
+
+    Each new sample is a weighted average of two earlier ones (a + b = 1), so
+    every later sample lies between the minimum and maximum of the last
+    period. The DC component never decays, so the amplitude is measured about
+    the midpoint of that range.
+    """
+    return (threshold is not None) and (np.ptp(period)/2 < threshold)
+
+
+def _settled_level(period):
+    """Constant (DC) level that a decayed note has settled on."""
+    return (np.max(period) + np.min(period))/2
+
+
+def _filter_direct(wavetable, num_samples, a, b, threshold=None):
+    """Whole signal in one call: y[n] = a*x[n] + b*y[n - 1] + a*y[n - N].
+
+    With a threshold, filter DECAY_CHECK_INTERVAL samples at a time and stop early.
+    """
+    wavetable_size = len(wavetable)
+    excitation = np.zeros(num_samples)
+    excitation[:wavetable_size] = wavetable[:num_samples]
+    denominator = np.zeros(wavetable_size + 1)
+    denominator[0] = 1
+    denominator[1] -= b
+    denominator[wavetable_size] -= a
+    if threshold is None:
+        return lfilter([a], denominator, excitation)
+
+    chunks = []
+    state = np.zeros(wavetable_size)
+    for start in range(0, num_samples, DECAY_CHECK_INTERVAL):
+        chunk, state = lfilter([a], denominator, excitation[start:start + DECAY_CHECK_INTERVAL], zi=state)
+        chunks.append(chunk)
+        if _has_decayed(chunk[-wavetable_size:], threshold):
+            break
+    return np.concatenate(chunks)
+
+
+def _filter_blocks(wavetable, num_samples, a, b, threshold=None):
+    """One wavetable period per block: y[n] = b*y[n - 1] + a*y[n - N].
+
+    With a threshold, stop at the first multiple of DECAY_CHECK_INTERVAL
+    where the note has decayed below it.
+    """
+    wavetable_size = len(wavetable)
+    signal = np.empty(num_samples)
+    previous_block = wavetable.astype(np.float64)
+    previous_value = 0.0
+    next_check = DECAY_CHECK_INTERVAL
+    for start in range(0, num_samples, wavetable_size):
+        stop = min(start + wavetable_size, num_samples)
+        block, _ = lfilter([1.0], [1.0, -b], a*previous_block[:stop - start], zi=[b*previous_value])
+        signal[start:stop] = block
+        previous_block = block
+        previous_value = block[-1]
+        while (threshold is not None) and (next_check <= stop):
+            if (next_check >= wavetable_size) and _has_decayed(signal[next_check - wavetable_size:next_check], threshold):
+                return signal[:next_check]
+            next_check += DECAY_CHECK_INTERVAL
+    return signal
+
+
+def duration_to_samples(duration):
+    """Convert duration [s] to number of samples."""
+    return np.ceil(duration*fs).astype(int)
+
+
+def karplus_strong(frequency, smoothing_factor=0.5, seed=None, duration=2, threshold=None):
+    """
+    Karplus-Strong string synthesis.
+
+    Generates at most duration [s] of signal. With a threshold (amplitude
+    relative to the initial peak of 1, e.g. AUDIBILITY_THRESHOLD), stops as
+    soon as the note has decayed below it, so the result may be shorter.
+
+    Same output as karplus_strong_loop for the same seed (to float32 precision).
+    """
+    validate_smoothing_factor(smoothing_factor)
+    if duration < 0:
+        raise ValueError(f'duration must be >= 0, got {duration}.')
+
+    num_samples = duration_to_samples(duration)
+    if num_samples == 0:
+        return np.zeros(0, dtype=np.float32)
+    wavetable = initial_wavetable(get_wavetable_size(frequency), seed)
+
+    a = smoothing_factor
+    b = 1 - smoothing_factor
+    if len(wavetable) <= DIRECT_FORM_MAX_PERIOD:
+        signal = _filter_direct(wavetable, num_samples, a, b, threshold)
+    else:
+        signal = _filter_blocks(wavetable, num_samples, a, b, threshold)
+    signal = signal.astype(np.float32)
+
+    # Remove DC offset. If stopped early, remove the level the note settled
+    # on so that it ends at zero (no click).
+    if len(signal) < num_samples:
+        signal -= _settled_level(signal[-len(wavetable):])
+    else:
+        signal -= np.mean(signal)
+
+    return signal
+
+
+def karplus_strong_batch(frequencies, lengths, smoothing_factor=0.5, seeds=None, threshold=None):
+    """
+    Karplus-Strong synthesis of many voices at once.
+
+    Returns (signals, lengths): a (voices x samples) array with one row per
+    frequency, and the number of valid samples in each row (the rest is
+    zero). Voices are generated for at most lengths[i] samples, fewer if a
+    threshold is given and they decay below it first; voices that have
+    finished are dropped from the batch.
+
+    Wavetables of at most BATCH_DIRECT_FORM_MAX_PERIOD samples (and a lone
+    longer one) are filtered one voice at a time. The rest may all be
+    different sizes: time advances in blocks no longer than the shortest
+    active wavetable, so the delayed term y[n - N] is always already known and
+    each block is one gather plus one first-order lfilter along every row at
+    once, whatever the number of voices. The cost per sample does not depend
+    on the wavetable sizes.
+
+    Row i matches karplus_strong(frequencies[i], seed=seeds[i]) over its length.
+    """
+    validate_smoothing_factor(smoothing_factor)
+
+    frequencies = np.atleast_1d(np.asarray(frequencies, dtype=float))
+    num_voices = len(frequencies)
+    lengths = np.broadcast_to(np.asarray(lengths, dtype=int), (num_voices,)).copy()
+    if seeds is None:
+        seeds = [None]*num_voices
+    if len(seeds) != num_voices:
+        raise ValueError('seeds must have one entry per frequency.')
+    if num_voices == 0:
+        return np.zeros((0, 0), dtype=np.float32), lengths
+    num_samples = int(lengths.max())
+
+    # Ragged initial wavetables, zero-padded to the longest.
+    wavetable_sizes = get_wavetable_size(frequencies)
+    max_size = int(wavetable_sizes.max())
+    excitation = np.zeros((num_voices, max_size))
+    for i, (size, seed) in enumerate(zip(wavetable_sizes, seeds)):
+        excitation[i, :size] = initial_wavetable(size, seed)
+
+    # y[n] = a*x[n] + b*y[n - 1] + a*y[n - N], with max_size columns of zeros
+    # on the left so that y[n - N] can be gathered for every voice at once.
+    a = smoothing_factor
+    b = 1 - smoothing_factor
+    row_length = max_size + num_samples
+    padded = np.zeros((num_voices, row_length))
+    flat = padded.reshape(-1)
+
+    # Voices stopped early by the threshold remove the level they settled on
+    # as their DC offset (NaN: not stopped early, remove the mean instead).
+    settled_levels = np.full(num_voices, np.nan)
+
+    # Short wavetables are filtered one voice at a time in the direct form
+    # (one call each, as karplus_strong does); blocks for them would be short.
+    # So is a lone long one: a batch of one only adds the gathers.
+    single = wavetable_sizes <= BATCH_DIRECT_FORM_MAX_PERIOD
+    if np.count_nonzero(~single) == 1:
+        single[:] = True
+    for i in np.flatnonzero(single):
+        size = wavetable_sizes[i]
+        filter_voice = _filter_direct if size <= DIRECT_FORM_MAX_PERIOD else _filter_blocks
+        signal = filter_voice(excitation[i, :size], int(lengths[i]), a, b, threshold)
+        if len(signal) < lengths[i]:
+            lengths[i] = len(signal)
+            settled_levels[i] = _settled_level(signal[-size:])
+        padded[i, max_size:max_size + len(signal)] = signal
+
+    active = np.flatnonzero(~single)
+    previous_values = np.zeros((len(active), 1))
+    next_check = DECAY_CHECK_INTERVAL
+    start = 0
+    while (start < num_samples) and len(active):
+        # (Re)build the per-block lookups for the voices still sounding.
+        block_size = int(wavetable_sizes[active].min())
+        k = np.arange(block_size)
+        delayed_indices = (active*row_length + max_size - wavetable_sizes[active])[:, None] + k[None, :]
+
+        finished = np.zeros(len(active), dtype=bool)
+        while (start < num_samples) and not finished.any():
+            stop = min(start + block_size, num_samples)
+            size = stop - start
+            delayed = flat.take(delayed_indices[:, :size] + start)
+            if start < max_size:
+                overlap = min(stop, max_size) - start
+                delayed[:, :overlap] += excitation[active, start:start + overlap]
+            # First-order low pass within the block, as _filter_blocks, along every row.
+            block, _ = lfilter([a], [1.0, -b], delayed, axis=1, zi=b*previous_values)
+            padded[active, max_size + start:max_size + stop] = block
+            previous_values = block[:, -1:]
+            start = stop
+
+            # At each decay check, look at the last period of every voice
+            # (the last max_size samples, masked to each wavetable size).
+            finished = lengths[active] <= stop
+            while (threshold is not None) and (next_check <= stop):
+                window = padded[active, next_check:max_size + next_check]
+                in_period = np.arange(max_size)[None, :] >= (max_size - wavetable_sizes[active])[:, None]
+                high = np.max(np.where(in_period, window, -np.inf), axis=1)
+                low = np.min(np.where(in_period, window, np.inf), axis=1)
+                eligible = (wavetable_sizes[active] <= next_check) & ~finished
+                decayed = eligible & ((high - low)/2 < threshold)
+                lengths[active[decayed]] = next_check
+                settled_levels[active[decayed]] = ((high + low)/2)[decayed]
+                finished |= decayed
+                next_check += DECAY_CHECK_INTERVAL
+
+        active = active[~finished]
+        previous_values = previous_values[~finished]
+    num_samples = int(lengths.max())
+    signals = padded[:, max_size:max_size + num_samples].astype(np.float32)
+
+    # Remove DC offset (of each voice, over its own length), zero the rest.
+    for signal, length, settled_level in zip(signals, lengths, settled_levels):
+        if length > 0:
+            signal[:length] -= np.mean(signal[:length]) if np.isnan(settled_level) else np.float32(settled_level)
+        signal[length:] = 0
+    return signals, lengths
+
+
+def mix(signals, lengths, starts, num_samples):
+    """Add each voice into one output buffer at its start index (single scatter-add).
+
+    Samples that would land beyond num_samples are dropped.
+    """
+    lengths = np.broadcast_to(np.asarray(lengths, dtype=int), (len(signals),))
+    starts = np.asarray(starts, dtype=int)
+    offsets = np.arange(signals.shape[1])[None, :]
+    indices = starts[:, None] + offsets
+    valid = (offsets < lengths[:, None]) & (indices < num_samples)
+    output = np.bincount(indices[valid], weights=signals[valid], minlength=num_samples)
+    return output[:num_samples].astype(np.float32)
+
+
+def mix_buffers(buffers, starts, num_samples):
+    """Like mix, for a list of 1-D buffers of any lengths (single scatter-add)."""
+    if len(buffers) == 0:
+        return np.zeros(num_samples, dtype=np.float32)
+    lengths = np.array([len(buffer) for buffer in buffers])
+    ends = np.cumsum(lengths)
+    indices = np.arange(ends[-1]) + np.repeat(np.asarray(starts, dtype=int) - (ends - lengths), lengths)
+    values = np.concatenate(buffers)
+    valid = indices < num_samples
+    output = np.bincount(indices[valid], weights=values[valid], minlength=num_samples)
+    return output[:num_samples].astype(np.float32)
+
+
+def pluck(frequencies, starts, lengths, num_samples, smoothing_factor=0.5, seeds=None, threshold=None):
+    """Synthesise every voice in one batch and mix into an output of num_samples."""
+    signals, lengths = karplus_strong_batch(frequencies, lengths, smoothing_factor, seeds, threshold)
+    return mix(signals, lengths, starts, num_samples)
+
+
+def notes_per_second(synthesise, frequency, min_time=0.5):
+    """Call synthesise(frequency, seed=...) repeatedly, return calls per second."""
+    count = 0
+    start = perf_counter()
+    elapsed = 0
+    while elapsed < min_time:
+        synthesise(frequency, seed=count)
+        count += 1
+        elapsed = perf_counter() - start
+    return count/elapsed
+
+
+def benchmark():
+    """Notes per second: per-sample loop vs. block engine, 27.5 Hz (A0) to 4 kHz."""
+    frequencies = [27.5, 55, 110, 220, 440, 880, 1760, 4000]
+    print(f'{"f [Hz]":>8} {"loop":>10} {"blocks":>10} {"speedup":>8} {"max error":>10}')
+    for frequency in frequencies:
+        error = np.max(np.abs(karplus_strong(frequency, seed=0) - karplus_strong_loop(frequency, seed=0)))
+        loop_rate = notes_per_second(karplus_strong_loop, frequency, min_time=0.1)
+        block_rate = notes_per_second(karplus_strong, frequency)
+        print(f'{frequency:8.1f} {loop_rate:10.2f} {block_rate:10.1f} {block_rate/loop_rate:7.0f}x {error:10.2e}')
+
+
+def _time_per_voice_and_batch(frequencies, seeds, repeats=5):
+    """Best time [s] of one karplus_strong call per voice, and of one batch, 2 s notes."""
+    def per_voice():
+        for frequency, seed in zip(frequencies, seeds):
+            karplus_strong(frequency, seed=seed)
+
+    def batch():
+        karplus_strong_batch(frequencies, 2*fs, seeds=seeds)
+
+    times = []
+    for synthesise in [per_voice, batch]:
+        best = np.inf
+        for _ in range(repeats):
+            start = perf_counter()
+            synthesise()
+            best = min(best, perf_counter() - start)
+        times.append(best)
+    return times
+
+
+def benchmark_batch():
+    """Voices per second: one karplus_strong call per voice vs. one batch, 2 s notes.
+
+    Random voices in the guitar range, then six voices (a chord's worth) at
+    one pitch each, from A0 up: the batch should win at every pitch.
+    """
+    rng = np.random.default_rng(0)
+    print(f'{"voices":>8} {"per voice":>10} {"batch":>10} {"speedup":>8}')
+    for num_voices in [1, 6, 24, 96]:
+        midi = rng.integers(40, 77, num_voices)  # Guitar range, E2 to E5.
+        frequencies = 440*2**((midi - 69)/12)
+        per_voice_time, batch_time = _time_per_voice_and_batch(frequencies, list(range(num_voices)))
+        print(f'{num_voices:8d} {num_voices/per_voice_time:10.1f} {num_voices/batch_time:10.1f} {per_voice_time/batch_time:7.1f}x')
+
+    print(f'{"f [Hz]":>8} {"per voice":>10} {"batch":>10} {"speedup":>8}  (6 voices)')
+    for frequency in [27.5, 55, 82.4, 110, 220, 330, 440, 880]:
+        per_voice_time, batch_time = _time_per_voice_and_batch([frequency]*6, list(range(6)))
+        print(f'{frequency:8.1f} {6/per_voice_time:10.1f} {6/batch_time:10.1f} {per_voice_time/batch_time:7.1f}x')
+
+
+def main():
+    benchmark()
+    benchmark_batch()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,259 @@
+"""
+keyboard_renderer.py
+
+Render frames of a piano keyboard (any range of keys, by default the full 88
+from A0 to C8) with given keys highlighted, fast enough to make piano-view
+videos at frame rate alongside the fretboard.
+
+The outline of every key is computed once, with NumPy, from the one-octave
+shapes in keyboard.get_key_vertices_lookup (shifted by octave; the keys at
+each end squared off where they have no black neighbour). The keyboard with
+no keys highlighted is drawn once into a cached surface; each frame is a copy
+of it with only the highlighted keys drawn again on top.
+
+todo:
+Labels on keys (note names, scale degrees, fingering).
+"""
+
+import math
+import os
+import os.path
+from time import perf_counter
+from typing import Dict, Iterable, Union
+
+import cairo
+import numpy as np
+
+from frame_buffer import FrameBuffer, surface_to_buffer
+from frame_writer import FrameWriter
+from chroma import chroma_list, len_chroma
+from keyboard import Colour, KeyboardDimensions, get_key_vertices_lookup, is_black_key
+
+MIDI_A0 = 21
+MIDI_C8 = 108
+
+white = Colour(1, 1, 1)
+black = Colour(0, 0, 0)
+grey = Colour(0.8, 0.8, 0.8)
+blue = Colour(0, 0, 1)
+line_width = 3
+folder = 'data'
+
+golden_ratio = 2/(1 + math.sqrt(5))
+white_keys_per_octave = 7
+
+
+def get_octave_dimensions() -> KeyboardDimensions:
+    """Dimensions of one octave, in units of white key width (black key height as a fraction of key height)."""
+    black_key_width = golden_ratio
+    return KeyboardDimensions(
+        num_octaves=1,
+        white_key_width=1,
+        black_key_width=black_key_width,
+        black_key_height=golden_ratio,
+        offset_1=black_key_width/6,
+        offset_2=black_key_width/4
+    )
+
+
+def get_key_vertices(first_midi=MIDI_A0, last_midi=MIDI_C8):
+    """Outline of every key from first_midi to last_midi (inclusive), normalised to [0, 1] in x and y.
+
+    Returns (vertices, counts): vertices is keys x most vertices x 2 (x, y),
+    padded by repeating each key's last vertex; counts is the number of
+    vertices of each key.
+    """
+    if is_black_key(chroma_list[first_midi % len_chroma]) or is_black_key(chroma_list[last_midi % len_chroma]):
+        raise ValueError('The keyboard must start and end on white keys.')
+
+    # One octave: vertices of each chroma (C first), padded to the same length.
+    lookup = get_key_vertices_lookup(get_octave_dimensions())
+    max_vertices = max(len(vertices) for vertices in lookup.values())
+    templates = np.zeros((len_chroma, max_vertices, 2))
+    template_counts = np.zeros(len_chroma, dtype=int)
+    for i, chroma in enumerate(chroma_list):
+        points = np.array([(point.x, point.y) for point in lookup[chroma]])
+        templates[i, :len(points)] = points
+        templates[i, len(points):] = points[-1]
+        template_counts[i] = len(points)
+
+    # Every key at once: template shifted by its octave.
+    midis = np.arange(first_midi, last_midi + 1)
+    chroma_indices = midis % len_chroma
+    octaves = midis//len_chroma
+    vertices = templates[chroma_indices].copy()
+    vertices[:, :, 0] += white_keys_per_octave*octaves[:, np.newaxis]
+
+    # Square off the ends: no black key beyond the first and last keys.
+    for key, side in [(0, 'left'), (-1, 'right')]:
+        x = vertices[key, :, 0]
+        white_left = np.floor(x.min() + 0.5)
+        white_right = white_left + 1
+        if side == 'left':
+            x[x < white_left + 0.5] = white_left
+        else:
+            x[x > white_left + 0.5] = white_right
+
+    # Normalise: x from the left edge of the first key to the right edge of the last.
+    left = vertices[0, :, 0].min()
+    right = vertices[-1, :, 0].max()
+    vertices[:, :, 0] = (vertices[:, :, 0] - left)/(right - left)
+    return vertices, template_counts[chroma_indices]
+
+
+class KeyboardRenderer:
+    """Keyboard frames with given keys highlighted, the unhighlighted keyboard drawn only once.
+
+    box (left, top, right, bottom) in pixels is where the keyboard goes in
+    the image (default: as keyboard.main). render() draws into one frame
+    surface that is reused for every frame: use (or copy) each frame before
+    rendering the next. To draw into a surface shared with other views (see
+    layout.py), use draw_static and draw_highlights: the renderer's own
+    surfaces are only made when first needed.
+    """
+    def __init__(self, width=2220, height=1080, box=None, first_midi=MIDI_A0, last_midi=MIDI_C8, background=grey):
+        if box is None:
+            padding_horizontal = 200
+            padding_vertical = 100
+            box = (padding_horizontal, padding_vertical, width - padding_horizontal, height/2 - padding_vertical)
+        self.width = width
+        self.height = height
+        self.first_midi = first_midi
+        self.last_midi = last_midi
+        self._background = background
+
+        # Every key's outline in pixels, as plain lists ready for drawing.
+        vertices, counts = get_key_vertices(first_midi, last_midi)
+        left, top, right, bottom = box
+        vertices[:, :, 0] = left + vertices[:, :, 0]*(right - left)
+        vertices[:, :, 1] = top + vertices[:, :, 1]*(bottom - top)
+        self._vertices = vertices
+        self._outlines = [key[:count].tolist() for key, count in zip(vertices, counts)]
+        self._is_black = [is_black_key(chroma_list[midi % len_chroma]) for midi in range(first_midi, last_midi + 1)]
+
+        self._base = None
+        self._frame = None
+
+    @property
+    def num_keys(self):
+        return len(self._outlines)
+
+    @property
+    def vertices(self) -> np.ndarray:
+        """Outline of every key in pixels (keys x vertices x 2, padded: see get_key_vertices)."""
+        return self._vertices
+
+    def _ensure_surfaces(self):
+        """Make the cached base and the frame surface, the first time they are needed."""
+        if self._frame is None:
+            self._base = self._draw_base()
+            self._frame = cairo.ImageSurface(cairo.FORMAT_RGB24, self.width, self.height)
+            self._context = cairo.Context(self._frame)
+            self._buffer = surface_to_buffer(self._frame)
+
+    def _draw_base(self):
+        surface = cairo.ImageSurface(cairo.FORMAT_RGB24, self.width, self.height)
+        context = cairo.Context(surface)
+        context.set_source_rgb(*self._background)
+        context.paint()
+        self.draw_static(context)
+        surface.flush()
+        return surface
+
+    def draw_static(self, context):
+        """Draw every key, none highlighted (no background), into context."""
+        context.set_antialias(cairo.ANTIALIAS_BEST)
+        context.set_line_width(line_width)
+        for i in range(self.num_keys):
+            self._draw_key(context, i, black if self._is_black[i] else white)
+
+    def _draw_key(self, context, i, colour):
+        """Fill the key then stroke its outline (one path)."""
+        outline = self._outlines[i]
+        context.move_to(*outline[0])
+        for x, y in outline[1:]:
+            context.line_to(x, y)
+        context.close_path()
+        context.set_source_rgb(*colour)
+        context.fill_preserve()
+        context.set_source_rgb(*black)
+        context.stroke()
+
+    def render(self, highlights: Union[Dict[int, Colour], Iterable[int]]) -> cairo.ImageSurface:
+        """Frame with the given keys highlighted: the reused frame surface.
+
+        highlights is MIDI note numbers (all in blue), or a dict of MIDI note
+        number to colour.
+        """
+        self._ensure_surfaces()
+        context = self._context
+        context.set_operator(cairo.OPERATOR_SOURCE)
+        context.set_source_surface(self._base, 0, 0)
+        context.paint()
+
+        context.set_operator(cairo.OPERATOR_OVER)
+        self.draw_highlights(context, highlights)
+        self._frame.flush()
+        return self._frame
+
+    def draw_highlights(self, context, highlights: Union[Dict[int, Colour], Iterable[int]]):
+        """Draw the given keys again, highlighted (as render), into context."""
+        if not isinstance(highlights, dict):
+            highlights = {midi: blue for midi in highlights}
+        context.set_antialias(cairo.ANTIALIAS_BEST)
+        context.set_line_width(line_width)
+        for midi, colour in highlights.items():
+            if not self.first_midi <= midi <= self.last_midi:
+                raise ValueError(f'MIDI note {midi} is not on this keyboard ({self.first_midi} to {self.last_midi}).')
+            self._draw_key(context, midi - self.first_midi, colour)
+
+    @property
+    def buffer(self) -> FrameBuffer:
+        """View of the frame surface's pixels (no copy): holds the latest render."""
+        self._ensure_surfaces()
+        return self._buffer
+
+    def render_frames(self, highlight_sets):
+        """Yield one frame per set of highlights (the same surface each time: see render)."""
+        for highlights in highlight_sets:
+            yield self.render(highlights)
+
+    def write_video(self, highlight_sets, filepath, fps=25):
+        """Render each set of highlights to one frame of a video (or GIF); return the number written.
+
+        Each frame goes to the encoder straight from the frame surface (see buffer).
+        """
+        with FrameWriter(filepath, fps) as writer:
+            for _ in self.render_frames(highlight_sets):
+                writer.write(self._buffer)
+            return writer.num_frames
+
+
+def benchmark(num_frames=200, max_keys=6, seed=0):
+    """Frames per second at 2220 x 1080 (88 keys, up to max_keys highlighted per frame)."""
+    rng = np.random.default_rng(seed)
+    highlight_sets = [
+        rng.choice(np.arange(MIDI_A0, MIDI_C8 + 1), int(rng.integers(1, max_keys + 1)), replace=False).tolist()
+        for _ in range(num_frames)
+    ]
+    start = perf_counter()
+    renderer = KeyboardRenderer()
+    renderer.render([])  # Draws the cached layer.
+    setup_seconds = perf_counter() - start
+    start = perf_counter()
+    for frame in renderer.render_frames(highlight_sets):
+        pass
+    seconds = perf_counter() - start
+    print(f'{num_frames/seconds:.1f} frames/s (plus {1e3*setup_seconds:.1f} ms to build the renderer once)')
+
+
+def main():
+    renderer = KeyboardRenderer()
+    A5 = [45, 52, 57]  # A2, E3, A3 (as keyboard.main: A5 power chord "577xxx").
+    os.makedirs(folder, exist_ok=True)
+    renderer.render(A5).write_to_png(os.path.join(folder, 'keyboard.png'))
+    benchmark()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,230 @@
+"""
+layout.py
+
+Frames showing several views of the same music at once (tab, fretboard and
+keyboard), each in its own region of one shared surface, sized for phone,
+tablet or laptop screens.
+
+Regions are bounding boxes normalised to [0, 1] of the frame ((left, top,
+right, bottom)), scaled to pixels for each screen size. Every view's static
+layer (staff lines, neck, unlit keys) is drawn once into one base surface. A
+frame is one copy of the base, then each view's highlights (tab page and
+cursor, markers, lit keys) drawn on top, in one pass into one reused frame
+surface: so it costs one full-frame copy however many views there are, plus
+the (small) highlights.
+
+Layouts are cached per preset (get_layout): the static layers are drawn once
+per screen size and set of views.
+
+todo:
+Sheet music view.
+Portrait presets.
+Titles (exercise name, BPM).
+"""
+
+from functools import lru_cache
+from time import perf_counter
+from typing import Dict, FrozenSet, NamedTuple, Optional, Tuple
+
+import cairo
+import numpy as np
+
+from chroma import Chroma
+from frame_buffer import FrameBuffer, surface_to_buffer
+from fretboard_renderer import FretboardRenderer
+from keyboard_renderer import KeyboardRenderer
+from scales import ScaleType
+from tab_renderer import TabRenderer
+from timeline import NO_STRING
+from video_renderer import render_video, scale_timeline
+
+white = (1, 1, 1)
+
+Box = Tuple[float, float, float, float]
+
+
+class LayoutPreset(NamedTuple):
+    width: int
+    height: int
+    regions: Dict[str, Box]  # View name ('tab', 'fretboard' or 'keyboard') to normalised box.
+
+
+landscape_regions = {
+    'tab': (0.04, 0.02, 0.96, 0.28),
+    'fretboard': (0.02, 0.30, 0.98, 0.62),
+    'keyboard': (0.04, 0.66, 0.96, 0.98),
+}
+tablet_regions = {
+    'tab': (0.04, 0.02, 0.96, 0.24),
+    'fretboard': (0.02, 0.27, 0.98, 0.55),
+    'keyboard': (0.04, 0.62, 0.96, 0.90),
+}
+
+presets = {
+    'phone': LayoutPreset(2220, 1080, landscape_regions),
+    'tablet': LayoutPreset(2160, 1620, tablet_regions),
+    'laptop': LayoutPreset(2560, 1600, landscape_regions),
+}
+all_views = ('tab', 'fretboard', 'keyboard')
+
+
+class LayoutFrame(NamedTuple):
+    """What every view shows in one frame (hashable: equal states give identical frames)."""
+    positions: FrozenSet[Tuple[int, int]] = frozenset()  # Fretboard markers (string, fret).
+    midis: FrozenSet[int] = frozenset()  # Keys lit.
+    tab_page: Tuple = ()  # Columns of (string, fret), see tab_renderer.
+    tab_column: Optional[int] = None  # Cursor (index in tab_page).
+
+
+def to_pixels(box: Box, width, height):
+    """Normalised box to pixels."""
+    left, top, right, bottom = box
+    return (left*width, top*height, right*width, bottom*height)
+
+
+class Layout:
+    """Views in regions of one frame: static layers drawn once, every view's highlights in one pass.
+
+    regions maps view name to normalised box; views without a region are
+    left out. render() draws into one frame surface that is reused for
+    every frame: use (or copy) each frame before rendering the next.
+    """
+    def __init__(self, width, height, regions, background=white, columns_per_page=16):
+        unknown = set(regions) - set(all_views)
+        if unknown:
+            raise ValueError(f'Unknown views {sorted(unknown)}: use {", ".join(all_views)}.')
+        self.width = width
+        self.height = height
+        self.tab = None
+        self.fretboard = None
+        self.keyboard = None
+        if 'tab' in regions:
+            self.tab = TabRenderer(to_pixels(regions['tab'], width, height), columns_per_page=columns_per_page, background=background)
+        if 'fretboard' in regions:
+            self.fretboard = FretboardRenderer(width, height, box=to_pixels(regions['fretboard'], width, height))
+        if 'keyboard' in regions:
+            self.keyboard = KeyboardRenderer(width, height, box=to_pixels(regions['keyboard'], width, height), background=background)
+
+        self._base = cairo.ImageSurface(cairo.FORMAT_RGB24, width, height)
+        context = cairo.Context(self._base)
+        context.set_source_rgb(*background)
+        context.paint()
+        for view in [self.tab, self.fretboard, self.keyboard]:
+            if view is not None:
+                view.draw_static(context)
+        self._base.flush()
+
+        self._frame = cairo.ImageSurface(cairo.FORMAT_RGB24, width, height)
+        self._context = cairo.Context(self._frame)
+        self._buffer = surface_to_buffer(self._frame)
+
+    @property
+    def buffer(self) -> FrameBuffer:
+        """View of the frame surface's pixels (no copy): holds the latest render."""
+        return self._buffer
+
+    def render(self, frame: LayoutFrame) -> cairo.ImageSurface:
+        """Frame with every view's highlights: the reused frame surface."""
+        context = self._context
+        context.set_operator(cairo.OPERATOR_SOURCE)
+        context.set_source_surface(self._base, 0, 0)
+        context.paint()
+
+        context.set_operator(cairo.OPERATOR_OVER)
+        if self.tab is not None:
+            self.tab.draw_page(context, frame.tab_page, frame.tab_column)
+        if self.fretboard is not None:
+            self.fretboard.draw_markers(context, frame.positions)
+        if self.keyboard is not None:
+            self.keyboard.draw_highlights(context, frame.midis)
+        self._frame.flush()
+        return self._frame
+
+
+@lru_cache(maxsize=None)
+def get_layout(preset='phone', views=all_views) -> Layout:
+    """Layout for a preset screen (see presets) with the given views, built once and cached."""
+    width, height, regions = presets[preset]
+    return Layout(width, height, {view: regions[view] for view in views})
+
+
+def timeline_tab_pages(timeline, columns_per_page):
+    """Tab of a timeline: (column onsets, pages), one column per distinct onset.
+
+    Each column is the positions (string, fret) starting at its onset
+    (events without a position are left out); pages are tuples of up to
+    columns_per_page columns.
+    """
+    column_onsets, first_events = np.unique(timeline.onsets, return_index=True)
+    bounds = np.append(first_events, len(timeline)).tolist()
+    strings = timeline.strings.tolist()
+    frets = timeline.frets.tolist()
+    columns = [
+        tuple((strings[i], frets[i]) for i in range(start, stop) if strings[i] != NO_STRING)
+        for start, stop in zip(bounds[:-1], bounds[1:])
+    ]
+    pages = [tuple(columns[i:i + columns_per_page]) for i in range(0, len(columns), columns_per_page)]
+    return column_onsets, pages
+
+
+class LayoutFrames:
+    """Frames of a timeline in a layout (a frame source for video_renderer.render_video)."""
+    def __init__(self, timeline, layout):
+        self._timeline = timeline
+        self._layout = layout
+        self._columns_per_page = layout.tab.columns_per_page if layout.tab is not None else 1
+        self._column_onsets, self._pages = timeline_tab_pages(timeline, self._columns_per_page)
+
+    def state_at(self, t) -> LayoutFrame:
+        positions = frozenset(self._timeline.positions_at(t)) if self._layout.fretboard is not None else frozenset()
+        midis = frozenset(self._timeline.midis_at(t).tolist()) if self._layout.keyboard is not None else frozenset()
+        if (self._layout.tab is None) or not self._pages:
+            return LayoutFrame(positions, midis)
+        column = int(np.searchsorted(self._column_onsets, t, side='right')) - 1
+        if column < 0:
+            return LayoutFrame(positions, midis, self._pages[0], None)
+        page, column_in_page = divmod(column, self._columns_per_page)
+        return LayoutFrame(positions, midis, self._pages[page], column_in_page)
+
+    def render(self, state: LayoutFrame) -> FrameBuffer:
+        self._layout.render(state)
+        return self._layout.buffer
+
+
+def render_layout_video(timeline, filename, preset='phone', views=all_views, fps=30, audio=True, **audio_kwargs):
+    """Render timeline to a video of the given views, sized for preset; return a VideoRenderReport."""
+    frames = LayoutFrames(timeline, get_layout(preset, tuple(views)))
+    return render_video(timeline, filename, fps, audio=audio, frames=frames, **audio_kwargs)
+
+
+def benchmark(num_frames=200, repeats=4, bpm=120):
+    """Frames per second for each preset: fretboard alone vs. tab, fretboard and keyboard together.
+
+    Frames are the changing frames of a scale (every one is rendered, none
+    repeated); layout setup (static layers) is timed separately.
+    """
+    timeline = scale_timeline(ScaleType.MINOR_PENTATONIC, Chroma.A, bpm, repeats)
+    print(f'{"preset":>7} {"views":>26} {"setup [ms]":>11} {"frames/s":>9}')
+    for preset in presets:
+        for views in [('fretboard',), all_views]:
+            start = perf_counter()
+            layout = get_layout(preset, views)
+            setup_seconds = perf_counter() - start
+            frames = LayoutFrames(timeline, layout)
+            states = [frames.state_at(t) for t in np.linspace(0, timeline.end, num_frames, endpoint=False).tolist()]
+            start = perf_counter()
+            for state in states:
+                frames.render(state)
+            seconds = perf_counter() - start
+            print(f'{preset:>7} {" + ".join(views):>26} {1e3*setup_seconds:11.1f} {num_frames/seconds:9.1f}')
+
+
+def main():
+    timeline = scale_timeline(ScaleType.MINOR_PENTATONIC, Chroma.A, 120)
+    for preset in presets:
+        print(render_layout_video(timeline, f'layout-{preset}.mp4', preset))
+    benchmark()
+
+
+if __name__ == '__main__':
+    main()
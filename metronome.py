@@ -1,20 +1,223 @@
 """
 metronome.py
 
-Experimenting with metronome using link below.
+Click track: a click on every beat, accented on the first beat of each bar,
+placed at exact sample offsets, for mixing into the audio of a video or for
+playing in real time.
 
-https://stackoverflow.com/questions/51389691/how-can-i-do-a-precise-metronome
+The clicks (accented and unaccented) are synthesised once. Beat n starts at
+sample start + round(n*60*sample_rate/bpm), computed with integers (the BPM
+as a fraction), so every click is within half a sample of its exact time
+however many beats come before it: no drift accumulates, unlike adding a
+rounded beat length (or sleeping for one) beat after beat.
 
-Easier and cleaner to insert into videos instead?
+Audio is produced block by block (ClickTrack.render(block_start, length)
+finds the beats overlapping any block directly, without keeping state), so a
+click track can be mixed into another stream of blocks (ClickTrack.mix), or
+be endless.
+
+Real time (play): blocks are written to an audio sink (raw PCM, e.g. aplay),
+whose blocking writes pace the loop. Time is the number of samples written
+(the audio clock), never sleep() or the wall clock.
+
+See check_drift for the drift over 10,000 beats. The original experiment
+(correcting sleep() drift with perf_counter, after
+https://stackoverflow.com/questions/51389691/how-can-i-do-a-precise-metronome)
+is kept for comparison as sleep_drift.
+
+todo:
+Subdivisions (eighths, triplets) and count-in bars.
+Tempo changes (beat times from a tempo map).
 """
 
-from time import sleep, perf_counter
+from fractions import Fraction
+import math
+from time import perf_counter, sleep
+from typing import NamedTuple
 
-def main():
-    delay = d = 0.2
-    print(60 / delay, 'bpm')
+import numpy as np
+
+from audio_stream import BLOCK_SIZE
+from karplus_strong import fs
+
+
+class TimeSignature(NamedTuple):
+    beats_per_bar: int = 4
+    beat_unit: int = 4  # BPM counts these beats.
+
+    def __str__(self):
+        return f'{self.beats_per_bar}/{self.beat_unit}'
+
+
+common_time = TimeSignature(4, 4)
+
+
+class ClickSounds(NamedTuple):
+    accent: np.ndarray  # First beat of the bar.
+    normal: np.ndarray
+
+
+def make_click(frequency, gain, duration=0.03, decay=0.005, sample_rate=fs):
+    """Short decaying tone (float32): starts at full gain (cosine), so its first sample marks the beat."""
+    t = np.arange(int(duration*sample_rate))/sample_rate
+    return (gain*np.cos(2*math.pi*frequency*t)*np.exp(-t/decay)).astype(np.float32)
+
+
+def make_click_sounds(sample_rate=fs, gain=0.5):
+    """Accented click higher and louder than the others."""
+    return ClickSounds(make_click(1500, gain, sample_rate=sample_rate), make_click(1000, 0.6*gain, sample_rate=sample_rate))
+
+
+class ClickTrack:
+    """Clicks at bpm from sample start (beat 0), num_beats of them (None: endless).
+
+    The BPM is taken as a fraction (to within 1/1000 BPM), so beat times are
+    exact integer arithmetic (see module docstring).
+    """
+    def __init__(self, bpm, time_signature=common_time, start=0, num_beats=None, sample_rate=fs, sounds=None):
+        if bpm <= 0:
+            raise ValueError(f'BPM must be > 0, got {bpm}.')
+        self.bpm = bpm
+        self.time_signature = time_signature
+        self.start = int(start)
+        self.num_beats = num_beats
+        self.sample_rate = sample_rate
+        self.sounds = make_click_sounds(sample_rate) if sounds is None else sounds
+        self.click_length = max(len(self.sounds.accent), len(self.sounds.normal))
+
+        # Samples per beat = 60*sample_rate/bpm = _numerator/_denominator exactly.
+        bpm_fraction = Fraction(bpm).limit_denominator(1000)
+        self._numerator = 60*sample_rate*bpm_fraction.denominator
+        self._denominator = bpm_fraction.numerator
+        self.samples_per_beat = self._numerator/self._denominator
+
+    def beat_samples(self, beats) -> np.ndarray:
+        """Sample index of the start of each beat (beat 0 at start), rounded to the nearest sample."""
+        beats = np.asarray(beats, dtype=np.int64)
+        return self.start + (2*beats*self._numerator + self._denominator)//(2*self._denominator)
+
+    def is_accent(self, beats) -> np.ndarray:
+        return np.asarray(beats) % self.time_signature.beats_per_bar == 0
+
+    @property
+    def num_samples(self):
+        """Samples to the end of the last click (None if endless)."""
+        if self.num_beats is None:
+            return None
+        return int(self.beat_samples(self.num_beats - 1)) + self.click_length if self.num_beats else self.start
+
+    def beats_between(self, first_sample, last_sample) -> np.ndarray:
+        """Beats starting in [first_sample, last_sample)."""
+        first = max(math.floor((first_sample - self.start)/self.samples_per_beat) - 1, 0)
+        last = math.ceil((last_sample - self.start)/self.samples_per_beat) + 1
+        if self.num_beats is not None:
+            last = min(last, self.num_beats)
+        beats = np.arange(first, max(last, first))
+        samples = self.beat_samples(beats)
+        return beats[(first_sample <= samples) & (samples < last_sample)]
+
+    def render(self, block_start, length) -> np.ndarray:
+        """Clicks sounding in samples [block_start, block_start + length), as a float32 block."""
+        block = np.zeros(length, dtype=np.float32)
+        beats = self.beats_between(block_start - self.click_length + 1, block_start + length)
+        for sample, accent in zip(self.beat_samples(beats).tolist(), self.is_accent(beats).tolist()):
+            sound = self.sounds.accent if accent else self.sounds.normal
+            first = max(block_start - sample, 0)
+            last = min(block_start + length - sample, len(sound))
+            block[sample + first - block_start:sample + last - block_start] += sound[first:last]
+        return block
+
+    def blocks(self, num_samples=None, block_size=BLOCK_SIZE):
+        """Yield the click track block_size samples at a time, up to num_samples (default: the end; endless if num_beats is None)."""
+        if num_samples is None:
+            num_samples = self.num_samples
+        block_start = 0
+        while (num_samples is None) or (block_start < num_samples):
+            length = block_size if num_samples is None else min(block_size, num_samples - block_start)
+            yield self.render(block_start, length)
+            block_start += length
+
+    def mix(self, blocks, gain=1.0):
+        """Add the click track into a stream of blocks (from sample 0, any block sizes), block by block."""
+        block_start = 0
+        for block in blocks:
+            clicks = self.render(block_start, len(block))
+            yield block + (clicks if gain == 1 else gain*clicks)
+            block_start += len(block)
+
+
+def play(click_track, sink, num_samples=None, block_size=BLOCK_SIZE, on_beat=None):
+    """Play click_track in real time: write its blocks to sink (a binary file, e.g. playback.open_raw_player().stdin).
+
+    The sink's blocking writes set the pace; no sleeping. on_beat(beat,
+    accent, sample) is called as the block holding each beat is handed
+    over (it is heard the sink's buffering later). Returns the samples written.
+    """
+    samples_written = 0
+    for block in click_track.blocks(num_samples, block_size):
+        if on_beat is not None:
+            beats = click_track.beats_between(samples_written, samples_written + len(block))
+            for beat, sample, accent in zip(beats.tolist(), click_track.beat_samples(beats).tolist(), click_track.is_accent(beats).tolist()):
+                on_beat(beat, accent, sample)
+        sink.write(block.astype('<f4').tobytes())
+        samples_written += len(block)
+    sink.flush()
+    return samples_written
+
+
+def find_click_onsets(blocks, gap):
+    """First sample of each click in a stream of blocks: non-zero after at least gap silent samples."""
+    onsets = []
+    last_nonzero = -gap - 1
+    block_start = 0
+    for block in blocks:
+        nonzero = np.flatnonzero(block) + block_start
+        if len(nonzero):
+            previous = np.concatenate([[last_nonzero], nonzero[:-1]])
+            onsets.append(nonzero[nonzero - previous > gap])
+            last_nonzero = nonzero[-1]
+        block_start += len(block)
+    return np.concatenate(onsets) if onsets else np.zeros(0, dtype=np.int64)
+
+
+def check_drift(bpms=(97, 133.3, 187.5), num_beats=10_000, time_signature=TimeSignature(7, 8)):
+    """Render num_beats clicks block by block, find every click in the audio, and compare with its exact time.
+
+    Passes if every click is found, on the right sound, within half a sample
+    of n*60*fs/bpm (zero cumulative drift). For comparison: the drift from
+    adding the beat length rounded to a whole sample, beat after beat.
+    Returns True if every BPM passes.
+    """
+    passed = True
+    print(f'{"BPM":>7} {"beats":>6} {"found":>6} {"max error [samples]":>20} {"drift [samples]":>16} {"rounded beats drift [ms]":>25} {"render [s]":>11}')
+    for bpm in bpms:
+        track = ClickTrack(bpm, time_signature, num_beats=num_beats)
+        start = perf_counter()
+        onsets = find_click_onsets(track.blocks(), gap=track.click_length)
+        seconds = perf_counter() - start
+
+        beats = np.arange(num_beats)
+        exact = track.start + beats*track.samples_per_beat
+        found = len(onsets) == num_beats
+        errors = onsets - exact if found else np.array([np.inf])
+        drift = errors[-1] - errors[0]
+        accents = found and np.all(np.isclose(
+            np.array([track.render(int(onset), 1)[0] for onset in onsets[:2*time_signature.beats_per_bar]]),
+            np.where(track.is_accent(beats[:2*time_signature.beats_per_bar]), track.sounds.accent[0], track.sounds.normal[0])
+        ))
+        rounded_drift_ms = 1000*(num_beats - 1)*(round(track.samples_per_beat) - track.samples_per_beat)/fs
+        ok = found and accents and (np.abs(errors).max() <= 0.5)
+        passed = passed and ok
+        print(f'{bpm:7.1f} {num_beats:6d} {len(onsets):6d} {np.abs(errors).max():20.3f} {drift:16.3f} {rounded_drift_ms:25.3f} {seconds:11.2f} {"PASS" if ok else "FAIL"}')
+    return passed
+
+
+def sleep_drift(delay=0.2, num_beats=20):
+    """The original experiment: sleep() between beats, correcting each delay by the error measured so far."""
+    print(60/delay, 'bpm')
+    d = delay
     prev = perf_counter()
-    for i in range(20):
+    for i in range(num_beats):
         sleep(d)
         t = perf_counter()
         delta = t - prev - delay
@@ -22,5 +225,10 @@ def main():
         d -= delta
         prev = t
 
+
+def main():
+    check_drift()
+
+
 if __name__ == '__main__':
     main()
@@ -13,10 +13,23 @@ Generate static images:
 """
 
 
+from collections import OrderedDict
 import os.path
+from time import perf_counter
 
+import numpy as np
 from PIL import Image
 
+from frame_buffer import FrameBuffer, copies, image_to_buffer, new_image
+from frame_writer import FrameWriter
+from profiling import span
+from render_cache import content_key
+
+# Bump whenever a change to how frames are drawn (not the input images, which
+# are hashed) changes them: cached frames and animations are keyed on it (see
+# render_cache.py).
+DRAWING_VERSION = 1
+
 def bpm_to_milliseconds(bpm):
     """Convert beats per minute (BPM) to milliseconds.
     
@@ -25,7 +38,7 @@ def bpm_to_milliseconds(bpm):
     return 60000/bpm
 
 class NeckRenderer:
-    def __init__(self):
+    def __init__(self, max_cached_bytes=16*1024**2):
         # Load input images.
         self._folder = 'data'
         self._frets = self._imread('guitar-fretboard.png')
@@ -36,6 +49,28 @@ class NeckRenderer:
         self._fret_edges = [140,266,385,497,603,703,797,886,970,1049,1124,1195,1261,1324,1384,1440,1493,1543,1590,1634,1676,1716,1753,1789]
         self._string_centres = [25,53,81,109,137,165]
         self._num_strings = len(self._string_centres)
+
+        # Rendered frames (RGBA FrameBuffers, drawn by PIL straight into their
+        # arrays) keyed on the set of positions, least recently used evicted
+        # first once they take more than max_cached_bytes (16 MiB: 12 frames
+        # of 1800 x 190; 0 keeps none).
+        self._frames = OrderedDict()
+        self._max_cached_bytes = max_cached_bytes
+        self._cached_bytes = 0
+        self.frame_cache_hits = 0
+        self.frame_cache_misses = 0
+        self._fingerprint = None
+
+    @property
+    def fingerprint(self):
+        """Content key (render_cache.content_key) of everything a frame depends on besides its positions."""
+        if self._fingerprint is None:
+            self._fingerprint = content_key(
+                'neck', self._frets.mode, self._frets.size, self._frets.tobytes(),
+                self._marker.mode, self._marker.size, self._marker.tobytes(), self._fret_edges, self._string_centres,
+                DRAWING_VERSION
+            )
+        return self._fingerprint
     
     def render_image(self, positions):
         """Render an image of the neck with markers at the given positions."""
@@ -47,26 +82,89 @@ class NeckRenderer:
             output.paste(self._marker, offset)
         return output
     
+    def iter_images(self, sequence):
+        """Given a sequence of positions, generate corresponding images one at a time."""
+        for positions in sequence:
+            yield self.render_image(positions)
+
+    def get_buffer(self, positions) -> FrameBuffer:
+        """Rendered frame (read-only RGBA FrameBuffer) for the given positions, memoized.
+
+        Order and repeats of positions do not matter: the same set of markers
+        is only ever rendered once while it stays in the cache. The markers
+        are pasted into an array-backed image (frame_buffer.new_image), so the
+        array goes to the encoder as drawn.
+        """
+        key = frozenset(positions)
+        if key in self._frames:
+            self._frames.move_to_end(key)
+            self.frame_cache_hits += 1
+            return self._frames[key]
+
+        self.frame_cache_misses += 1
+        image, buffer = new_image(self._frets.size)
+        image.paste(self._frets, (0, 0))
+        for (string, fret) in key:
+            image.paste(self._marker, self._calculate_offset(string, fret))
+        buffer.pixels.setflags(write=False)
+        self._frames[key] = buffer
+        self._cached_bytes += buffer.pixels.nbytes
+        while self._frames and (self._cached_bytes > self._max_cached_bytes):
+            _, evicted = self._frames.popitem(last=False)
+            self._cached_bytes -= evicted.pixels.nbytes
+        return buffer
+
+    def get_frame(self, positions):
+        """Rendered frame (read-only RGB array, a view of get_buffer's) for the given positions.
+
+        For moviepy, which wants RGB: FrameWriter takes get_buffer directly.
+        """
+        return self.get_buffer(positions).pixels[:, :, :3]
+
     def render_images(self, sequence):
         """Given a sequence of positions, generate corresponding images.
         
         todo:
         Input validation
         Error handling
-        Generator rather than load all images at once.
-        Refactor as return [self.render_image(p) for p in sequence]?
         """
-        images = []
-        for positions in sequence:
-            image = self.render_image(positions)
-            images.append(image)
-        return images
+        return list(self.iter_images(sequence))
     
     def animate(self, sequence, filename, bpm=60):
-        """Given array of images, save as animation (GIF).
-    
-        todo:
-        Append GIF here.
+        """Given a sequence of positions, save as animation (GIF or video).
+
+        Frames are streamed to the encoder one at a time, so memory does not
+        grow with the length of the sequence: it is bounded by the frame cache
+        (max_cached_bytes, 16 MiB by default). A set of markers still in the
+        cache is not rendered again, and its memoized buffer goes to the
+        encoder as it is (no copy).
+        """
+        fps = 1000/bpm_to_milliseconds(bpm)
+        with span('NeckRenderer.animate', filename=filename) as stage:
+            with FrameWriter(self._get_path(filename), fps) as writer:
+                for positions in sequence:
+                    writer.write(self.get_buffer(positions))
+            stage.count('frames', writer.num_frames)
+
+    def animate_timeline(self, timeline, filename, fps=25):
+        """Save a timeline.Timeline as animation (GIF or video) at a fixed frame rate.
+
+        Each frame shows the notes sounding at its time, looked up in the
+        timeline's interval index, so frames stay in step with audio rendered
+        from the same timeline.
+        """
+        num_frames = int(np.ceil(timeline.end*fps))
+        sequence = (timeline.positions_at(i/fps) for i in range(num_frames))
+        with span('NeckRenderer.animate_timeline', filename=filename) as stage:
+            with FrameWriter(self._get_path(filename), fps) as writer:
+                for positions in sequence:
+                    writer.write(self.get_buffer(positions))
+            stage.count('frames', writer.num_frames)
+
+    def animate_in_memory(self, sequence, filename, bpm=60):
+        """Render every image first, then save as GIF with PIL (the original approach).
+
+        Kept for comparison: see animations.benchmark_animate.
         """
         duration = bpm_to_milliseconds(bpm)
         images = self.render_images(sequence)
@@ -86,4 +184,37 @@ class NeckRenderer:
     
     def _get_path(self, filename):
         return os.path.join(self._folder, filename)
-    
\ No newline at end of file
+
+
+def benchmark_frame_buffers(num_frames=200, max_markers=6, seed=0):
+    """Bytes copied and time per frame: PIL copy then array (as before) vs. array-backed image.
+
+    Every frame is a new set of markers (nothing memoized), encoded to an mp4
+    so the writer's copies count too.
+    """
+    rng = np.random.default_rng(seed)
+    marker_sets = [
+        list(zip(rng.integers(1, 7, num_markers).tolist(), rng.integers(1, 22, num_markers).tolist()))
+        for num_markers in rng.integers(1, max_markers + 1, num_frames)
+    ]
+    renderer = NeckRenderer(max_cached_bytes=0)
+    methods = {
+        'PIL copy + asarray': lambda positions: image_to_buffer(renderer.render_image(positions).convert('RGB')),
+        'array-backed image': renderer.get_buffer,
+    }
+    for name, render in methods.items():
+        copies.reset()
+        start = perf_counter()
+        with FrameWriter(renderer._get_path('benchmark-frame-buffers.mp4'), 25) as writer:
+            for positions in marker_sets:
+                writer.write(render(positions))
+        seconds = perf_counter() - start
+        print(f'{name}: {copies.bytes_per_frame:8.0f} bytes copied/frame, {1e3*seconds/num_frames:.2f} ms/frame (with encoding)')
+
+
+def main():
+    benchmark_frame_buffers()
+
+
+if __name__ == '__main__':
+    main()
@@ -9,7 +9,7 @@ Add a frequency conversion function which accounts for string inharmonicity (see
 """
 
 from typing import NamedTuple
-from chroma import Chroma, chroma_list, len_chroma
+from chroma import Chroma, chroma_list, chroma_to_index, len_chroma
 
 MIDI_MIN = 0
 MIDI_MAX = 128
@@ -58,7 +58,7 @@ def midi_to_note(midi):
 
 def note_to_midi(chroma, octave):
     """Convert note (chroma, octave) to MIDI note number."""
-    chroma_index = chroma_list.index(chroma)
+    chroma_index = chroma_to_index[chroma]
     return (octave + 1)*len_chroma + chroma_index
 
 def midi_to_frequency(midi):
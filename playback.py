@@ -0,0 +1,294 @@
+"""
+playback.py
+
+Play an exercise while it is being synthesised: fixed-size blocks are
+pulled from the Karplus-Strong voices (generate_audio.timeline_to_blocks or
+any other stream of blocks) on a background thread, into a bounded queue,
+and written from it to a raw PCM sink as the sink asks for them.
+
+Sinks take mono float32 little-endian PCM:
+RawSink: any binary file (a file, a pipe, stdout).
+open_pipe_sink: aplay reading from a pipe (started with Popen, so no
+    shell and no finished WAV file needed, unlike generate_audio.play_wav).
+NullSink: discards the audio, optionally paced like a sound card (a
+    device clock, sleeping when its buffer is full), for benchmarks without
+    one.
+
+A paced sink is real time: if it is ready for a block and the queue is empty,
+that is an underrun. A block of silence is written (a controlled gap instead
+of a device glitch) and counted. An unpaced sink just waits for the next
+block. Every block's render time is recorded; the queue is filled before
+playback starts, so latency is about queue_blocks blocks. The defaults
+(block_size 1024, queue_blocks 4: about 93 ms at 44.1 kHz) played without
+underruns in the paced benchmark; larger blocks or a longer queue trade
+latency for headroom.
+
+todo:
+Stereo.
+Start, stop and seek while playing (practice loops).
+"""
+
+import shutil
+import subprocess
+import sys
+import threading
+from queue import Empty, Queue
+from time import perf_counter, sleep
+from typing import NamedTuple
+
+import numpy as np
+
+from karplus_strong import fs
+
+BLOCK_SIZE = 1024  # Samples per block (23 ms at 44.1 kHz), smaller than audio_stream's: latency matters here.
+QUEUE_BLOCKS = 4  # Blocks rendered ahead.
+
+_end = object()  # Queued after the last block.
+
+
+class RawSink:
+    """Raw PCM blocks (mono float32 little-endian) to a binary file.
+
+    paced: the file is real time (a pipe to a player, stdout into aplay),
+    so its writes block at the playback rate.
+    """
+    def __init__(self, file, paced=False):
+        self._file = file
+        self.paced = paced
+
+    def write(self, block):
+        self._file.write(np.ascontiguousarray(block, dtype='<f4'))
+
+    def close(self):
+        self._file.flush()
+
+
+class PipeSink(RawSink):
+    """Raw PCM to a player process's stdin (see open_pipe_sink); close() waits for it to finish playing."""
+    def __init__(self, process):
+        super().__init__(process.stdin, paced=True)
+        self._process = process
+
+    def close(self):
+        self._file.close()
+        self._process.wait()
+
+
+def open_raw_player(sample_rate=fs):
+    """aplay reading mono float32 PCM from its stdin: write blocks to process.stdin."""
+    command = shutil.which('aplay')
+    if command is None:
+        raise FileNotFoundError('aplay not found on the PATH (alsa-utils): use a file, stdout or NullSink instead.')
+    return subprocess.Popen(
+        [command, '-q', '-t', 'raw', '-f', 'FLOAT_LE', '-c', '1', '-r', str(sample_rate)],
+        stdin=subprocess.PIPE
+    )
+
+
+def open_pipe_sink(sample_rate=fs) -> PipeSink:
+    return PipeSink(open_raw_player(sample_rate))
+
+
+def stdout_sink(paced=True) -> RawSink:
+    """Raw PCM to stdout (e.g. | aplay -t raw -f FLOAT_LE -c 1 -r 44100)."""
+    return RawSink(sys.stdout.buffer, paced)
+
+
+class NullSink:
+    """Discards blocks. Paced, it plays them in real time on a simulated device.
+
+    The device starts on the first write and holds buffer_samples: a write
+    that would overfill it sleeps until there is room, and a write that
+    comes after the device ran dry counts a device underrun.
+    """
+    def __init__(self, sample_rate=fs, paced=False, buffer_samples=2*BLOCK_SIZE):
+        self.sample_rate = sample_rate
+        self.paced = paced
+        self.buffer_samples = buffer_samples
+        self.samples_written = 0
+        self.device_underruns = 0
+        self._start = None
+
+    def write(self, block):
+        if self.paced:
+            now = perf_counter()
+            if self._start is None:
+                self._start = now
+            played = (now - self._start)*self.sample_rate
+            if played > self.samples_written:
+                self.device_underruns += 1
+                self._start += (played - self.samples_written)/self.sample_rate  # Silence played meanwhile.
+                played = self.samples_written
+            excess = self.samples_written + len(block) - played - self.buffer_samples
+            if excess > 0:
+                sleep(excess/self.sample_rate)
+        self.samples_written += len(block)
+
+    def close(self):
+        pass
+
+
+class PlaybackReport(NamedTuple):
+    num_blocks: int
+    block_size: int
+    queue_blocks: int
+    sample_rate: int
+    underruns: int  # Paced sink ready with the queue empty (silence written instead).
+    render_seconds: np.ndarray  # Time to render each block.
+    first_block_seconds: float  # From play() to the first block written (queue filled).
+    wall_seconds: float
+
+    @property
+    def audio_seconds(self):
+        return self.num_blocks*self.block_size/self.sample_rate
+
+    @property
+    def block_seconds(self):
+        return self.block_size/self.sample_rate
+
+    @property
+    def latency_seconds(self):
+        """Time a block waits in the full queue before it is written (steady state)."""
+        return self.queue_blocks*self.block_seconds
+
+    @property
+    def realtime_factor(self):
+        """Seconds of audio rendered per second of rendering."""
+        total = float(self.render_seconds.sum())
+        return self.audio_seconds/total if total > 0 else float('inf')
+
+    def __str__(self):
+        render_ms = 1e3*self.render_seconds if len(self.render_seconds) else np.zeros(1)
+        return (
+            f'{self.num_blocks} blocks of {self.block_size} ({1e3*self.block_seconds:.1f} ms): '
+            f'render mean {render_ms.mean():.2f} ms, 99th percentile {np.percentile(render_ms, 99):.2f} ms, max {render_ms.max():.2f} ms; '
+            f'{self.realtime_factor:.1f}x real time, {self.underruns} underruns, '
+            f'latency {1e3*self.latency_seconds:.0f} ms (first block after {1e3*self.first_block_seconds:.1f} ms)'
+        )
+
+
+class PlaybackEngine:
+    """Play streams of blocks to a sink through a bounded pre-render queue (see module docstring)."""
+    def __init__(self, sink, block_size=BLOCK_SIZE, queue_blocks=QUEUE_BLOCKS, sample_rate=fs):
+        if queue_blocks < 1:
+            raise ValueError(f'The queue must hold at least one block, got {queue_blocks}.')
+        self.sink = sink
+        self.block_size = block_size
+        self.queue_blocks = queue_blocks
+        self.sample_rate = sample_rate
+
+    def _render(self, blocks, queue, render_seconds, stop, ready):
+        """Producer thread: pull blocks, timing each, into the queue (then _end, or the exception).
+
+        Sets ready once the queue is full, or when there is nothing more to queue.
+        """
+        try:
+            iterator = iter(blocks)
+            while not stop.is_set():
+                start = perf_counter()
+                block = next(iterator, _end)
+                if block is _end:
+                    break
+                render_seconds.append(perf_counter() - start)
+                queue.put(np.ascontiguousarray(block, dtype='<f4'))
+                if queue.full():
+                    ready.set()
+            queue.put(_end)
+        except Exception as error:
+            queue.put(error)
+        finally:
+            ready.set()
+
+    def play(self, blocks) -> PlaybackReport:
+        """Play blocks (an iterable of 1-D arrays of block_size samples, the last may be shorter) to the end."""
+        start = perf_counter()
+        queue = Queue(maxsize=self.queue_blocks)
+        render_seconds = []
+        stop = threading.Event()
+        ready = threading.Event()
+        producer = threading.Thread(target=self._render, args=(blocks, queue, render_seconds, stop, ready), daemon=True)
+        producer.start()
+
+        # Wait for the queue to fill, so playback begins with queue_blocks in hand.
+        ready.wait()
+
+        silence = np.zeros(self.block_size, dtype='<f4')
+        num_blocks = 0
+        underruns = 0
+        first_block_seconds = None
+        try:
+            while True:
+                if self.sink.paced:
+                    try:
+                        block = queue.get_nowait()
+                    except Empty:
+                        underruns += 1
+                        self.sink.write(silence)
+                        continue
+                else:
+                    block = queue.get()
+                if block is _end:
+                    break
+                if isinstance(block, Exception):
+                    raise block
+                self.sink.write(block)
+                num_blocks += 1
+                if first_block_seconds is None:
+                    first_block_seconds = perf_counter() - start
+        finally:
+            stop.set()
+            while producer.is_alive():  # Unblock the producer if it is waiting on a full queue.
+                try:
+                    queue.get_nowait()
+                except Empty:
+                    sleep(0.001)
+        return PlaybackReport(
+            num_blocks, self.block_size, self.queue_blocks, self.sample_rate, underruns,
+            np.array(render_seconds), first_block_seconds or 0.0, perf_counter() - start
+        )
+
+
+def play_timeline(timeline, sink=None, block_size=BLOCK_SIZE, queue_blocks=QUEUE_BLOCKS, **audio_kwargs) -> PlaybackReport:
+    """Play a timeline.Timeline as it is synthesised (default sink: aplay); audio_kwargs as generate_audio.timeline_to_blocks."""
+    from generate_audio import timeline_to_blocks
+
+    if sink is None:
+        sink = open_pipe_sink()
+    try:
+        return PlaybackEngine(sink, block_size, queue_blocks).play(timeline_to_blocks(timeline, block_size=block_size, **audio_kwargs))
+    finally:
+        sink.close()
+
+
+def benchmark(block_sizes=(256, 1024, 4096), seconds=30, notes_per_second=8):
+    """Render time per block and real-time factor on a null sink, then underruns in (simulated) real time.
+
+    A random timeline (several notes starting every second). Unpaced runs
+    render as fast as they can: synthesising every note, then from a
+    SampleCache (filled by the first cached run, as for repeat plays). The
+    paced runs play a shorter timeline on a simulated device with a small
+    queue.
+    """
+    from generate_audio import timeline_to_blocks
+    from sample_cache import SampleCache
+    from timeline import random_timeline
+
+    timeline = random_timeline(int(seconds*notes_per_second), seconds)
+    cache = SampleCache()
+    for label, block_cache in [('synthesised', None), ('cached', cache), ('cached', cache)]:
+        for block_size in block_sizes:
+            report = PlaybackEngine(NullSink(), block_size).play(timeline_to_blocks(timeline, cache=block_cache, block_size=block_size))
+            print(f'null sink, {label}: {report}')
+    short = random_timeline(int(seconds*notes_per_second/3), seconds/3)
+    for block_size in block_sizes:
+        sink = NullSink(paced=True, buffer_samples=2*block_size)
+        report = PlaybackEngine(sink, block_size).play(timeline_to_blocks(short, block_size=block_size))
+        print(f'paced null sink, synthesised: {report}, {sink.device_underruns} device underruns')
+
+
+def main():
+    benchmark()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""
+practice_session.py
+
+Run a practice session (exercises.get_exercises) with asyncio, rendering
+each exercise's media (video with audio, see exercises.MediaJob) on a
+process pool before it is needed.
+
+When an exercise comes up, the renders for the next few (prefetch) are
+started in the background, so they are ready by the time the user has
+finished the current one. Waiting for the user (input()) happens on a
+thread, so the event loop is never blocked. For every exercise with media,
+time-to-first-media is measured: from the moment the prompt is shown to the
+moment its video is ready. If the render finished in time this is about zero,
+otherwise it is the time the user waited.
+
+todo:
+Play the media as well as saving it (see playback.py).
+Let the user skip or repeat an exercise.
+"""
+
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+import os
+import os.path
+import random
+from time import perf_counter
+from typing import List, NamedTuple, Optional
+
+from exercises import Exercise, MediaJob, scale_exercise
+from scales import ScaleType
+
+session_folder = 'session'  # Under video_renderer.folder.
+
+
+class MediaResult(NamedTuple):
+    filename: str  # Under video_renderer.folder.
+    render_seconds: float
+
+
+class ExerciseReport(NamedTuple):
+    prompt: str
+    media: Optional[MediaResult]
+    time_to_first_media: Optional[float]  # [s] from prompt shown to media ready (None: no media).
+    practice_seconds: float  # [s] from prompt shown to the user moving on.
+
+
+def render_media(job: MediaJob, fps=30) -> MediaResult:
+    """Render the scale's video, with audio (runs in a worker process)."""
+    from video_renderer import folder, render_video, scale_timeline
+
+    start = perf_counter()
+    os.makedirs(os.path.join(folder, session_folder), exist_ok=True)
+    filename = os.path.join(session_folder, job.name + '.mp4')
+    render_video(scale_timeline(job.scale_type, job.root, job.bpm), filename, fps)
+    return MediaResult(filename, perf_counter() - start)
+
+
+async def wait_for_enter(exercise):
+    """Wait for the user to press enter, on a thread (input() would block the event loop)."""
+    await asyncio.get_running_loop().run_in_executor(None, input, 'Press enter to continue...')
+
+
+async def run_session(exercises: List[Exercise], wait_for_user=wait_for_enter, prefetch=2, max_workers=2, fps=30) -> List[ExerciseReport]:
+    """Show each exercise in turn, rendering media for this one and the next prefetch in the background.
+
+    wait_for_user(exercise) is a coroutine function that returns when the
+    user moves on. Returns one report per exercise, and prints a summary.
+    """
+    loop = asyncio.get_running_loop()
+    renders = {}
+    reports = []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        def schedule(i):
+            if (i < len(exercises)) and (exercises[i].media is not None) and (i not in renders):
+                renders[i] = loop.run_in_executor(executor, render_media, exercises[i].media, fps)
+
+        for i, exercise in enumerate(exercises):
+            shown = perf_counter()
+            print(exercise.prompt)
+            for j in range(i, i + prefetch + 1):
+                schedule(j)
+
+            media = None
+            time_to_first_media = None
+            if i in renders:
+                media = await renders.pop(i)
+                time_to_first_media = perf_counter() - shown
+                print(f'Video: {media.filename}')
+            await wait_for_user(exercise)
+            reports.append(ExerciseReport(exercise.prompt, media, time_to_first_media, perf_counter() - shown))
+            print()
+
+    print('Well done! Session complete!')
+    print_summary(reports)
+    return reports
+
+
+def print_summary(reports):
+    print(f'{"exercise":<50} {"render [s]":>11} {"first media [s]":>16}')
+    for report in reports:
+        if report.media is not None:
+            print(f'{report.prompt:<50} {report.media.render_seconds:11.2f} {report.time_to_first_media:16.3f}')
+    waits = [report.time_to_first_media for report in reports if report.time_to_first_media is not None]
+    if waits:
+        print(f'Waited {sum(waits):.2f} s in all for media (worst {max(waits):.2f} s).')
+
+
+def benchmark(practice_seconds=3.0, bpm=160, fps=10, seed=0):
+    """Time-to-first-media with no prefetch (render on demand) vs. prefetching the next two.
+
+    A session of four scale exercises in a row; the user is simulated, taking
+    practice_seconds over each one.
+    """
+    async def practise(exercise):
+        await asyncio.sleep(practice_seconds)
+
+    random.seed(seed)
+    exercises = [
+        scale_exercise(scale_type, scale_type.name.lower().replace('_', ' '), bpm)
+        for scale_type in [ScaleType.MINOR_PENTATONIC, ScaleType.MAJOR, ScaleType.MINOR, ScaleType.MAJOR_PENTATONIC]
+    ]
+    results = {}
+    for prefetch in [0, 2]:
+        print(f'--- prefetch {prefetch} ---')
+        start = perf_counter()
+        reports = asyncio.run(run_session(exercises, practise, prefetch, fps=fps))
+        results[prefetch] = (reports, perf_counter() - start)
+    for prefetch, (reports, seconds) in results.items():
+        waits = [report.time_to_first_media for report in reports]
+        print(f'prefetch {prefetch}: waited {sum(waits):.2f} s for media (first exercise {waits[0]:.2f} s, later ones {sum(waits[1:]):.2f} s), session {seconds:.1f} s')
+
+
+def main():
+    benchmark()
+
+
+if __name__ == '__main__':
+    main()
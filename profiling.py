@@ -0,0 +1,257 @@
+"""
+profiling.py
+
+Where the time goes across the pipeline (audio synthesis, frame rendering,
+encoding): timing spans around each stage, with counts of what it produced
+(samples, frames) for throughput, and the peak memory of the process as
+each span ends.
+
+Switched off by default, and then nearly free: span() returns one shared
+do-nothing span, so an instrumented stage costs a global lookup and a call
+(see benchmark_overhead). Spans are placed around stages, never inside
+per-sample loops. Switch on with enable() (or cli.py --profile), then
+disable() returns the Tracer, which writes:
+a trace (Chrome trace-event JSON: open it in chrome://tracing or
+    https://ui.perfetto.dev), one complete event per span, on the thread
+    that ran it, and a counter track of peak RSS;
+a summary table: calls, total and worst time per stage, counts and
+    throughput, peak RSS.
+
+Spans nest (a stage's time includes its sub-stages') and can be used from
+any thread. Worker processes (batch_render) are not traced.
+
+todo:
+Collect traces from worker processes (one pid each in the same file).
+Python memory by stage (tracemalloc), not only peak RSS.
+"""
+
+from collections import defaultdict
+import functools
+import json
+import os
+import resource
+import sys
+import threading
+from time import perf_counter, perf_counter_ns
+
+_tracer = None  # The Tracer while enabled.
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far [MB]."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak/1024**2 if sys.platform == 'darwin' else peak/1024  # Bytes on macOS, KiB on Linux.
+
+
+class _NullSpan:
+    """What span() returns while tracing is off: does nothing."""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def count(self, name, amount=1):
+        pass
+
+
+_null_span = _NullSpan()
+
+
+class Span:
+    """One timed run of a stage (use as a context manager); count() what it produced."""
+    __slots__ = ('_tracer', 'name', 'args', 'counts', '_start')
+
+    def __init__(self, tracer, name, args):
+        self._tracer = tracer
+        self.name = name
+        self.args = args
+        self.counts = {}
+        self._start = None
+
+    def __enter__(self):
+        self._start = perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._tracer._end(self, self._start, perf_counter_ns())
+        return False
+
+    def count(self, name, amount=1):
+        """Add amount to this span's count of name (e.g. 'samples', 'frames')."""
+        self.counts[name] = self.counts.get(name, 0) + amount
+
+
+class StageStats:
+    """Totals over every span of one name."""
+    def __init__(self):
+        self.calls = 0
+        self.total_ns = 0
+        self.max_ns = 0
+        self.peak_rss_mb = 0.0
+        self.counts = defaultdict(int)
+
+
+class Tracer:
+    """Records spans as Chrome trace events and totals by stage (see module docstring)."""
+    def __init__(self):
+        self.pid = os.getpid()
+        self.events = []
+        self.stages = defaultdict(StageStats)
+        self._origin = perf_counter_ns()
+        self._wall_start = perf_counter()
+        self._threads = {}
+        self._lock = threading.Lock()
+
+    def span(self, name, **args) -> Span:
+        return Span(self, name, args)
+
+    def _end(self, span, start, end):
+        peak = peak_rss_mb()
+        thread = threading.current_thread()
+        timestamp = (start - self._origin)/1000  # [us], as Chrome wants.
+        event = {
+            'name': span.name, 'cat': 'stage', 'ph': 'X', 'ts': timestamp, 'dur': (end - start)/1000,
+            'pid': self.pid, 'tid': thread.ident, 'args': {**span.args, **span.counts, 'peak_rss_mb': round(peak, 1)},
+        }
+        memory = {'name': 'peak RSS [MB]', 'ph': 'C', 'ts': (end - self._origin)/1000, 'pid': self.pid, 'args': {'MB': round(peak, 1)}}
+        with self._lock:
+            self.events.append(event)
+            self.events.append(memory)
+            self._threads[thread.ident] = thread.name
+            stats = self.stages[span.name]
+            stats.calls += 1
+            stats.total_ns += end - start
+            stats.max_ns = max(stats.max_ns, end - start)
+            stats.peak_rss_mb = max(stats.peak_rss_mb, peak)
+            for name, amount in span.counts.items():
+                stats.counts[name] += amount
+
+    @property
+    def wall_seconds(self):
+        return perf_counter() - self._wall_start
+
+    def trace(self):
+        """Chrome trace-event format (JSON object form), with thread names."""
+        with self._lock:
+            names = [
+                {'name': 'thread_name', 'ph': 'M', 'pid': self.pid, 'tid': tid, 'args': {'name': name}}
+                for tid, name in self._threads.items()
+            ]
+            return {'traceEvents': names + list(self.events), 'displayTimeUnit': 'ms'}
+
+    def write(self, filepath):
+        """Save the trace (for chrome://tracing or Perfetto)."""
+        directory = os.path.dirname(filepath)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(filepath, 'w') as file:
+            json.dump(self.trace(), file)
+
+    def summary(self):
+        """Table of the stages, most total time first (nested stages include their sub-stages)."""
+        lines = [f'{"stage":<32} {"calls":>6} {"total [s]":>10} {"max [ms]":>9} {"peak RSS [MB]":>14}  throughput']
+        for name, stats in sorted(self.stages.items(), key=lambda item: -item[1].total_ns):
+            seconds = stats.total_ns/1e9
+            throughput = ', '.join(
+                f'{amount} {unit} ({amount/seconds:,.0f}/s)' if seconds > 0 else f'{amount} {unit}'
+                for unit, amount in stats.counts.items()
+            )
+            lines.append(f'{name:<32} {stats.calls:6d} {seconds:10.3f} {stats.max_ns/1e6:9.1f} {stats.peak_rss_mb:14.1f}  {throughput}')
+        lines.append(f'{len(self.stages)} stages in {self.wall_seconds:.2f} s; peak RSS {peak_rss_mb():.1f} MB.')
+        return '\n'.join(lines)
+
+
+def enable() -> Tracer:
+    """Start tracing (a new Tracer) in this process."""
+    global _tracer
+    _tracer = Tracer()
+    return _tracer
+
+
+def disable() -> Tracer:
+    """Stop tracing; return the Tracer (None if it was not on)."""
+    global _tracer
+    tracer, _tracer = _tracer, None
+    return tracer
+
+
+def is_enabled():
+    return _tracer is not None
+
+
+def span(name, **args):
+    """Context manager timing a stage while tracing is on (args go in the trace); see module docstring."""
+    if _tracer is None:
+        return _null_span
+    return _tracer.span(name, **args)
+
+
+def traced(name=None):
+    """Decorator: run the function in a span (named after it by default)."""
+    def decorator(function):
+        label = function.__qualname__ if name is None else name
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return function(*args, **kwargs)
+            with _tracer.span(label):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def finish(filepath):
+    """Stop tracing, write the trace to filepath and print the summary."""
+    tracer = disable()
+    if tracer is None:
+        return None
+    tracer.write(filepath)
+    print(tracer.summary())
+    print(f'Trace: {filepath}')
+    return tracer
+
+
+def benchmark_overhead(num_spans=1_000_000, seconds=8, bpm=120):
+    """Cost of a span off and on, and of tracing a whole video render (minor pentatonic, repeated)."""
+    import profiling  # Not this module's globals: as __main__, they are not the ones the pipeline sees.
+    from chroma import Chroma
+    from scales import ScaleType
+    from video_renderer import render_video, scale_timeline
+
+    start = perf_counter()
+    for _ in range(num_spans):
+        with profiling.span('stage') as stage:
+            stage.count('items')
+    off_ns = (perf_counter() - start)*1e9/num_spans
+    tracer = profiling.enable()
+    start = perf_counter()
+    for _ in range(num_spans//10):
+        with profiling.span('stage') as stage:
+            stage.count('items')
+    on_ns = (perf_counter() - start)*1e9/(num_spans//10)
+    profiling.disable()
+    print(f'span: {off_ns:.0f} ns off, {on_ns:.0f} ns on ({tracer.stages["stage"].calls} spans recorded)')
+
+    repeats = max(1, int(seconds*bpm/60/24))
+    timeline = scale_timeline(ScaleType.MINOR_PENTATONIC, Chroma.A, bpm, repeats)
+    results = {'off': [], 'on': []}
+    for label in ['off', 'on', 'off', 'on']:
+        if label == 'on':
+            profiling.enable()
+        report = render_video(timeline, f'benchmark-profiling-{label}.mp4', fps=30)
+        tracer = profiling.disable() or tracer
+        results[label].append(report.render_seconds)
+    print(f'render_video: {min(results["off"]):.2f} s off, {min(results["on"]):.2f} s on (best of 2)')
+    print(tracer.summary())
+
+
+def main():
+    benchmark_overhead()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,254 @@
+"""
+render_cache.py
+
+Content-addressed store for the outputs of each stage of the pipeline
+(audio, frames, videos, animations, images), shared between runs and
+between processes, so nothing is rendered again unless its inputs changed.
+
+Each artifact is keyed on a hash of everything it is made from (content_key):
+the stage name, its inputs and its parameters. Inputs can be outputs of
+earlier stages, or their keys, so keys chain: positions -> frequencies ->
+audio, positions -> frames, audio + frames -> video. Change the BPM and only
+the audio and video keys change: the frames are found in the cache. Change
+nothing and the video itself is found, so no stage runs at all. The cheap
+stages (positions to notes to frequencies) are simply recomputed: looking
+them up would cost more than computing them.
+
+Artifacts are files under folder/<stage>/ (.npy for arrays), written to a
+temporary file and renamed, so a reader never sees half an artifact and
+parallel workers can share the folder. Every hit touches the file, and when
+the folder grows past max_bytes the least recently used artifacts are
+deleted. Outputs are exported from the cache as copies, so an exported file
+outlives its eviction, and writing over it later cannot change the cache.
+Writers that skip the cache remove_output first anyway: an export may still
+be a hard link made by an older version.
+
+Keys cover inputs, not code, so each stage's key includes the version of the
+code that makes it (karplus_strong.SYNTHESIS_VERSION for audio,
+fretboard.DRAWING_VERSION and neck_renderer.DRAWING_VERSION for images and
+frames): bump it after changing what that code produces, and only that
+stage's artifacts (and those made from them) are made again. Bump version
+to invalidate everything.
+
+todo:
+Store the frames of a step once, not once per sequence.
+"""
+
+from collections import Counter
+from enum import Enum
+import hashlib
+import os
+import os.path
+import shutil
+import threading
+from time import perf_counter
+
+import numpy as np
+
+folder = os.path.join('data', 'cache')
+version = 1
+
+
+def _update(hasher, value):
+    """Feed value to hasher, unambiguously (type and length before contents)."""
+    if isinstance(value, np.ndarray):
+        hasher.update(f'array {value.dtype.str} {value.shape}:'.encode())
+        hasher.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, Enum):
+        hasher.update(f'enum {type(value).__name__}.{value.name};'.encode())
+    elif isinstance(value, (list, tuple)):  # NamedTuples too: (1, 3) and FretboardPosition(1, 3) are the same input.
+        hasher.update(f'sequence {len(value)}('.encode())
+        for item in value:
+            _update(hasher, item)
+        hasher.update(b')')
+    elif isinstance(value, (set, frozenset)):
+        _update(hasher, sorted(value))
+    elif isinstance(value, dict):
+        _update(hasher, sorted(value.items()))
+    elif isinstance(value, bytes):
+        hasher.update(f'bytes {len(value)}:'.encode())
+        hasher.update(value)
+    elif isinstance(value, str):
+        _update(hasher, value.encode())
+    elif value is None:
+        hasher.update(b'none;')
+    elif isinstance(value, (bool, np.bool_, int, float, np.number)):  # 60 and 60.0 BPM are the same input (True and np.True_ too).
+        hasher.update(f'number {float(value)!r};'.encode())
+    else:
+        raise TypeError(f'Cannot make a content key from {type(value).__name__}: pass its contents instead.')
+
+
+def content_key(stage, *inputs):
+    """Hash (hex) of a stage name and everything its output is made from."""
+    hasher = hashlib.sha256()
+    _update(hasher, (version, stage) + inputs)
+    return hasher.hexdigest()[:32]
+
+
+def remove_output(path):
+    """Delete the file at path, if any, before writing a new one there (so never through a link)."""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class RenderCache:
+    """Artifacts by content key, least recently used evicted past max_bytes (see module docstring).
+
+    Counts hits, misses and the seconds spent computing misses, per stage.
+    """
+    def __init__(self, folder=folder, max_bytes=2*1024**3):
+        if max_bytes < 0:
+            raise ValueError(f'max_bytes must be >= 0, got {max_bytes}.')
+        self.folder = os.path.abspath(folder)
+        self.max_bytes = max_bytes
+        self.hits = Counter()
+        self.misses = Counter()
+        self.compute_seconds = Counter()
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._bytes = sum(size for _, _, size in self._scan())
+
+    def __len__(self):
+        return sum(1 for _ in self._scan())
+
+    @property
+    def num_bytes(self):
+        """Size of the cache as last counted (other processes may have added to it since)."""
+        return self._bytes
+
+    def get_path(self, stage, key, ext):
+        return os.path.join(self.folder, stage, key + ext)
+
+    def lookup(self, stage, key, ext):
+        """Path of the artifact if cached (and touch it), else None."""
+        path = self.get_path(stage, key, ext)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def file(self, stage, key, ext, write):
+        """Path of the artifact, calling write(path) to make it on a miss.
+
+        write gets an absolute temporary path with the same extension (for
+        writers that choose the format from it).
+        """
+        path = self.lookup(stage, key, ext)
+        if path is not None:
+            self._count(self.hits, stage)
+            return path
+
+        path = self.get_path(stage, key, ext)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary = f'{path[:-len(ext)] if ext else path}.tmp-{os.getpid()}-{threading.get_ident()}{ext}'
+        start = perf_counter()
+        try:
+            write(temporary)
+            os.replace(temporary, path)
+        finally:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+        with self._lock:
+            self.misses[stage] += 1
+            self.compute_seconds[stage] += perf_counter() - start
+            self._bytes += os.path.getsize(path)
+        if self._bytes > self.max_bytes:
+            self.evict(keep=path)
+        return path
+
+    def array(self, stage, key, compute):
+        """The array from compute(), saved on a miss (.npy) and loaded on a hit (read-only)."""
+        path = self.lookup(stage, key, '.npy')
+        if path is not None:
+            try:
+                array = np.load(path)
+                self._count(self.hits, stage)
+                array.setflags(write=False)
+                return array
+            except (FileNotFoundError, ValueError):  # Evicted meanwhile, or unreadable: make it again.
+                pass
+
+        result = []
+
+        def write(temporary):
+            result.append(np.asarray(compute()))
+            np.save(temporary, result[0])
+
+        self.file(stage, key, '.npy', write)
+        if not result:  # Another thread or process made it first.
+            return self.array(stage, key, compute)
+        return result[0]
+
+    def export(self, path, destination):
+        """Copy the cached artifact at path to destination (a new file: never a link into the cache)."""
+        directory = os.path.dirname(destination)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        remove_output(destination)
+        shutil.copyfile(path, destination)
+        return destination
+
+    def evict(self, keep=None):
+        """Delete least recently used artifacts (never keep) until the cache fits in max_bytes."""
+        entries = sorted(self._scan())
+        total = sum(size for _, _, size in entries)
+        for _, path, size in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:  # Another process evicted it.
+                pass
+            total -= size
+            with self._lock:
+                self.evictions += 1
+        with self._lock:
+            self._bytes = total
+
+    def clear(self):
+        """Delete every artifact and reset the counters."""
+        for _, path, _ in self._scan():
+            os.remove(path)
+        self._bytes = 0
+        self.hits.clear()
+        self.misses.clear()
+        self.compute_seconds.clear()
+        self.evictions = 0
+
+    def stats(self):
+        stages = sorted(set(self.hits) | set(self.misses))
+        return {
+            stage: {'hits': self.hits[stage], 'misses': self.misses[stage], 'compute_seconds': self.compute_seconds[stage]}
+            for stage in stages
+        }
+
+    def __str__(self):
+        stages = ', '.join(
+            f'{stage} {counts["hits"]}/{counts["hits"] + counts["misses"]} hits ({counts["compute_seconds"]:.1f} s computing)'
+            for stage, counts in self.stats().items()
+        )
+        return f'{self.num_bytes/1e6:.1f} MB of {self.max_bytes/1e6:.0f} MB, {self.evictions} evicted; {stages or "unused"}'
+
+    def _count(self, counter, stage):
+        with self._lock:
+            counter[stage] += 1
+
+    def _scan(self):
+        """(last used, path, size) of every artifact (not temporary files)."""
+        if not os.path.isdir(self.folder):
+            return
+        for directory, _, filenames in os.walk(self.folder):
+            for filename in filenames:
+                if '.tmp-' in filename:
+                    continue
+                path = os.path.join(directory, filename)
+                try:
+                    status = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield status.st_mtime, path, status.st_size
@@ -0,0 +1,141 @@
+"""
+sample_cache.py
+
+Cache of rendered Karplus-Strong buffers, so the same pluck is only ever
+synthesised once (scales ascending and descending, lesson batches).
+
+Keyed on (frequency, smoothing factor, duration, seed, threshold): the seed
+fixes the initial wavetable, so a cached buffer is exactly what synthesis
+would have produced. Bounded in memory (least recently used evicted first),
+with an optional on-disk tier of .npy files shared between runs.
+
+todo:
+Evict from disk tier too (size cap)?
+"""
+
+from collections import OrderedDict
+import hashlib
+import os
+import os.path
+
+import numpy as np
+
+from karplus_strong import duration_to_samples, karplus_strong_batch
+
+folder = os.path.join('data', 'samples')
+
+
+class SampleCache:
+    """Least recently used cache of Karplus-Strong buffers.
+
+    Set folder (e.g. sample_cache.folder) to also store every buffer as a
+    .npy file there and look there before synthesising. Buffers returned are
+    read-only: they are shared between callers.
+    """
+    def __init__(self, max_entries=512, folder=None):
+        if max_entries < 1:
+            raise ValueError('max_entries must be >= 1.')
+        self._max_entries = max_entries
+        self._folder = folder
+        self._buffers = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._buffers)
+
+    @property
+    def hit_rate(self):
+        """Fraction of lookups served without synthesis (memory or disk)."""
+        lookups = self.hits + self.disk_hits + self.misses
+        return (self.hits + self.disk_hits)/lookups if lookups else 0.0
+
+    def stats(self):
+        return {
+            'entries': len(self),
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': self.hit_rate,
+        }
+
+    def clear(self):
+        """Empty the memory tier and reset the counters (disk tier untouched)."""
+        self._buffers.clear()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def get(self, frequency, smoothing_factor=0.5, duration=2, seed=0, threshold=None):
+        """Return the buffer for one pluck, synthesising it on a miss."""
+        return self.get_many([frequency], smoothing_factor, duration, seed, threshold)[0]
+
+    def get_many(self, frequencies, smoothing_factor=0.5, durations=2, seeds=0, threshold=None):
+        """Return buffers for many plucks; all misses are synthesised in one batch.
+
+        durations [s] and seeds may be one value for all, or one per frequency.
+        """
+        num_voices = len(frequencies)
+        durations = np.broadcast_to(durations, (num_voices,))
+        seeds = np.broadcast_to(seeds, (num_voices,))
+        keys = [
+            self._key(frequency, smoothing_factor, duration, seed, threshold)
+            for frequency, duration, seed in zip(frequencies, durations, seeds)
+        ]
+
+        # Look up each distinct key once; repeats within this call are hits.
+        buffers = {}
+        missing = {}  # Keys to synthesise, in order (a dict: constant-time membership).
+        for key in keys:
+            if key in buffers or key in missing:
+                self.hits += 1
+            elif key in self._buffers:
+                self._buffers.move_to_end(key)
+                buffers[key] = self._buffers[key]
+                self.hits += 1
+            elif self._exists_on_disk(key):
+                buffers[key] = self._store(key, np.load(self._get_path(key)))
+                self.disk_hits += 1
+            else:
+                missing[key] = None
+                self.misses += 1
+
+        if missing:
+            frequencies_missing, _, durations_missing, seeds_missing, _ = zip(*missing)
+            signals, lengths = karplus_strong_batch(
+                frequencies_missing,
+                duration_to_samples(np.array(durations_missing)),
+                smoothing_factor,
+                [int(seed) for seed in seeds_missing],
+                threshold
+            )
+            if self._folder is not None:
+                os.makedirs(self._folder, exist_ok=True)
+            for key, signal, length in zip(missing, signals, lengths):
+                buffer = signal[:length].copy()
+                if self._folder is not None:
+                    np.save(self._get_path(key), buffer)
+                buffers[key] = self._store(key, buffer)
+
+        return [buffers[key] for key in keys]
+
+    def _key(self, frequency, smoothing_factor, duration, seed, threshold):
+        if seed is None:
+            raise ValueError('seed must be given: unseeded plucks are never the same twice.')
+        return (float(frequency), float(smoothing_factor), float(duration), int(seed), threshold)
+
+    def _store(self, key, buffer):
+        buffer.setflags(write=False)
+        self._buffers[key] = buffer
+        self._buffers.move_to_end(key)
+        while len(self._buffers) > self._max_entries:
+            self._buffers.popitem(last=False)
+        return buffer
+
+    def _exists_on_disk(self, key):
+        return (self._folder is not None) and os.path.exists(self._get_path(key))
+
+    def _get_path(self, key):
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()[:16]
+        return os.path.join(self._folder, f'ks-{digest}.npy')
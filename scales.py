@@ -15,8 +15,13 @@ Specify octave of root note. Default to 4.
 Power chords.
 """
 
+from enum import Enum
+
 from chroma import Chroma, chroma_list, len_chroma
+from fingering import find_fingering
+from fretboard import FretboardPosition
 from guitar_tuning import GuitarTuning
+from notes import Note, midi_to_note, note_to_midi
 
 semitone = 1
 tone = 2
@@ -37,6 +42,12 @@ def get_notes_in_scale(chroma, intervals):
         i = j
     return notes
 
+class ScaleType(Enum):
+    MAJOR = 1
+    MINOR = 2
+    MINOR_PENTATONIC = 3
+    MAJOR_PENTATONIC = 4
+
 def major_scale(chroma):
     return get_notes_in_scale(chroma, intervals_major)
 
@@ -102,6 +113,52 @@ def get_triads_in_major_key(chroma):
         triad = get_major_triad(note)
         print(notes_str(triad))
 
+def get_scale(scale_type, root):
+    """Get the notes (chromas) of the given scale type on the given root."""
+    scale_functions = {
+        ScaleType.MAJOR: major_scale,
+        ScaleType.MINOR: natural_minor_scale,
+        ScaleType.MINOR_PENTATONIC: minor_pentatonic_scale,
+        ScaleType.MAJOR_PENTATONIC: major_pentatonic_scale,
+    }
+    return scale_functions[scale_type](root)
+
+def scale_box_positions(scale_type, root, tuning=None):
+    """Positions of the scale, ascending, in one box shape (one step per note).
+
+    The root is on the lowest string at the lowest fret >= 2, and the box
+    spans from one fret below to three frets above it (e.g. E minor
+    pentatonic: the shape at the 12th fret). Open strings are not used.
+
+    todo:
+    Other positions (boxes) along the neck.
+    """
+    if tuning is None:
+        tuning = GuitarTuning()
+    chromas = set(get_scale(scale_type, root))
+
+    # Root fret on the lowest string.
+    open_chroma, open_octave = tuning.position_to_note(FretboardPosition(1, 0))
+    root_fret = (chroma_list.index(root) - chroma_list.index(open_chroma)) % len_chroma
+    if root_fret < 2:
+        root_fret += len_chroma  # Keep the whole box off the nut.
+    frets = range(root_fret - 1, root_fret + 4)
+
+    # Walk up each string in turn, only ever ascending in pitch.
+    positions = []
+    last_midi = None
+    for string in range(1, tuning.num_strings + 1):
+        for fret in frets:
+            if (string == 1) and (fret < root_fret):
+                continue  # Start on the root.
+            position = FretboardPosition(string, fret)
+            chroma, octave = tuning.position_to_note(position)
+            midi = note_to_midi(chroma, octave)
+            if (chroma in chromas) and ((last_midi is None) or (midi > last_midi)):
+                positions.append([(string, fret)])
+                last_midi = midi
+    return positions
+
 def append_reversed_sequence(sequence, loop=True):
     """Given a sequence, reverse it and append it (without repeating the middle position).
 
@@ -119,15 +176,30 @@ def test_tuning_lookups():
     x = tuning.note_to_positions(Chroma.A, 3)
     print(x)
 
-def scale_to_neck_positions():
-    """Convert scale to neck positions, choosing best route where many available.
-    
-    todo:
-    Need to specify an octave?
-    Need to append the root note an octave higher.
+def scale_to_notes(scale_type, root, octave=3, num_octaves=1):
+    """Notes of the scale, ascending from the root in the given octave, ending on the root num_octaves higher."""
+    chromas = get_scale(scale_type, root)
+    if chromas[-1] == chromas[0]:
+        chromas = chromas[:-1]  # Drop the octave (added once at the end).
+    root_midi = note_to_midi(root, octave)
+    notes = []
+    for i in range(num_octaves):
+        for chroma in chromas:
+            # Each degree is the first instance of its chroma at or above the root.
+            interval = (chroma_list.index(chroma) - chroma_list.index(root)) % len_chroma
+            notes.append(Note(*midi_to_note(root_midi + i*len_chroma + interval)))
+    notes.append(Note(root, octave + num_octaves))
+    return notes
+
+def scale_to_neck_positions(notes, tuning=None, cost=None):
+    """Convert scale (or any melody: list of Notes) to neck positions, choosing best route where many available.
+
+    The route is the one with the lowest total cost (see fingering.py).
+    Returns one step per note, each a list of (string, fret) as in
+    scale_box_positions.
     """
-    scale = minor_pentatonic_scale(Chroma.E)
-    print(notes_str(scale))
+    positions = find_fingering(notes, tuning, cost)
+    return [[(string, fret)] for string, fret in positions.tolist()]
 
 def main():
     # test_tuning_lookups()
@@ -138,7 +210,9 @@ def main():
 
     # get_triads_in_major_key(Chroma.D)
 
-    scale_to_neck_positions()
+    notes = scale_to_notes(ScaleType.MINOR_PENTATONIC, Chroma.E, octave=2, num_octaves=2)
+    print(", ".join(f"{note.chroma.name}{note.octave}" for note in notes))
+    print(scale_to_neck_positions(notes))
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,116 @@
+"""
+tab_renderer.py
+
+Render guitar tablature (one line per string, high string at the top, fret
+numbers on the lines) a page of columns at a time, with the current column
+marked, for videos alongside the fretboard and keyboard (see layout.py).
+
+A column is the positions played together (one onset); a page is a tuple of
+up to columns_per_page columns. The staff lines are static. Each page's fret
+numbers are drawn once into a transparent sprite (least recently used
+evicted first), so a frame is one sprite and a cursor rectangle on top of the
+lines.
+
+todo:
+Rhythm (note lengths) under the staff.
+Bar lines.
+Read and write ASCII tab.
+"""
+
+from collections import OrderedDict
+
+import cairo
+import numpy as np
+
+white = (1, 1, 1)
+black = (0, 0, 0)
+blue = (0, 0, 1)
+line_width = 2
+cursor_line_width = 4
+
+
+class TabRenderer:
+    """Tab pages drawn into box (left, top, right, bottom) in pixels of a shared surface.
+
+    background is what the layout paints behind the staff (each fret number
+    is drawn on a patch of it, to break the line).
+    """
+    def __init__(self, box, num_strings=6, columns_per_page=16, background=white, max_cached_pages=16):
+        left, top, right, bottom = box
+        self.num_strings = num_strings
+        self.columns_per_page = columns_per_page
+        self._background = background
+        self._origin = (int(left), int(top))
+        self._size = (int(np.ceil(right - left)), int(np.ceil(bottom - top)))
+
+        # Geometry relative to the box: highest string on the top line (string 1 is the lowest).
+        width, height = right - left, bottom - top
+        margin = 0.02*width
+        self._line_left = margin
+        self._line_right = width - margin
+        self._string_y = height*(np.arange(num_strings) + 0.5)/num_strings
+        column_width = (self._line_right - self._line_left)/columns_per_page
+        self._column_width = column_width
+        self._column_x = self._line_left + column_width*(np.arange(columns_per_page) + 0.5)
+        self._font_size = 0.8*height/num_strings
+
+        self._pages = OrderedDict()
+        self._max_cached_pages = max_cached_pages
+
+    def draw_static(self, context):
+        """Draw the staff (one line per string, a bar at each end) into context."""
+        x0, y0 = self._origin
+        context.set_source_rgb(*black)
+        context.set_line_width(line_width)
+        for y in self._string_y.tolist():
+            context.move_to(x0 + self._line_left, y0 + y)
+            context.line_to(x0 + self._line_right, y0 + y)
+        for x in [self._line_left, self._line_right]:
+            context.move_to(x0 + x, y0 + self._string_y[0])
+            context.line_to(x0 + x, y0 + self._string_y[-1])
+        context.stroke()
+
+    def _page_sprite(self, page):
+        """Fret numbers of every column in page, on a transparent surface the size of the box (memoized)."""
+        if page in self._pages:
+            self._pages.move_to_end(page)
+            return self._pages[page]
+
+        surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, *self._size)
+        context = cairo.Context(surface)
+        context.select_font_face('sans-serif', cairo.FONT_SLANT_NORMAL, cairo.FONT_WEIGHT_BOLD)
+        context.set_font_size(self._font_size)
+        for x, column in zip(self._column_x.tolist(), page):
+            for string, fret in column:
+                text = str(fret)
+                x_bearing, y_bearing, text_width, text_height = context.text_extents(text)[:4]
+                y = self._string_y[self.num_strings - string]
+                context.set_source_rgb(*self._background)
+                context.rectangle(x - text_width/2 - 2, y - text_height/2 - 2, text_width + 4, text_height + 4)
+                context.fill()
+                context.set_source_rgb(*black)
+                context.move_to(x - text_width/2 - x_bearing, y - text_height/2 - y_bearing)
+                context.show_text(text)
+        surface.flush()
+
+        self._pages[page] = surface
+        while len(self._pages) > self._max_cached_pages:
+            self._pages.popitem(last=False)
+        return surface
+
+    def draw_page(self, context, page, column=None):
+        """Composite the page's fret numbers into context, with a cursor round column (index in page) if not None.
+
+        page is a tuple of columns, each a tuple of (string, fret).
+        """
+        x0, y0 = self._origin
+        if page:
+            context.set_source_surface(self._page_sprite(page), x0, y0)
+            context.rectangle(x0, y0, *self._size)
+            context.fill()
+        if column is not None:
+            x = x0 + self._column_x[column] - 0.4*self._column_width
+            context.set_source_rgb(*blue)
+            context.set_line_width(cursor_line_width)
+            context.rectangle(x, y0 + cursor_line_width, 0.8*self._column_width, self._size[1] - 2*cursor_line_width)
+            context.stroke()
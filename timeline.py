@@ -0,0 +1,188 @@
+"""
+timeline.py
+
+Timeline of note events, shared by audio and animation so they cannot drift
+apart: both are rendered from the same onsets.
+
+Columnar: one NumPy array per field (onset, duration, MIDI note number,
+string, fret, velocity), sorted by onset. Times are in seconds.
+
+Two queries, neither of which scans the whole timeline:
+starting_between(t0, t1): events with onsets in [t0, t1), by binary search
+    on the onsets (for the audio mixer, block by block).
+sounding_at(t): events with onset <= t < onset + duration, from an interval
+    index: time is cut into buckets (bucket_seconds long), and each event is
+    listed (CSR form) in every bucket it overlaps, so a query only looks at
+    the events in one bucket (for the frame renderer, frame by frame).
+
+todo:
+Read and write MIDI files.
+Tempo changes (onsets in beats as well as seconds?).
+"""
+
+from time import perf_counter
+
+import numpy as np
+
+from conversions import midis_to_frequencies
+from guitar_tuning import GuitarTuning
+
+NO_STRING = 0  # Events not played on a string (e.g. piano) have string 0 and fret -1.
+NO_FRET = -1
+
+
+class Timeline:
+    """Note events, sorted by onset, as read-only columns.
+
+    strings, frets and velocities are optional: default no position, and
+    full velocity (1).
+    """
+    def __init__(self, onsets, durations, midis, strings=None, frets=None, velocities=None, bucket_seconds=1.0):
+        onsets = np.asarray(onsets, dtype=float).ravel()
+        num_events = len(onsets)
+        columns = {
+            'onsets': onsets,
+            'durations': np.broadcast_to(np.asarray(durations, dtype=float), (num_events,)),
+            'midis': np.broadcast_to(np.asarray(midis, dtype=np.int16), (num_events,)),
+            'strings': np.broadcast_to(np.asarray(NO_STRING if strings is None else strings, dtype=np.int8), (num_events,)),
+            'frets': np.broadcast_to(np.asarray(NO_FRET if frets is None else frets, dtype=np.int8), (num_events,)),
+            'velocities': np.broadcast_to(np.asarray(1 if velocities is None else velocities, dtype=np.float32), (num_events,)),
+        }
+        if num_events and (columns['durations'].min() <= 0):
+            raise ValueError('Every duration must be > 0.')
+
+        order = np.argsort(onsets, kind='stable')
+        for name, column in columns.items():
+            column = column[order]
+            column.setflags(write=False)
+            setattr(self, name, column)
+        self._build_interval_index(bucket_seconds)
+
+    def __len__(self):
+        return len(self.onsets)
+
+    @property
+    def end(self) -> float:
+        """Time [s] the last event stops sounding."""
+        return float((self.onsets + self.durations).max()) if len(self) else 0.0
+
+    @property
+    def frequencies(self) -> np.ndarray:
+        return midis_to_frequencies(self.midis)
+
+    @classmethod
+    def from_steps(cls, steps, onsets, tuning=None, velocity=1.0):
+        """Timeline from a sequence of steps of positions, as animations use.
+
+        Each step is a list of (string, fret) (several for a chord) that
+        sounds from onsets[i] to onsets[i + 1] [s], so onsets has one more
+        entry than steps (as generate_audio.bpm_to_onsets, which is in ms).
+        """
+        if tuning is None:
+            tuning = GuitarTuning()
+        onsets = np.asarray(onsets, dtype=float)
+        if len(onsets) != len(steps) + 1:
+            raise ValueError(f'Need one more onset than steps (the end), got {len(onsets)} onsets for {len(steps)} steps.')
+        step_sizes = [len(step) for step in steps]
+        positions = np.array([position for step in steps for position in step], dtype=int).reshape(-1, 2)
+        event_onsets = np.repeat(onsets[:-1], step_sizes)
+        event_durations = np.repeat(np.diff(onsets), step_sizes)
+        return cls(
+            event_onsets,
+            event_durations,
+            tuning.positions_to_midis(positions),
+            positions[:, 0],
+            positions[:, 1],
+            velocity
+        )
+
+    def _build_interval_index(self, bucket_seconds):
+        """Each event's index in every bucket it overlaps (CSR: _bucket_events, _bucket_offsets)."""
+        self._bucket_seconds = bucket_seconds
+        ends = self.onsets + self.durations
+        first = np.floor(self.onsets/bucket_seconds).astype(np.int64)
+        last = np.maximum(np.ceil(ends/bucket_seconds).astype(np.int64) - 1, first)
+        self._first_bucket = int(first.min()) if len(self) else 0
+        num_buckets = int(last.max()) - self._first_bucket + 1 if len(self) else 0
+
+        # Event i is in buckets first[i] .. last[i]; events stay in onset order within each bucket.
+        counts = last - first + 1
+        events = np.repeat(np.arange(len(self)), counts)
+        within = np.arange(len(events)) - np.repeat(np.cumsum(counts) - counts, counts)
+        buckets = np.repeat(first - self._first_bucket, counts) + within
+        order = np.argsort(buckets, kind='stable')
+        self._bucket_events = events[order]
+        self._bucket_offsets = np.zeros(num_buckets + 1, dtype=np.int64)
+        np.cumsum(np.bincount(buckets, minlength=num_buckets), out=self._bucket_offsets[1:])
+
+    def starting_between(self, t0, t1) -> slice:
+        """Events with onsets in [t0, t1), as a slice of the columns (binary search)."""
+        start, stop = np.searchsorted(self.onsets, [t0, t1], side='left')
+        return slice(int(start), int(stop))
+
+    def sounding_at(self, t) -> np.ndarray:
+        """Indices of the events sounding at time t [s] (onset <= t < onset + duration), in onset order."""
+        bucket = int(np.floor(t/self._bucket_seconds)) - self._first_bucket
+        if not 0 <= bucket < len(self._bucket_offsets) - 1:
+            return np.zeros(0, dtype=np.int64)
+        candidates = self._bucket_events[self._bucket_offsets[bucket]:self._bucket_offsets[bucket + 1]]
+        onsets = self.onsets[candidates]
+        sounding = (onsets <= t) & (t < onsets + self.durations[candidates])
+        return candidates[sounding]
+
+    def positions_at(self, t):
+        """(string, fret) of every event sounding at time t that has a position (for the renderers)."""
+        events = self.sounding_at(t)
+        events = events[self.strings[events] != NO_STRING]
+        return list(zip(self.strings[events].tolist(), self.frets[events].tolist()))
+
+    def midis_at(self, t) -> np.ndarray:
+        """MIDI note numbers of the events sounding at time t."""
+        return self.midis[self.sounding_at(t)]
+
+
+def random_timeline(num_events, seconds, seed=0):
+    """Random events (up to 2 s long, guitar positions) spread over the given length [s]."""
+    rng = np.random.default_rng(seed)
+    tuning = GuitarTuning()
+    strings = rng.integers(1, tuning.num_strings + 1, num_events)
+    frets = rng.integers(0, tuning.num_frets + 1, num_events)
+    return Timeline(
+        rng.uniform(0, seconds, num_events),
+        rng.uniform(0.05, 2, num_events),
+        tuning.positions_to_midis(np.stack([strings, frets], axis=1)),
+        strings,
+        frets,
+        rng.uniform(0.5, 1, num_events)
+    )
+
+
+def benchmark(song_seconds=(60, 600, 6000), notes_per_second=8, fps=30, num_frames=1800):
+    """Time to find the sounding notes per frame vs. scanning every event, for longer and longer songs.
+
+    The interval index should cost the same per frame however long the song.
+    """
+    print(f'{"song [s]":>9} {"events":>8} {"index [us/frame]":>17} {"scan [us/frame]":>16}')
+    for seconds in song_seconds:
+        timeline = random_timeline(int(seconds*notes_per_second), seconds)
+        times = (np.arange(num_frames)/fps).tolist()
+
+        start = perf_counter()
+        for t in times:
+            timeline.sounding_at(t)
+        index_seconds = perf_counter() - start
+
+        ends = timeline.onsets + timeline.durations
+        start = perf_counter()
+        for t in times:
+            np.flatnonzero((timeline.onsets <= t) & (t < ends))
+        scan_seconds = perf_counter() - start
+        print(f'{seconds:9d} {len(timeline):8d} {1e6*index_seconds/num_frames:17.1f} {1e6*scan_seconds/num_frames:16.1f}')
+
+
+def main():
+    benchmark()
+
+
+if __name__ == '__main__':
+    main()
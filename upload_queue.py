@@ -0,0 +1,400 @@
+"""
+upload_queue.py
+
+Upload a batch of videos to YouTube: several at once, each a resumable
+upload that picks up where it left off, even after the program is
+restarted.
+
+Speaks the resumable upload protocol directly (http.client, see
+fake_upload_server.py for the protocol), so it can be tried against the
+local stand-in server. For YouTube itself, pass an OAuth 2.0 access token
+with the youtube.upload scope (see youtube_upload.py).
+
+Each upload session URI is saved (UploadSessionStore, a JSON file) as soon as
+the session starts, with the file's size and modification time. After a
+crash or a restart, the server is asked how much it already has and the upload
+continues from there. Finished uploads are recorded with their video id and
+skipped.
+
+Chunk sizes are tuned as the upload goes: each chunk is sized to take about
+target_chunk_seconds at the throughput measured so far. This makes large
+chunks on a fast link (fewer requests) and small ones on a slow link (less
+to resend after an error). Sizes are multiples of 256 KiB, as the protocol
+requires, and are halved after an error.
+
+todo:
+Thumbnails and playlists (separate API calls once the video id is known).
+Refresh the access token during long batches.
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import glob
+import http.client
+import json
+import os
+import os.path
+import random
+import threading
+from time import perf_counter, sleep
+from typing import List, NamedTuple, Optional
+from urllib.parse import urlsplit
+
+youtube_upload_url = 'https://www.googleapis.com/upload/youtube/v3/videos?uploadType=resumable&part=snippet,status'
+sessions_path = os.path.join('data', 'upload_sessions.json')
+
+chunk_granularity = 256*1024  # The protocol wants chunks in multiples of this (except the last).
+min_chunk_size = chunk_granularity
+max_chunk_size = 64*1024*1024
+initial_chunk_size = 4*chunk_granularity
+target_chunk_seconds = 2.0
+
+# As youtube_upload.py: retry server errors and dropped connections, with exponential backoff.
+max_retries = 10
+retriable_status_codes = (500, 502, 503, 504)
+retriable_exceptions = (OSError, http.client.HTTPException)
+
+
+class UploadError(Exception):
+    pass
+
+
+class UploadReport(NamedTuple):
+    filepath: str
+    video_id: Optional[str]
+    size: int
+    resumed_from: int  # Bytes the server already had at the start (0 for a fresh upload).
+    bytes_sent: int
+    seconds: float
+    retries: int
+    error: Optional[str] = None
+
+    @property
+    def throughput(self) -> float:
+        """Bytes sent per second."""
+        return self.bytes_sent/self.seconds if self.seconds > 0 else 0.0
+
+    def __str__(self):
+        name = os.path.basename(self.filepath)
+        if self.error:
+            return f'{name}: FAILED after {self.bytes_sent/1e6:.1f} MB: {self.error}'
+        resumed = f', resumed at {self.resumed_from/1e6:.1f} MB' if self.resumed_from else ''
+        return f'{name}: {self.video_id}, {self.bytes_sent/1e6:.1f} MB in {self.seconds:.1f} s ({self.throughput/1e6:.2f} MB/s{resumed}, {self.retries} retries)'
+
+
+class UploadSessionStore:
+    """Upload session URIs and finished video ids by file, saved to JSON after every change (thread safe).
+
+    A saved session only applies to the file as it was (same size and
+    modification time): a re-rendered file starts a new upload.
+    """
+    def __init__(self, filepath=sessions_path):
+        self._filepath = filepath
+        self._lock = threading.Lock()
+        self._entries = {}
+        if os.path.exists(filepath):
+            with open(filepath) as file:
+                self._entries = json.load(file)
+
+    @staticmethod
+    def _key(filepath):
+        return os.path.abspath(filepath)
+
+    @staticmethod
+    def _stamp(filepath):
+        stat = os.stat(filepath)
+        return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+    def get(self, filepath) -> dict:
+        """Saved entry (session_uri and/or video_id) for the file as it is now, or an empty dict."""
+        with self._lock:
+            entry = self._entries.get(self._key(filepath), {})
+        if entry and all(entry.get(name) == value for name, value in self._stamp(filepath).items()):
+            return entry
+        return {}
+
+    def set(self, filepath, **values):
+        """Save values (session_uri, video_id) for the file; None removes a value."""
+        entry = dict(self.get(filepath), **self._stamp(filepath), **values)
+        entry = {name: value for name, value in entry.items() if value is not None}
+        with self._lock:
+            self._entries[self._key(filepath)] = entry
+            temporary_path = self._filepath + '.tmp'
+            folder = os.path.dirname(self._filepath)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            with open(temporary_path, 'w') as file:
+                json.dump(self._entries, file, indent=2)
+            os.replace(temporary_path, self._filepath)  # Never a half-written file, even if killed here.
+
+
+def tune_chunk_size(throughput, target_seconds=target_chunk_seconds):
+    """Chunk size [bytes] to take about target_seconds at throughput [bytes/s], in protocol units."""
+    size = int(throughput*target_seconds)//chunk_granularity*chunk_granularity
+    return min(max(size, min_chunk_size), max_chunk_size)
+
+
+def _connect(url):
+    parts = urlsplit(url)
+    connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+    return connection_class(parts.netloc, timeout=60)
+
+
+def _path(url):
+    parts = urlsplit(url)
+    return parts.path + (f'?{parts.query}' if parts.query else '')
+
+
+def _received_bytes(response):
+    """Bytes the server has, from the Range header of a 308 reply (none: 0)."""
+    byte_range = response.getheader('Range')
+    return int(byte_range.rsplit('-', 1)[1]) + 1 if byte_range else 0
+
+
+class ResumableUpload:
+    """One file's resumable upload (see module docstring); run() it."""
+    def __init__(self, filepath, metadata, store, endpoint=youtube_upload_url, access_token=None, content_type='video/*', max_retries=max_retries, backoff_seconds=1.0):
+        self.filepath = filepath
+        self.metadata = metadata
+        self.size = os.path.getsize(filepath)
+        self._store = store
+        self._endpoint = endpoint
+        self._access_token = access_token
+        self._content_type = content_type
+        self._max_retries = max_retries
+        self._backoff_seconds = backoff_seconds
+        self._connection = None
+        self._connection_url = None
+
+    def _headers(self, **headers):
+        if self._access_token:
+            headers['Authorization'] = f'Bearer {self._access_token}'
+        return headers
+
+    def _request(self, method, url, body=None, headers=None):
+        """Send a request on a connection kept open between chunks; return (response, body)."""
+        if (self._connection is None) or (self._connection_url != urlsplit(url).netloc):
+            self.close()
+            self._connection = _connect(url)
+            self._connection_url = urlsplit(url).netloc
+        try:
+            self._connection.request(method, _path(url), body=body, headers=headers or {})
+            response = self._connection.getresponse()
+            return response, response.read()
+        except retriable_exceptions:
+            self.close()  # Start a fresh connection on the retry.
+            raise
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def _start_session(self):
+        body = json.dumps(self.metadata).encode()
+        headers = self._headers(**{
+            'Content-Type': 'application/json; charset=UTF-8',
+            'X-Upload-Content-Length': str(self.size),
+            'X-Upload-Content-Type': self._content_type,
+        })
+        response, content = self._request('POST', self._endpoint, body, headers)
+        if response.status in retriable_status_codes:
+            raise http.client.HTTPException(f'HTTP {response.status} starting the session')
+        if response.status != 200:
+            raise UploadError(f'HTTP {response.status} starting the session: {content[:200]!r}')
+        session_uri = response.getheader('Location')
+        self._store.set(self.filepath, session_uri=session_uri)
+        return session_uri
+
+    def _put(self, session_uri, offset, chunk):
+        """Send a chunk at offset (or, chunk None, ask for the status); return (bytes received, resource or None)."""
+        if chunk is None:
+            headers = self._headers(**{'Content-Range': f'bytes */{self.size}', 'Content-Length': '0'})
+        else:
+            headers = self._headers(**{'Content-Range': f'bytes {offset}-{offset + len(chunk) - 1}/{self.size}'})
+        response, content = self._request('PUT', session_uri, chunk, headers)
+        if response.status in (200, 201):
+            try:
+                resource = json.loads(content)
+            except ValueError:
+                raise UploadError(f'HTTP {response.status} with a body that is not JSON: {content[:200]!r}') from None
+            return self.size, resource
+        if response.status == 308:
+            return _received_bytes(response), None
+        if response.status in (404, 410):
+            return None, None  # Session expired: start again.
+        if response.status in retriable_status_codes:
+            raise http.client.HTTPException(f'HTTP {response.status}')
+        raise UploadError(f'HTTP {response.status}: {content[:200]!r}')
+
+    def run(self) -> UploadReport:
+        """Upload the file (or finish it), retrying with backoff; return a report (error set if it gave up)."""
+        start = perf_counter()
+        if self.size == 0:  # No Content-Range can describe an empty chunk, and there is no empty video.
+            return UploadReport(self.filepath, None, 0, 0, 0, 0.0, 0, 'Empty file: nothing to upload.')
+        saved = self._store.get(self.filepath)
+        if 'video_id' in saved:
+            return UploadReport(self.filepath, saved['video_id'], self.size, self.size, 0, 0.0, 0)
+
+        session_uri = saved.get('session_uri')
+        offset = None  # Unknown until the server is asked (or the session is new).
+        resumed_from = 0
+        bytes_sent = 0
+        retries = 0
+        chunk_size = initial_chunk_size
+        resource = None
+        try:
+            with open(self.filepath, 'rb') as file:
+                while resource is None:
+                    try:
+                        if session_uri is None:
+                            session_uri = self._start_session()
+                            offset = 0
+                        elif offset is None:
+                            offset, resource = self._put(session_uri, 0, None)
+                            if offset is None:
+                                session_uri = None
+                                self._store.set(self.filepath, session_uri=None)
+                                continue
+                            if bytes_sent == 0:
+                                resumed_from = offset
+                            continue
+
+                        file.seek(offset)
+                        chunk = file.read(chunk_size)
+                        chunk_start = perf_counter()
+                        received, resource = self._put(session_uri, offset, chunk)
+                        if received is None:
+                            session_uri, offset = None, None
+                            self._store.set(self.filepath, session_uri=None)
+                            continue
+                        bytes_sent += received - offset
+                        offset = received
+                        chunk_size = tune_chunk_size(len(chunk)/max(perf_counter() - chunk_start, 1e-6))
+                    except retriable_exceptions as error:
+                        retries += 1
+                        if retries > self._max_retries:
+                            raise UploadError(f'Gave up after {self._max_retries} retries: {error}') from error
+                        offset = None  # Ask the server what arrived before sending more.
+                        chunk_size = max(chunk_size//2//chunk_granularity*chunk_granularity, min_chunk_size)
+                        sleep(random.random()*self._backoff_seconds*2**min(retries, 6))
+        except UploadError as error:
+            return UploadReport(self.filepath, None, self.size, resumed_from, bytes_sent, perf_counter() - start, retries, str(error))
+        finally:
+            self.close()
+
+        if not isinstance(resource, dict) or ('id' not in resource):
+            return UploadReport(self.filepath, None, self.size, resumed_from, bytes_sent, perf_counter() - start, retries, f'Unexpected response: {resource}')
+        self._store.set(self.filepath, video_id=resource['id'], session_uri=None)
+        return UploadReport(self.filepath, resource['id'], self.size, resumed_from, bytes_sent, perf_counter() - start, retries)
+
+
+def video_metadata(filepath, privacy_status='private', category='22', keywords=('guitar',)):
+    """YouTube video resource (snippet and status) titled after the file name."""
+    title = os.path.splitext(os.path.basename(filepath))[0]
+    return {
+        'snippet': {'title': title, 'description': title, 'tags': list(keywords), 'categoryId': category},
+        'status': {'privacyStatus': privacy_status},
+    }
+
+
+class UploadQueue:
+    """Files to upload, run max_concurrent at a time (threads: uploads wait on the network, not the CPU)."""
+    def __init__(self, endpoint=youtube_upload_url, access_token=None, max_concurrent=4, store=None, max_retries=max_retries, backoff_seconds=1.0):
+        self._endpoint = endpoint
+        self._access_token = access_token
+        self._max_concurrent = max_concurrent
+        self._store = UploadSessionStore() if store is None else store
+        self._max_retries = max_retries
+        self._backoff_seconds = backoff_seconds
+        self._uploads = []
+
+    def add(self, filepath, metadata=None):
+        if metadata is None:
+            metadata = video_metadata(filepath)
+        self._uploads.append(ResumableUpload(filepath, metadata, self._store, self._endpoint, self._access_token, max_retries=self._max_retries, backoff_seconds=self._backoff_seconds))
+
+    def run(self) -> List[UploadReport]:
+        """Upload everything queued, printing each report as it finishes; return them in completion order."""
+        reports = []
+        with ThreadPoolExecutor(max_workers=self._max_concurrent) as executor:
+            futures = [executor.submit(upload.run) for upload in self._uploads]
+            for i, future in enumerate(as_completed(futures)):
+                report = future.result()
+                reports.append(report)
+                print(f'[{i + 1}/{len(futures)}] {report}')
+        self._uploads = []
+        return reports
+
+
+def print_summary(reports, seconds):
+    sent = sum(report.bytes_sent for report in reports)
+    failures = sum(1 for report in reports if report.error)
+    print(f'{len(reports) - failures} uploaded, {failures} failed: {sent/1e6:.1f} MB in {seconds:.1f} s ({sent/1e6/seconds:.2f} MB/s overall)')
+
+
+def demo(num_files=6, file_size=3_000_000, max_concurrent=3, folder=os.path.join('data', 'upload-demo')):
+    """Upload made-up files to the local fake server: interrupted part way (server offline), then resumed.
+
+    The second queue is built from scratch (as after a restart) and only has
+    the session store to go on.
+    """
+    from fake_upload_server import serve_in_thread
+
+    os.makedirs(folder, exist_ok=True)
+    filepaths = []
+    for i in range(num_files):
+        filepath = os.path.join(folder, f'video-{i}.mp4')
+        with open(filepath, 'wb') as file:
+            file.write(os.urandom(file_size))
+        filepaths.append(filepath)
+    store_path = os.path.join(folder, 'upload_sessions.json')
+    if os.path.exists(store_path):
+        os.remove(store_path)
+
+    server = serve_in_thread(failure_rate=0.05, offline_after_chunks=num_files + 1)
+    try:
+        print('First run (the server goes offline part way):')
+        queue = UploadQueue(server.url, max_concurrent=max_concurrent, store=UploadSessionStore(store_path), max_retries=3, backoff_seconds=0.01)
+        for filepath in filepaths:
+            queue.add(filepath)
+        start = perf_counter()
+        print_summary(queue.run(), perf_counter() - start)
+
+        print('Second run (a new queue, resuming from the saved sessions):')
+        server.offline = False
+        queue = UploadQueue(server.url, max_concurrent=max_concurrent, store=UploadSessionStore(store_path), max_retries=3, backoff_seconds=0.01)
+        for filepath in filepaths:
+            queue.add(filepath)
+        start = perf_counter()
+        print_summary(queue.run(), perf_counter() - start)
+    finally:
+        server.shutdown()
+
+    uploaded = server.uploaded()
+    intact = sum(1 for filepath in filepaths if open(filepath, 'rb').read() in uploaded.values())
+    print(f'{intact}/{num_files} files on the server intact ({server.chunks_received} chunks received).')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Upload every video in a folder to YouTube (resumable, several at once).')
+    parser.add_argument('folder', nargs='?', help='Folder of videos (.mp4, .webm); omit to run the demo against a local fake server')
+    parser.add_argument('--access-token', default=os.environ.get('YOUTUBE_ACCESS_TOKEN'), help='OAuth 2.0 access token (default: $YOUTUBE_ACCESS_TOKEN)')
+    parser.add_argument('--endpoint', default=youtube_upload_url)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--privacy-status', choices=('public', 'private', 'unlisted'), default='private')
+    args = parser.parse_args()
+
+    if args.folder is None:
+        demo()
+        return
+    queue = UploadQueue(args.endpoint, args.access_token, args.concurrency)
+    filepaths = sorted(glob.glob(os.path.join(args.folder, '*.mp4')) + glob.glob(os.path.join(args.folder, '*.webm')))
+    for filepath in filepaths:
+        queue.add(filepath, video_metadata(filepath, args.privacy_status))
+    start = perf_counter()
+    print_summary(queue.run(), perf_counter() - start)
+
+
+if __name__ == '__main__':
+    main()
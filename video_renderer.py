@@ -0,0 +1,167 @@
+"""
+video_renderer.py
+
+Render a timeline (see timeline.py) to video at a fixed frame rate, with its
+audio, in one ffmpeg pass.
+
+Frame i shows the notes sounding at i/fps. A frame is only looked up when a
+note starts or stops since the previous frame (found for every frame at once
+by binary search on the timeline's onsets and ends); otherwise the previous
+frame is sent again as it is. Raw RGBA frames are piped to ffmpeg straight
+from the renderer's arrays (no PNG or GIF, and no copy: see frame_buffer.py),
+and the audio, rendered from the same timeline, is muxed in as they are
+encoded: every onset is placed at its exact sample, and shown from the first
+frame at or after it.
+
+todo:
+Effects between onsets (e.g. fade markers out over a note's duration):
+    would need frames rendered whenever the effect changes, not only at
+    onsets and ends.
+"""
+
+import os
+import os.path
+from time import perf_counter
+from typing import NamedTuple
+
+import numpy as np
+
+from audio_stream import stream_to_wav
+from chroma import Chroma
+from frame_buffer import copies
+from frame_writer import FrameWriter
+from generate_audio import fs, timeline_to_blocks
+from neck_renderer import NeckRenderer
+from profiling import span, traced
+from scales import ScaleType, append_reversed_sequence, scale_box_positions
+from timeline import Timeline
+
+folder = 'data'
+
+
+class VideoRenderReport(NamedTuple):
+    filename: str
+    num_frames: int
+    frames_looked_up: int  # Frames where a note started or stopped (the rest repeat the previous frame).
+    video_seconds: float
+    render_seconds: float
+    bytes_copied: int  # Pixel data copied on the way to the encoder (frame_buffer.copies).
+
+    @property
+    def realtime_factor(self):
+        """Seconds of video per second of rendering."""
+        return self.video_seconds/self.render_seconds if self.render_seconds > 0 else float('inf')
+
+    @property
+    def bytes_copied_per_frame(self):
+        return self.bytes_copied/self.num_frames if self.num_frames > 0 else 0.0
+
+    def __str__(self):
+        return (
+            f'{self.filename}: {self.num_frames} frames ({self.frames_looked_up} looked up), '
+            f'{self.video_seconds:.1f} s of video in {self.render_seconds:.2f} s ({self.realtime_factor:.1f}x real time), '
+            f'{self.bytes_copied_per_frame:.0f} bytes copied per frame'
+        )
+
+
+def get_num_frames(timeline, fps):
+    """Frames to cover the whole timeline (the last may run past its end)."""
+    return int(np.ceil(timeline.end*fps))
+
+
+def get_changed_frames(timeline, fps, num_frames):
+    """Whether each frame can differ from the previous one: a note started or stopped in between."""
+    boundaries = np.unique(np.concatenate([timeline.onsets, timeline.onsets + timeline.durations]))
+    times = np.arange(num_frames)/fps
+    boundaries_passed = np.searchsorted(boundaries, times, side='right')
+    changed = np.ones(num_frames, dtype=bool)
+    changed[1:] = np.diff(boundaries_passed) > 0
+    return changed
+
+
+class NeckFrames:
+    """Frames of a timeline on the neck alone (NeckRenderer): the default for render_video.
+
+    Frame sources have two methods: state_at(t), what the frame at time t
+    shows (hashable, equal for identical frames), and render(state), its
+    FrameBuffer (see layout.LayoutFrames for another).
+    """
+    def __init__(self, timeline, neck_renderer=None):
+        self._timeline = timeline
+        self._neck_renderer = NeckRenderer() if neck_renderer is None else neck_renderer
+
+    def state_at(self, t):
+        return frozenset(self._timeline.positions_at(t))
+
+    def render(self, state):
+        return self._neck_renderer.get_buffer(state)
+
+
+@traced()
+def render_video(timeline, filename, fps=30, neck_renderer=None, audio=True, frames=None, click_track=None, **audio_kwargs):
+    """Render timeline to a video file (.mp4 or .webm) in folder; return a VideoRenderReport.
+
+    frames is the frame source (default NeckFrames with neck_renderer).
+    With audio, the audio is rendered from the same timeline (see
+    generate_audio.timeline_to_blocks, which takes audio_kwargs) to a
+    temporary WAV file, muxed in, then deleted. A click_track
+    (metronome.ClickTrack) is mixed into it block by block.
+    """
+    start = perf_counter()
+    bytes_copied = copies.bytes_copied
+    if frames is None:
+        frames = NeckFrames(timeline, neck_renderer)
+    filepath = os.path.join(folder, filename)
+    num_frames = get_num_frames(timeline, fps)
+    changed = get_changed_frames(timeline, fps, num_frames)
+
+    audio_path = None
+    if audio:
+        audio_path = filepath + '.wav'
+        with span('audio') as stage:
+            blocks = timeline_to_blocks(timeline, **audio_kwargs)
+            if click_track is not None:
+                blocks = click_track.mix(blocks)
+            stage.count('samples', stream_to_wav(blocks, audio_path, fs))
+    try:
+        previous = None
+        with span('frames + encode') as stage, FrameWriter(filepath, fps, audio_path) as writer:
+            for i in range(num_frames):
+                if changed[i]:
+                    state = frames.state_at(i/fps)
+                    if state != previous:
+                        with span('render frame'):
+                            buffer = frames.render(state)
+                        writer.write(buffer)
+                        previous = state
+                        continue
+                writer.repeat()
+            stage.count('frames', num_frames)
+    finally:
+        if audio_path is not None:
+            os.remove(audio_path)
+
+    return VideoRenderReport(filename, num_frames, int(changed.sum()), num_frames/fps, perf_counter() - start, copies.bytes_copied - bytes_copied)
+
+
+def scale_timeline(scale_type, root, bpm, repeats=1):
+    """Timeline of a scale (box shape, ascending then descending) played repeats times at bpm."""
+    steps = append_reversed_sequence(scale_box_positions(scale_type, root))*repeats
+    onsets = 0.1 + np.arange(len(steps) + 1)*60/bpm
+    return Timeline.from_steps(steps, onsets)
+
+
+def benchmark(repeats=8, bpm=120):
+    """Encode speed vs. real time at 30 and 60 fps (minor pentatonic, repeated: about a minute)."""
+    timeline = scale_timeline(ScaleType.MINOR_PENTATONIC, Chroma.A, bpm, repeats)
+    for fps in [30, 60]:
+        report = render_video(timeline, f'benchmark-{fps}fps.mp4', fps)
+        print(report)
+
+
+def main():
+    benchmark()
+
+
+if __name__ == '__main__':
+    main()
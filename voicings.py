@@ -0,0 +1,340 @@
+"""
+voicings.py
+
+Find every playable voicing of a chord on a given tuning, and keep them in an
+on-disk index so they only ever have to be found once.
+
+A voicing is one fret per string (string 1 first, as in GuitarTuning), -1
+for a muted string: e.g. C major in standard tuning is (-1, 3, 2, 0, 1, 0),
+or 'x32010' as a chord string (see fretboard.chord_string_to_fretboard_positions).
+
+The search is depth first over the strings, trying only frets that give a
+chord tone, and abandons a partial voicing (branch and bound) as soon as it
+can no longer be playable: the frets span too far, more fingers are needed
+than a hand has, too few strings remain to sound every chord tone, etc.
+
+todo:
+Finger assignment per voicing (for chord diagrams).
+Inversions (root_in_bass=False finds them, but does not name them).
+Rank voicings by how common they are, not just by position.
+"""
+
+from enum import Enum
+import hashlib
+import json
+import os.path
+from time import perf_counter
+from typing import Dict, List, NamedTuple, Tuple
+
+import numpy as np
+
+from chroma import Chroma, chroma_list, chroma_to_index, len_chroma
+from fretboard import FretboardPosition
+from guitar_tuning import GuitarTuning
+from scales import major_third, minor_third, semitone, tone
+
+folder = os.path.join('data', 'voicings')
+
+MUTED = -1
+
+perfect_fifth = major_third + minor_third
+diminished_fifth = 2*minor_third
+augmented_fifth = 2*major_third
+perfect_fourth = 2*tone + semitone
+minor_seventh = perfect_fifth + minor_third
+major_seventh = perfect_fifth + major_third
+
+Voicing = Tuple[int, ...]
+
+
+class ChordQuality(Enum):
+    """Chord qualities: (symbol as in chord names, intervals from the root in semitones)."""
+    MAJOR = ('', (0, major_third, perfect_fifth))
+    MINOR = ('m', (0, minor_third, perfect_fifth))
+    POWER = ('5', (0, perfect_fifth))
+    DIMINISHED = ('dim', (0, minor_third, diminished_fifth))
+    AUGMENTED = ('aug', (0, major_third, augmented_fifth))
+    SUSPENDED_2 = ('sus2', (0, tone, perfect_fifth))
+    SUSPENDED_4 = ('sus4', (0, perfect_fourth, perfect_fifth))
+    DOMINANT_7 = ('7', (0, major_third, perfect_fifth, minor_seventh))
+    MAJOR_7 = ('maj7', (0, major_third, perfect_fifth, major_seventh))
+    MINOR_7 = ('m7', (0, minor_third, perfect_fifth, minor_seventh))
+    HALF_DIMINISHED = ('m7b5', (0, minor_third, diminished_fifth, minor_seventh))
+
+    @property
+    def symbol(self) -> str:
+        return self.value[0]
+
+    @property
+    def intervals(self) -> Tuple[int, ...]:
+        return self.value[1]
+
+
+symbol_to_quality = {quality.symbol: quality for quality in ChordQuality}
+
+
+class VoicingRules(NamedTuple):
+    """What counts as playable.
+
+    max_span: most frets between the lowest and highest fretted notes (3 is
+    four frets, one per finger). min_strings None means at least as many
+    strings as chord tones (and at least three).
+    """
+    max_span: int = 3
+    max_fingers: int = 4
+    min_strings: int = None
+    root_in_bass: bool = True
+    allow_inner_mutes: bool = False
+
+
+def parse_chord_name(name) -> Tuple[Chroma, ChordQuality]:
+    """Root and quality from a chord name, e.g. 'C', 'F#m', 'Bb7', 'Am7'."""
+    letter = name[:1].upper()
+    if letter not in 'ABCDEFG' or not letter:
+        raise ValueError(f'Chord name must start with a note letter: {name}')
+    root_index = chroma_to_index[Chroma[letter]]
+    symbol = name[1:]
+    if symbol[:1] == '#':
+        root_index, symbol = root_index + 1, symbol[1:]
+    elif symbol[:1] == 'b':
+        root_index, symbol = root_index - 1, symbol[1:]
+    if symbol not in symbol_to_quality:
+        raise ValueError(f'Unknown chord quality {symbol!r}: use one of {", ".join(repr(s) for s in symbol_to_quality)}.')
+    return chroma_list[root_index % len_chroma], symbol_to_quality[symbol]
+
+
+def voicing_to_string(voicing) -> str:
+    """Chord string, e.g. 'x32010' (frets separated by '-' if any is above 9)."""
+    frets = ['x' if fret == MUTED else str(fret) for fret in voicing]
+    separator = '-' if any(fret > 9 for fret in voicing) else ''
+    return separator.join(frets)
+
+
+def voicing_to_positions(voicing) -> List[FretboardPosition]:
+    """Positions of the strings played (open strings have fret 0)."""
+    return [FretboardPosition(string, fret) for string, fret in enumerate(voicing, start=1) if fret != MUTED]
+
+
+def _count_fingers(voicing):
+    """Fingers needed: one per fretted string, or a barre across the lowest fret.
+
+    A barre is only possible if no string above (higher in pitch than) the
+    first barred string is open.
+    """
+    fretted = [fret for fret in voicing if fret > 0]
+    if not fretted:
+        return 0
+    lowest = min(fretted)
+    at_lowest = fretted.count(lowest)
+    if at_lowest > 1:
+        first = voicing.index(lowest)
+        if 0 not in voicing[first:]:
+            return len(fretted) - at_lowest + 1
+    return len(fretted)
+
+
+def find_voicings(root, quality, tuning=None, rules=VoicingRules()) -> List[Voicing]:
+    """Every playable voicing of the chord, lowest on the neck first."""
+    voicings, _ = _search(root, quality, tuning, rules)
+    return voicings
+
+
+def _search(root, quality, tuning, rules):
+    """Branch and bound search: returns (voicings, number of partial voicings visited)."""
+    if tuning is None:
+        tuning = GuitarTuning()
+    num_strings = tuning.num_strings
+    tones = sorted(set(interval % len_chroma for interval in quality.intervals))
+    tone_bits = {interval: 1 << i for i, interval in enumerate(tones)}
+    all_tones = (1 << len(tones)) - 1
+    min_strings = rules.min_strings
+    if min_strings is None:
+        min_strings = max(3, len(tones))
+    min_strings = min(min_strings, num_strings)
+
+    # Chord tones on each string: (fret, bit of the tone it sounds), lowest fret first.
+    intervals = (tuning.midis - chroma_to_index[root]) % len_chroma
+    candidates = []
+    for string_intervals in intervals.tolist():
+        candidates.append([
+            (fret, tone_bits[interval])
+            for fret, interval in enumerate(string_intervals) if interval in tone_bits
+        ])
+
+    voicings = []
+    frets = [MUTED]*num_strings
+    visited = 0
+
+    def extend(string, covered, sounding, low, high, fret_set, muting):
+        nonlocal visited
+        visited += 1
+        remaining = num_strings - string
+        if string == num_strings or muting:
+            # Leaf (or only mutes can follow).
+            if covered == all_tones and sounding >= min_strings and _count_fingers(frets) <= rules.max_fingers:
+                voicings.append(tuple(frets))
+            return
+
+        # Bound: can the strings left still sound every missing tone, and enough strings?
+        if bin(all_tones & ~covered).count('1') > remaining or sounding + remaining < min_strings:
+            return
+
+        for fret, bit in candidates[string]:
+            if sounding == 0 and rules.root_in_bass and bit != tone_bits[0]:
+                continue
+            if fret > 0:
+                new_low, new_high = min(low, fret), max(high, fret)
+                if new_high - new_low > rules.max_span:
+                    if fret > new_low:
+                        break  # Frets only go up from here.
+                    continue
+                new_fret_set = fret_set | {fret}
+                if len(new_fret_set) > rules.max_fingers:
+                    continue  # Each distinct fret needs a finger (even with a barre).
+            else:
+                new_low, new_high, new_fret_set = low, high, fret_set
+            frets[string] = fret
+            extend(string + 1, covered | bit, sounding + 1, new_low, new_high, new_fret_set, False)
+        frets[string] = MUTED
+
+        # Mute this string: before the first sounding string any number may
+        # be muted; after it, only the rest of the strings (unless inner
+        # mutes are allowed).
+        if sounding == 0 or rules.allow_inner_mutes:
+            extend(string + 1, covered, sounding, low, high, fret_set, False)
+        else:
+            extend(string + 1, covered, sounding, low, high, fret_set, True)
+
+    extend(0, 0, 0, tuning.num_frets + 1, 0, frozenset(), False)
+    voicings.sort(key=_voicing_sort_key)
+    return voicings, visited
+
+
+def _voicing_sort_key(voicing):
+    fretted = [fret for fret in voicing if fret > 0]
+    position = min(fretted) if fretted else 0
+    return (position, max(fretted, default=0) - position, voicing.count(MUTED), voicing)
+
+
+def tuning_key(tuning) -> str:
+    """Name for a tuning in the index: open string MIDI numbers and number of frets."""
+    open_midis = '-'.join(str(midi) for midi in tuning.midis[:, 0].tolist())
+    return f'{open_midis}f{tuning.num_frets}'
+
+
+class VoicingIndex:
+    """Voicings keyed on (tuning, chord quality, root), stored on disk.
+
+    One JSON file per tuning (and set of rules) in folder, holding every
+    quality on every root. A tuning's file is built (all chords at once) the
+    first time any of its chords is looked up, then loaded from disk on
+    later runs: lookups are dict lookups.
+    """
+    def __init__(self, folder=folder, rules=VoicingRules()):
+        self._folder = folder
+        self._rules = rules
+        self._tunings: Dict[str, Dict[Tuple[str, str], List[Voicing]]] = {}
+
+    def get(self, root, quality, tuning=None) -> List[Voicing]:
+        """Voicings of the chord (lowest on the neck first)."""
+        if tuning is None:
+            tuning = GuitarTuning()
+        return self._get_tuning(tuning)[(quality.name, root.name)]
+
+    def get_by_name(self, name, tuning=None) -> List[Voicing]:
+        """Voicings of a chord given by name, e.g. 'Am7'."""
+        return self.get(*parse_chord_name(name), tuning)
+
+    def _get_tuning(self, tuning):
+        key = tuning_key(tuning)
+        if key not in self._tunings:
+            filepath = self._get_path(key)
+            if os.path.exists(filepath):
+                with open(filepath) as file:
+                    entries = json.load(file)['voicings']
+            else:
+                entries = self._build(tuning)
+                os.makedirs(self._folder, exist_ok=True)
+                with open(filepath, 'w') as file:
+                    json.dump({'tuning': key, 'rules': self._rules._asdict(), 'voicings': entries}, file)
+            self._tunings[key] = {
+                tuple(chord.split('/')): [tuple(voicing) for voicing in voicings]
+                for chord, voicings in entries.items()
+            }
+        return self._tunings[key]
+
+    def _build(self, tuning):
+        return {
+            f'{quality.name}/{root.name}': find_voicings(root, quality, tuning, self._rules)
+            for quality in ChordQuality
+            for root in Chroma
+        }
+
+    def _get_path(self, key):
+        rules = hashlib.sha1(repr(tuple(self._rules)).encode()).hexdigest()[:8]
+        return os.path.join(self._folder, f'voicings-{key}-{rules}.json')
+
+
+def chord_sequence(names, tuning=None, index=None, open_strings=True):
+    """One voicing per chord name, each as close on the neck as possible to the last.
+
+    Returns a sequence of lists of (string, fret) for the renderers (e.g.
+    animations.animate). The first chord gets its lowest voicing. With
+    open_strings False, only voicings without open strings are used (e.g.
+    for NeckRenderer, which cannot mark them yet).
+    """
+    if index is None:
+        index = VoicingIndex()
+    sequence = []
+    previous = None
+    for name in names:
+        voicings = index.get_by_name(name, tuning)
+        if not open_strings:
+            voicings = [voicing for voicing in voicings if 0 not in voicing]
+        if not voicings:
+            raise ValueError(f'No playable voicing of {name}.')
+        if previous is None:
+            voicing = voicings[0]
+        else:
+            voicing = min(voicings, key=lambda v: _voicing_distance(previous, v))
+        sequence.append([tuple(position) for position in voicing_to_positions(voicing)])
+        previous = voicing
+    return sequence
+
+
+def _voicing_distance(a, b):
+    """How far the hand moves between voicings: change in mean fretted fret."""
+    def centre(voicing):
+        fretted = [fret for fret in voicing if fret > 0]
+        return np.mean(fretted) if fretted else 0
+    return abs(centre(a) - centre(b))
+
+
+def benchmark():
+    """Branch and bound vs. brute force (every fret or mute on every string)."""
+    tuning = GuitarTuning()
+    brute_force = (tuning.num_frets + 2)**tuning.num_strings
+    total_visited = 0
+    total_voicings = 0
+    start = perf_counter()
+    for quality in ChordQuality:
+        for root in Chroma:
+            voicings, visited = _search(root, quality, tuning, VoicingRules())
+            total_visited += visited
+            total_voicings += len(voicings)
+    seconds = perf_counter() - start
+    num_chords = len(ChordQuality)*len(Chroma)
+    print(f'{num_chords} chords, {total_voicings} voicings in {seconds:.2f} s')
+    print(f'Partial voicings visited per chord: {total_visited/num_chords:.0f} (brute force: {brute_force} complete ones)')
+
+
+def main():
+    index = VoicingIndex()
+    for name in ['C', 'G', 'D', 'Am', 'E7', 'Bm7b5']:
+        voicings = index.get_by_name(name)
+        print(f'{name}: {len(voicings)} voicings, e.g. {", ".join(voicing_to_string(v) for v in voicings[:4])}')
+    benchmark()
+
+
+if __name__ == '__main__':
+    main()
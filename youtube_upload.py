@@ -4,6 +4,8 @@ Upload video to YouTube. Work in progress!
 Adapted from https://developers.google.com/youtube/v3/guides/uploading_a_video
 
 See youtube_upload.sh for example usage.
+For a batch of videos (several at once, resumed after a restart) see
+upload_queue.py.
 
 TODO:
 Too much hassle? Just copy to phone instead?! Or upload manually!